@@ -11,6 +11,12 @@ pdfjs.GlobalWorkerOptions.workerSrc = `${ORIGIN}/pdfjs/pdf.worker.min.js`;
 
 // 与后端保持一致
 const OCR_PARAMS = { dpi: 500, tile: 1400, overlap: 0.12 };
+const OCR_BASE = 'http://127.0.0.1:8000';
+const OCR_PAGE_WINDOW = 1; // 当前页前后各拉几页 OCR 结果（叠加框换算用）
+
+function ocrCacheUrl(name: string) {
+  return `${OCR_BASE}/ocr_cache?pdf_name=${encodeURIComponent(name)}&dpi=${OCR_PARAMS.dpi}&tile=${OCR_PARAMS.tile}&overlap=${OCR_PARAMS.overlap}`;
+}
 
 function normalize(s: string) {
   return (s || '').replace(/\s+/g, '').toLowerCase();
@@ -61,6 +67,8 @@ export default function Viewer() {
   // OCR / 搜索
   const [ocrPages, setOcrPages] = useState<any[] | null>(null);
   const [isOcrRunning, setIsOcrRunning] = useState(false);
+  const [ocrProgress, setOcrProgress] = useState<any | null>(null);
+  const [ocrPageCount, setOcrPageCount] = useState(0); // 后端已 OCR 的页数
   const [query, setQuery] = useState('');
   const [hits, setHits] = useState<any[]>([]);
   const [activeHitIdx, setActiveHitIdx] = useState(-1);
@@ -122,19 +130,17 @@ export default function Viewer() {
           const name = f.split('/').pop()!;
           setProxyUrl(`/api/proxy?f=${encodeURIComponent(name)}`);
 
-          // 恢复 OCR 缓存
+          // OCR 缓存只按需拉当前页附近（见下方 effect）；这里只探一下是否已 OCR
+          setOcrPages(null);
+          setOcrPageCount(0);
           try {
-            const OCR_BASE = 'http://127.0.0.1:8000';
-            const url = `${OCR_BASE}/ocr_cache?pdf_name=${encodeURIComponent(name)}&dpi=${OCR_PARAMS.dpi}&tile=${OCR_PARAMS.tile}&overlap=${OCR_PARAMS.overlap}`;
-            const rr = await fetch(url);
+            const rr = await fetch(`${ocrCacheUrl(name)}&pages=1`, { cache: 'no-cache' });
             if (mounted && rr.ok) {
-              const cached = await rr.json();
-              setOcrPages(cached);
-            } else {
-              setOcrPages(null);
+              setOcrPageCount(Number(rr.headers.get('X-Pages-Total') || 0));
+              mergeOcrPages(await rr.json());
             }
           } catch {
-            setOcrPages(null);
+            if (mounted) setOcrPages(null);
           }
         } else {
           setProxyUrl(null);
@@ -270,9 +276,9 @@ export default function Viewer() {
   };
 
   // OCR 像素 → 当前 canvas CSS
-  const mapBox = (page: number, box: { x: number; y: number; w: number; h: number }) => {
+  const mapBox = (page: number, box: { x: number; y: number; w: number; h: number }, dims?: { pw?: number; ph?: number }) => {
     const ocrMap = new Map((ocrPages || []).map((p: any) => [p.page, p]));
-    const ocr = ocrMap.get(page);
+    const ocr = dims?.pw && dims?.ph ? { w: dims.pw, h: dims.ph } : ocrMap.get(page);
     const css = pageCssSizeRef.current.get(page);
     if (!ocr || !css) {
       return { left: box.x, top: box.y, width: box.w, height: box.h };
@@ -282,29 +288,91 @@ export default function Viewer() {
     return { left: box.x * sx, top: box.y * sy, width: box.w * sx, height: box.h * sy };
   };
 
-  // 触发 OCR
+  // ocrPages 只留每页尺寸（叠加框换算用）；检索走后端 /search，不在浏览器里保存整本 hits
+  const mergeOcrPages = (pages: any[]) => {
+    if (!pages.length) return;
+    setOcrPages(prev => {
+      const map = new Map<number, any>();
+      (prev || []).forEach(p => map.set(p.page, p));
+      pages.forEach((p: any) => map.set(p.page, { page: p.page, w: p.w, h: p.h }));
+      return Array.from(map.values()).sort((a, b) => a.page - b.page);
+    });
+  };
+
+  // 翻页时补拉当前页附近的页尺寸（/ocr_cache 带 ETag，重复访问基本 304）
+  useEffect(() => {
+    if (!file || !ocrPageCount) return;
+    const have = new Set((ocrPages || []).map((p: any) => p.page));
+    const lo = Math.max(1, pageNumber - OCR_PAGE_WINDOW);
+    const hi = pageNumber + OCR_PAGE_WINDOW;
+    let missing = false;
+    for (let p = lo; p <= hi; p++) if (!have.has(p)) missing = true;
+    if (!missing) return;
+    let alive = true;
+    const name = file.split('/').pop()!;
+    fetch(`${ocrCacheUrl(name)}&from=${lo}&to=${hi}`, { cache: 'no-cache' })
+      .then((r) => (r.ok ? r.json() : []))
+      .then((pages) => { if (alive) mergeOcrPages(pages); })
+      .catch(() => {});
+    return () => { alive = false; };
+  }, [file, pageNumber, ocrPageCount]);
+
+  // 触发 OCR：流式提交（NDJSON），逐页推送进度，已完成的批即可检索
+
   const runOCR = async (force = false) => {
     if (!file) return;
     setIsOcrRunning(true);
+    setOcrProgress(null);
     try {
-      const OCR_BASE = 'http://127.0.0.1:8000';
       const base = typeof window !== 'undefined' ? window.location.origin : '';
       const url = base + (proxyUrl || file);
       const name = file.split('/').pop()!;
-      const body = { pdf_url: url, pdf_name: name, force, ...OCR_PARAMS };
+      const body = { pdf_url: url, pdf_name: name, force, stream: 'ndjson', ...OCR_PARAMS };
 
       const resp = await fetch(`${OCR_BASE}/ocr_pdf`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(body)
       });
-      const data = await resp.json();
-      setOcrPages(prev => {
-        const map = new Map<number, any>();
-        (prev || []).forEach(p => map.set(p.page, p));
-        (data || []).forEach((p: any) => map.set(p.page, p));
-        return Array.from(map.values()).sort((a, b) => a.page - b.page);
-      });
+      if (!resp.ok || !resp.body) throw new Error(`HTTP ${resp.status}`);
+
+      const reader = resp.body.getReader();
+      const decoder = new TextDecoder();
+      let buf = '';
+      let received = 0;
+      let summary: any = null;
+      for (;;) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buf += decoder.decode(value, { stream: true });
+        const lines = buf.split('\n');
+        buf = lines.pop() || '';
+        const pages: any[] = [];
+        for (const line of lines) {
+          if (!line.trim()) continue; // keepalive
+          const rec = JSON.parse(line);
+          if (rec.type === 'job') {
+            setOcrProgress({ ...rec, pages_received: received });
+          } else if (rec.type === 'summary') {
+            summary = rec;
+          } else {
+            pages.push(rec);
+          }
+        }
+        if (pages.length) {
+          received += pages.length;
+          mergeOcrPages(pages);
+          setOcrPageCount((n) => Math.max(n, received)); // 后端每批（10 页）更新一次检索索引
+          setOcrProgress((p: any) => (p ? { ...p, pages_received: received } : p));
+        }
+      }
+      if (summary) {
+        setOcrProgress(summary);
+        setOcrPageCount((summary.pages_done || 0) + (summary.pages_skipped || 0));
+      }
+      if (summary?.status === 'failed') {
+        alert(`OCR 失败：${summary.error || ''}`);
+      }
     } catch (e) {
       console.error(e);
       alert('OCR 服务请求失败，请确认 127.0.0.1:8000 正在运行');
@@ -313,6 +381,26 @@ export default function Viewer() {
     }
   };
 
+  const cancelOCR = async () => {
+    if (!ocrProgress?.job_id) return;
+    try {
+      await fetch(`${OCR_BASE}/ocr_jobs/${ocrProgress.job_id}/cancel`, { method: 'POST' });
+    } catch (e) {
+      console.warn('取消 OCR 失败：', e);
+    }
+  };
+
+  const fmtProgress = (j: any) => {
+    if (!j) return '';
+    if (j.pages_received != null) {
+      const all = (j.pages_total || 0) + (j.pages_skipped || 0);
+      return all ? ` ${j.pages_received}/${all}` : '';
+    }
+    if (!j.pages_total) return '';
+    const eta = j.eta_sec != null ? ` · 剩余约 ${Math.ceil(j.eta_sec / 60)} 分钟` : '';
+    return ` ${j.pages_done}/${j.pages_total}${eta}`;
+  };
+
   function rankHits(items: any[]) {
     return items.slice().sort((a, b) => (b.score || 0) - (a.score || 0));
   }
@@ -322,8 +410,8 @@ export default function Viewer() {
       setHits([]);
       return;
     }
-    if (useOCR && !ocrPages) {
-      alert('请先执行 OCR 或等待缓存加载');
+    if (useOCR && !ocrPageCount) {
+      alert('请先执行 OCR');
       return;
     }
 
@@ -333,7 +421,6 @@ export default function Viewer() {
 
     if (useLLM && file) {
       try {
-        const OCR_BASE = 'http://127.0.0.1:8000';
         const name = file.split('/').pop()!;
         const r = await fetch(`${OCR_BASE}/synonyms`, {
           method: 'POST',
@@ -355,39 +442,24 @@ export default function Viewer() {
     }
 
     const allHits: any[] = [];
-    if (useOCR && ocrPages) {
-      for (const p of ocrPages) {
-        const heights = p.hits.map((h: any) => h.box.h);
-        const sortedH = heights.slice().sort((a: number, b: number) => a - b);
-        const h90 = sortedH.length ? sortedH[Math.max(0, Math.floor(sortedH.length * 0.9) - 1)] : 0;
-
-        const rows: Record<string, number> = {};
-        p.hits.forEach((h: any) => {
-          const key = Math.round(h.box.y / 5);
-          rows[key] = (rows[key] || 0) + 1;
+    if (useOCR && file) {
+      try {
+        const name = file.split('/').pop()!;
+        const r = await fetch(`${OCR_BASE}/search`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ pdf_name: name, dpi: OCR_PARAMS.dpi, query: q, terms })
         });
-        const rowDensity = (y: number) => rows[Math.round(y / 5)] || 1;
-
-        p.hits.forEach((h: any, idx: number) => {
-          const txt = normalize(h.text);
-          if (!txt) return;
-          const include = terms.some((t) => txt.includes(t));
-          if (!include) return;
-
-          const isTitle = h.box.h >= h90;
-          const isTableish = rowDensity(h.box.y) >= 12;
-          const score = 1 + (isTableish ? 1 : 0) + (isTitle ? 3 : 0);
-
-          allHits.push({
-            page: p.page,
-            index: idx,
-            text: h.text,
-            score,
-            box: h.box,
-            source: 'ocr',
-            rawConf: h.conf
+        if (r.ok) {
+          const data = await r.json();
+          (data.hits || []).forEach((h: any) => {
+            allHits.push({ ...h, source: 'ocr', rawConf: h.conf });
           });
-        });
+        } else if (r.status === 404) {
+          alert('该文档尚未 OCR');
+        }
+      } catch (e) {
+        console.warn('检索失败：', e);
       }
     }
 
@@ -428,7 +500,6 @@ export default function Viewer() {
       setQaHits([]);
 
       const name = file.split('/').pop()!;
-      const OCR_BASE = 'http://127.0.0.1:8000';
       const r = await fetch(`${OCR_BASE}/qa`, {
         method: 'POST',
         headers: {'Content-Type':'application/json'},
@@ -508,12 +579,15 @@ export default function Viewer() {
     {useOCR ? (
       <div className="row" style={{ marginTop: 8, gap: 8, flexWrap: 'wrap' }}>
       <button className="btn" onClick={() => runOCR(false)} disabled={isOcrRunning}>
-      {isOcrRunning ? 'OCR 处理中…' : '执行 OCR（可用缓存）'}
+      {isOcrRunning ? `OCR 处理中…${fmtProgress(ocrProgress)}` : '执行 OCR（可用缓存）'}
       </button>
       <button className="btn" onClick={() => runOCR(true)} disabled={isOcrRunning}>
       清除并重建
       </button>
-      <span className="pill">{ocrPages ? `已索引 ${ocrPages.length} 页` : '未索引'}</span>
+      {isOcrRunning && ocrProgress?.job_id ? (
+        <button className="btn" onClick={cancelOCR}>取消</button>
+      ) : null}
+      <span className="pill">{ocrPageCount ? `已索引 ${ocrPageCount} 页` : '未索引'}</span>
       </div>
     ) : null}
 
@@ -529,7 +603,7 @@ export default function Viewer() {
     value={query}
     onChange={(e) => setQuery(e.target.value)}
     />
-    <button className="btn" onClick={performSearch} disabled={isIndexing || (useOCR && !ocrPages)}>
+    <button className="btn" onClick={performSearch} disabled={isIndexing || (useOCR && !ocrPageCount)}>
     {isIndexing ? '索引中…' : '查找'}
     </button>
     </div>
@@ -653,7 +727,7 @@ export default function Viewer() {
         .slice(0, 300)
         .map((h) => {
           const css = (h.source === 'ocr' || h.source === 'qa')
-          ? mapBox(h.page, h.box)
+          ? mapBox(h.page, h.box, h)
           : { left: h.box.x, top: h.box.y, width: h.box.w, height: h.box.h };
           return (
             <div
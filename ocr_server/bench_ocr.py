@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+OCR 流水线基准：在合成电路图（bench_synth）上跑 dpi / tile / overlap（/ adaptive）网格，输出可逐次对比的 JSON。
+
+每组参数在独立子进程里跑（峰值 RSS 互不影响；引擎加载与预热页单独计时，不计入吞吐）：
+  pages_per_sec     页吞吐
+  page_ms           每页耗时 p50 / p95 / max
+  tile_ms           每个实际 OCR 的块：渲染 + 检测耗时 p50 / p95 / max（识别是批量做的，另见 rec_ms_per_tile）
+  rec_ms_per_tile   批量识别总耗时 / 块数
+  stages_ms         各阶段总耗时（取自每页 JSON 的 timing：render / blank / detect / recognize / dedup …）
+  tiles             块统计合计（total / ocr / blank / no_raster / fine，mpx 为渲染的总像素，百万）
+  engine_rss_mb / peak_rss_mb   加载引擎后的 RSS / 子进程峰值 RSS
+  recall            标注文字召回：label（规范化后整条命中）/ char（字符级），以及按类别（label/pin/wire/rotated/table/title）
+micro 为几个热点函数的单次耗时（rotate_box_back / tile_is_blank / postprocess_hits / ocr_layout.analyze_hits）。
+
+用法（在 ocr_server/ 下）：
+  python bench_ocr.py --pages 4 --grid "dpi=300,500 tile=1000,1400 overlap=0.08,0.12" --out bench/run.json
+  python bench_ocr.py --pages 4 --out bench/new.json --compare bench/run.json   # 与上次结果逐组对比
+  python bench_ocr.py --grid "dpi=500 adaptive=0,1"                          # 整页分块 vs 粗到细
+  python bench_ocr.py --pdf some.pdf                                         # 真实文档（无标注时不算召回）
+"""
+import os, sys, json, time, hashlib, itertools, platform, random, subprocess, tempfile, unicodedata
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Dict, List
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+DEFAULT_GRID = "dpi=300,500 tile=1000,1400 overlap=0.08,0.12"
+
+# ---------------- 统计工具 ----------------
+def _pct(xs: List[float]) -> Dict[str, float]:
+    if not xs:
+        return {"n": 0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    a = np.asarray(xs, dtype=np.float64)
+    return {"n": int(len(a)), "p50": round(float(np.percentile(a, 50)), 2),
+            "p95": round(float(np.percentile(a, 95)), 2), "max": round(float(a.max()), 2)}
+
+def _norm(s: str) -> str:
+    return "".join(unicodedata.normalize("NFKC", s or "").split()).upper()
+
+def _peak_rss_mb() -> float:
+    try:
+        import resource
+        ru = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round((ru if sys.platform == "darwin" else ru * 1024) / 1048576, 1)
+    except Exception:
+        return 0.0
+
+# ---------------- 召回 ----------------
+def score_page(labels: List[Dict], hits: List[Dict], scale: float) -> List[Dict]:
+    """
+    每条标注：取与其外接框重叠（交集 ≥ 较小框面积的 30%）的 hit，按 (y, x) 拼接后比对；
+    整条包含即 label 命中，字符级按最长公共块计
+    """
+    if hits:
+        hb = np.array([[h["box"]["x"], h["box"]["y"], h["box"]["x"] + h["box"]["w"], h["box"]["y"] + h["box"]["h"]]
+                       for h in hits], dtype=np.float64) / scale
+    else:
+        hb = np.zeros((0, 4))
+    harea = np.maximum(1e-6, (hb[:, 2] - hb[:, 0]) * (hb[:, 3] - hb[:, 1]))
+    out = []
+    for lab in labels:
+        x0, y0, x1, y1 = lab["box"]
+        gt = _norm(lab["text"])
+        iw = np.clip(np.minimum(hb[:, 2], x1) - np.maximum(hb[:, 0], x0), 0, None)
+        ih = np.clip(np.minimum(hb[:, 3], y1) - np.maximum(hb[:, 1], y0), 0, None)
+        inter = iw * ih
+        near = np.nonzero(inter >= 0.3 * np.minimum(harea, max(1e-6, (x1 - x0) * (y1 - y0))))[0]
+        near = sorted(near.tolist(), key=lambda i: (hb[i, 1], hb[i, 0]))
+        got = "".join(_norm(hits[i]["text"]) for i in near)
+        chars = sum(b.size for b in SequenceMatcher(None, gt, got, autojunk=False).get_matching_blocks())
+        out.append({"kind": lab["kind"], "exact": bool(gt) and gt in got, "chars": chars, "len": len(gt)})
+    return out
+
+def summarize_recall(rows: List[Dict]) -> Dict:
+    def agg(rs):
+        n, total = len(rs), sum(r["len"] for r in rs)
+        return {"n": n, "label": round(sum(r["exact"] for r in rs) / n, 4) if n else 0.0,
+                "char": round(sum(r["chars"] for r in rs) / total, 4) if total else 0.0}
+    out = agg(rows)
+    out["by_kind"] = {k: agg([r for r in rows if r["kind"] == k]) for k in sorted({r["kind"] for r in rows})}
+    return out
+
+# ---------------- 单组参数（子进程里执行） ----------------
+class _TileTimer:
+    """包住 ocr_pipeline._add_tile（渲染 + 检测一块，粗图/细图都走它）记每块耗时；只在基准进程里安装"""
+    def __init__(self, op):
+        self.tile_ms: List[float] = []
+        add = op._add_tile
+
+        def _add_tile(*a, **k):
+            t = time.perf_counter()
+            out = add(*a, **k)
+            if out is not None:
+                self.tile_ms.append(1000 * (time.perf_counter() - t))
+            return out
+        op._add_tile = _add_tile
+
+def run_config(cfg: Dict) -> Dict:
+    import fitz
+    import ocr_pipeline as op
+    from mem_governor import rss_bytes
+    import bench_synth
+
+    t = time.perf_counter()
+    op.get_engine()
+    engine_s = time.perf_counter() - t
+    engine_rss = rss_bytes() / 1048576
+    timer = _TileTimer(op)
+
+    doc = fitz.open(cfg["pdf"])
+    n = min(cfg.get("pages") or doc.page_count, doc.page_count)
+    opts = {"text_layer": cfg.get("text_layer", False), "orientation": cfg.get("orientation", op.ORIENTATION_DEFAULT),
+            "dedup": cfg.get("dedup", True), "batch_pages": cfg.get("batch_pages", 1),
+            "adaptive": bool(cfg.get("adaptive", 0))}
+    dpi, tile, overlap = cfg["dpi"], cfg["tile"], cfg["overlap"]
+
+    # 预热：推理库首次调用有一次性开销，不计入
+    for _ in op.ocr_pages(doc, list(range(min(cfg.get("warmup", 1), n))), dpi, tile, overlap, **opts):
+        pass
+    timer.tile_ms.clear()
+
+    truth = bench_synth.load_truth(Path(cfg["pdf"]))
+    page_ms, rows, hits_n = [], [], 0
+    tiles = {"total": 0, "ocr": 0, "blank": 0, "no_raster": 0, "fine": 0, "mpx": 0.0}
+    stages: Dict[str, float] = {}
+    t0 = t = time.perf_counter()
+    for out in op.ocr_pages(doc, list(range(n)), dpi, tile, overlap, **opts):
+        now = time.perf_counter()
+        page_ms.append(1000 * (now - t))
+        hits_n += len(out["hits"])
+        for k in tiles:
+            tiles[k] += out["tiles"].get(k, 0)
+        for k, ms in (out.get("timing") or {}).items():
+            stages[k] = stages.get(k, 0.0) + ms
+        if truth is not None:
+            rows += score_page(truth["pages"][out["page"] - 1]["labels"], out["hits"], dpi / 72.0)
+        t = time.perf_counter()   # 打分不计入耗时
+        t0 += t - now
+    wall = time.perf_counter() - t0
+    doc.close()
+
+    res = {
+        "dpi": dpi, "tile": tile, "overlap": overlap, "adaptive": int(opts["adaptive"]), "pages": n,
+        "pages_per_sec": round(n / wall, 4) if wall > 0 else 0.0,
+        "wall_s": round(wall, 3),
+        "page_ms": _pct(page_ms),
+        "tile_ms": _pct(timer.tile_ms),
+        "rec_ms_per_tile": round(stages.get("recognize", 0.0) / max(1, tiles["ocr"]), 2),
+        "stages_ms": {k: round(v, 1) for k, v in sorted(stages.items())},
+        "tiles": dict(tiles, mpx=round(tiles["mpx"], 2)),
+        "hits": hits_n,
+        "engine_load_s": round(engine_s, 2),
+        "engine_rss_mb": round(engine_rss, 1),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    if truth is not None:
+        res["recall"] = summarize_recall(rows)
+    return res
+
+# ---------------- 微基准 ----------------
+def _timeit(fn, n: int) -> float:
+    t = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return round(1e6 * (time.perf_counter() - t) / n, 2)
+
+def micro(pdf: Path, dpi: int = 300) -> Dict:
+    """热点函数的单次耗时（微秒）；不加载 OCR 模型，但导入 ocr_pipeline 仍需装好 paddleocr"""
+    import fitz
+    import ocr_pipeline as op, ocr_layout
+    from ocr_postprocess import postprocess_hits
+    rnd = random.Random(0)
+    polys = [[[rnd.uniform(0, 1400), rnd.uniform(0, 1400)] for _ in range(4)] for _ in range(256)]
+    out = {}
+    for rot in (0, 90, 270):
+        it = itertools.cycle(polys)
+        out[f"rotate_box_back_{rot}_us"] = _timeit(lambda: op.rotate_box_back(next(it), rot, 1400, 1400, (100, 200)), 5000)
+
+    with fitz.open(str(pdf)) as doc:
+        page = doc[0]
+        s = dpi / 72.0
+        mtx = fitz.Matrix(s, s)
+        full = page.get_pixmap(matrix=mtx, clip=fitz.Rect(0, 0, 1400 / s, 1400 / s), colorspace=fitz.csGRAY, alpha=False)
+        out["tile_render_1400_ms"] = round(_timeit(
+            lambda: page.get_pixmap(matrix=mtx, clip=fitz.Rect(0, 0, 1400 / s, 1400 / s), colorspace=fitz.csGRAY, alpha=False), 10) / 1000, 2)
+        out["tile_is_blank_1400_us"] = _timeit(lambda: op.tile_is_blank(full), 50)
+
+    # 合成一页量级的 hit（含跨块重复）测后处理与版面分析
+    hits = []
+    for i in range(1500):
+        x, y = rnd.randint(0, 8000), rnd.randint(0, 5600)
+        h = {"text": f"C{rnd.randint(100, 999)}-{rnd.randint(1, 4)}", "conf": 0.9, "box": {"x": x, "y": y, "w": 80, "h": 16}}
+        hits.append(h)
+        if i % 10 == 0:
+            hits.append({"text": h["text"], "conf": 0.8, "box": {"x": x + 2, "y": y + 1, "w": 78, "h": 16}})
+    cuts = list(range(1232, 8000, 1232))
+    out["postprocess_hits_1650_ms"] = round(_timeit(lambda: postprocess_hits([dict(h) for h in hits], cuts, cuts), 5) / 1000, 2)
+    out["layout_analyze_1650_ms"] = round(_timeit(lambda: ocr_layout.analyze_hits(hits), 5) / 1000, 2)
+    return out
+
+# ---------------- 网格 / 汇总 / 对比 ----------------
+def parse_grid(spec: str) -> List[Dict]:
+    axes = {}
+    for part in spec.split():
+        k, _, vs = part.partition("=")
+        cast = float if k == "overlap" else int
+        axes[k] = [cast(v) for v in vs.split(",") if v]
+    for k, default in (("dpi", [500]), ("tile", [1400]), ("overlap", [0.12]), ("adaptive", [0])):
+        axes.setdefault(k, default)
+    return [{"dpi": d, "tile": t, "overlap": o, "adaptive": a}
+            for d, t, o, a in itertools.product(axes["dpi"], axes["tile"], axes["overlap"], axes["adaptive"])]
+
+def _meta(pdf: Path, args) -> Dict:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        rev = ""
+    try:
+        from ocr_pipeline import OCR_CACHE_VERSION
+    except Exception:
+        OCR_CACHE_VERSION = ""
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git": rev, "python": platform.python_version(), "platform": platform.platform(),
+        "cpus": os.cpu_count(), "ocr_version": OCR_CACHE_VERSION,
+        "pdf": str(pdf), "pdf_sha1": hashlib.sha1(pdf.read_bytes()).hexdigest(),
+        "pages": args.pages, "seed": args.seed, "scan_dpi": args.scan_dpi,
+        "env": {k: v for k, v in sorted(os.environ.items()) if k.startswith("OCR_") or k.endswith("_NUM_THREADS")},
+    }
+
+def _run_isolated(cfg: Dict) -> Dict:
+    p = subprocess.run([sys.executable, str(Path(__file__).resolve()), "--child", json.dumps(cfg)],
+                       cwd=HERE, capture_output=True, text=True)
+    lines = [ln for ln in p.stdout.splitlines() if ln.startswith("{")]
+    if p.returncode != 0 or not lines:
+        return {"dpi": cfg["dpi"], "tile": cfg["tile"], "overlap": cfg["overlap"], "adaptive": cfg["adaptive"],
+                "error": (p.stderr or p.stdout).strip().splitlines()[-5:]}
+    return json.loads(lines[-1])
+
+def _label(r: Dict) -> str:
+    return f"dpi={r['dpi']:<4} tile={r['tile']:<5} overlap={r['overlap']:<5} {'adaptive' if r.get('adaptive') else 'full    '}"
+
+def _row(r: Dict) -> str:
+    if "error" in r:
+        return f"{_label(r)} ERROR {r['error'][-1] if r['error'] else ''}"
+    rc = r.get("recall") or {}
+    return (f"{_label(r)} {r['pages_per_sec']:>7.3f} p/s  tile p50 {r['tile_ms']['p50']:>7.1f}ms p95 {r['tile_ms']['p95']:>7.1f}ms  "
+            f"{r['tiles']['ocr']:>4} tiles {r['tiles']['mpx']:>7.1f}MPx  "
+            f"rss {r['peak_rss_mb']:>7.1f}MB  recall {rc.get('label', 0):.3f}/{rc.get('char', 0):.3f}")
+
+def compare(cur: Dict, base: Dict) -> List[str]:
+    key = lambda r: (r["dpi"], r["tile"], r["overlap"], r.get("adaptive", 0))
+    old = {key(r): r for r in base.get("results", []) if "error" not in r}
+    out = []
+    for r in cur.get("results", []):
+        b = old.get(key(r))
+        if b is None or "error" in r:
+            continue
+        d_pps = 100 * (r["pages_per_sec"] / b["pages_per_sec"] - 1) if b["pages_per_sec"] else 0.0
+        d_rec = (r.get("recall") or {}).get("label", 0) - (b.get("recall") or {}).get("label", 0)
+        out.append(f"{_label(r)} p/s {d_pps:+6.1f}%  tile p50 {r['tile_ms']['p50'] - b['tile_ms']['p50']:+7.1f}ms  "
+                   f"rss {r['peak_rss_mb'] - b['peak_rss_mb']:+7.1f}MB  recall {d_rec:+.3f}")
+    return out
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="OCR 流水线基准（合成电路图 + dpi/tile/overlap 网格）")
+    ap.add_argument("--pdf", help="用已有 PDF（同名 .truth.json 存在时计算召回）；默认生成合成文档")
+    ap.add_argument("--pages", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--scan-dpi", type=int, default=0, help="合成文档栅格化为纯图片（模拟扫描件）")
+    ap.add_argument("--grid", default=DEFAULT_GRID, help=f'参数网格，默认 "{DEFAULT_GRID}"')
+    ap.add_argument("--orientation", default=None, help="auto / horizontal / dual（默认同流水线）")
+    ap.add_argument("--text-layer", action="store_true", help="启用文字层（默认关闭，全部走栅格 OCR）")
+    ap.add_argument("--batch-pages", type=int, default=1)
+    ap.add_argument("--warmup", type=int, default=1, help="每组计时前先跑几页预热")
+    ap.add_argument("--inproc", action="store_true", help="不起子进程（调试用；峰值 RSS 不再按组隔离）")
+    ap.add_argument("--no-micro", action="store_true")
+    ap.add_argument("--out", help="结果 JSON 路径（默认只打印）")
+    ap.add_argument("--compare", help="与之前的结果 JSON 对比")
+    ap.add_argument("--child", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(run_config(json.loads(args.child)), ensure_ascii=False))
+        return
+
+    import bench_synth
+    if args.pdf:
+        pdf = Path(args.pdf).resolve()
+    else:
+        pdf = Path(tempfile.gettempdir()) / f"bench_synth_s{args.seed}_p{args.pages}_d{args.scan_dpi}.pdf"
+        bench_synth.make_pdf(pdf, args.pages, args.seed, args.scan_dpi)
+
+    report = {"meta": _meta(pdf, args), "micro": {} if args.no_micro else micro(pdf), "results": []}
+    for cfg in parse_grid(args.grid):
+        cfg.update(pdf=str(pdf), pages=args.pages, warmup=args.warmup, text_layer=args.text_layer,
+                   batch_pages=args.batch_pages)
+        if args.orientation:
+            cfg["orientation"] = args.orientation
+        r = run_config(cfg) if args.inproc else _run_isolated(cfg)
+        report["results"].append(r)
+        print(_row(r), flush=True)
+
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=1), encoding="utf-8")
+        print(f"→ {args.out}")
+    if args.compare:
+        print(f"与 {args.compare} 对比：")
+        for line in compare(report, json.loads(Path(args.compare).read_text("utf-8"))):
+            print("  " + line)
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(HERE))
+    main()
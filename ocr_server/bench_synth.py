@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+合成电路图 PDF（基准测试用）：同一 seed 生成完全相同的文档与标注。
+
+每页（A3 横向）按 4×3 网格摆放内容，刻意留出空白格：
+  元件    方框 + 中文名称 + 连接器编号（C123-1），四边小字号针脚号（A12）
+  导线    元件之间的折线，水平段标线色/线径（0.5 R/B），竖直段标注旋转 90°
+  表格    针脚表（针脚 / 信号 / 线色 / 连接至），细网格线
+  标题栏  右下角大字号标题与图号
+标注（ground truth）与 PDF 一起写出：每条文字的内容、外接框（PDF 点）、旋转角、字号、类别。
+scan_dpi > 0 时把每页栅格化后另存为纯图片 PDF（模拟扫描件，没有文字层）。
+"""
+import json, random
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import fitz  # PyMuPDF
+
+PAGE_W, PAGE_H = 1191, 842          # A3 横向（点）
+GRID_COLS, GRID_ROWS = 4, 3
+BLANK_CELLS = 2                     # 每页留空的格数（检验空白块预筛）
+FONT = "china-s"                    # PyMuPDF 内置简体中文字体（含中文的文字）
+FONT_LATIN = "helv"                 # 纯 ASCII 的编号/线色用比例字体，更接近真实图纸
+
+_NAMES = ["加速踏板位置传感器", "发动机控制单元", "节气门执行器", "曲轴位置传感器", "凸轮轴位置传感器",
+          "喷油器", "点火线圈", "冷却液温度传感器", "进气压力传感器", "氧传感器", "燃油泵继电器",
+          "制动灯开关", "车身控制模块", "组合仪表", "起动继电器", "空调压缩机离合器"]
+_SIGNALS = ["供电", "接地", "信号", "5V参考", "CAN-H", "CAN-L", "屏蔽", "LIN", "唤醒", "PWM"]
+_COLORS = ["R", "B", "W", "G", "Y", "L", "Br", "O", "Gr", "P"]
+_ABBR = ["APS", "ECU", "ETC", "CKP", "CMP", "ECT", "MAP", "O2S", "BCM", "IPC"]
+
+def _font_for(text: str) -> str:
+    return FONT_LATIN if text.isascii() else FONT
+
+def _text_w(text: str, size: float) -> float:
+    # 与 insert_text 的排版一致（内置 CJK 字体里拉丁字符也按全角宽度排）
+    return fitz.get_text_length(text, fontname=_font_for(text), fontsize=size)
+
+class _Page:
+    def __init__(self, page: fitz.Page, rnd: random.Random):
+        self.page, self.rnd = page, rnd
+        self.truth: List[Dict] = []
+
+    def text(self, x: float, y: float, text: str, size: float, kind: str, rot: int = 0):
+        """(x, y) 为基线起点；rot=90 时文字自下而上"""
+        self.page.insert_text((x, y), text, fontname=_font_for(text), fontsize=size, rotate=rot)
+        w, asc, desc = _text_w(text, size), size, 0.2 * size
+        if rot == 90:
+            rect = (x - asc, y - w, x + desc, y)
+        else:
+            rect = (x, y - asc, x + w, y + desc)
+        self.truth.append({"text": text, "box": [round(v, 2) for v in rect], "rot": rot, "size": size, "kind": kind})
+
+    def line(self, a: Tuple[float, float], b: Tuple[float, float], width: float = 0.6):
+        self.page.draw_line(a, b, color=(0, 0, 0), width=width)
+
+def _connector(rnd: random.Random) -> str:
+    return f"C{rnd.randint(100, 999)}" + (f"-{rnd.randint(1, 4)}" if rnd.random() < 0.6 else "")
+
+def _pin(rnd: random.Random) -> str:
+    return f"{rnd.choice('ABCDEFGHJK')}{rnd.randint(1, 40)}"
+
+def _component(pg: _Page, x0: float, y0: float, cw: float, ch: float) -> List[Tuple[float, float]]:
+    """画一个元件，返回针脚端点（供导线连接）"""
+    rnd = pg.rnd
+    w, h = rnd.uniform(0.45, 0.7) * cw, rnd.uniform(0.35, 0.55) * ch
+    x, y = x0 + (cw - w) / 2, y0 + (ch - h) / 2
+    pg.page.draw_rect(fitz.Rect(x, y, x + w, y + h), color=(0, 0, 0), width=0.8)
+    name = rnd.choice(_NAMES)
+    size = rnd.choice([7, 8, 9])
+    pg.text(x + 4, y + h / 2, name, size, "label")
+    pg.text(x + 4, y + h / 2 + size + 3, rnd.choice(_ABBR), size - 1, "label")
+    pg.text(x, y - 4, _connector(rnd), 7, "label")
+    ends = []
+    n = rnd.randint(3, 7)
+    for k in range(n):
+        px = x + (k + 1) * w / (n + 1)
+        pg.line((px, y + h), (px, y + h + 10))
+        pg.text(px + 1.5, y + h - 3, _pin(rnd), rnd.choice([5, 5.5, 6]), "pin")
+        ends.append((px, y + h + 10))
+    return ends
+
+def _wires(pg: _Page, ends: List[Tuple[float, float]]):
+    rnd = pg.rnd
+    rnd.shuffle(ends)
+    for a, b in zip(ends[::2], ends[1::2]):
+        mid_y = max(a[1], b[1]) + rnd.uniform(8, 40)
+        pg.line(a, (a[0], mid_y)); pg.line((a[0], mid_y), (b[0], mid_y)); pg.line((b[0], mid_y), b)
+        label = f"{rnd.choice(['0.5', '0.75', '1.0', '1.5'])} {rnd.choice(_COLORS)}/{rnd.choice(_COLORS)}"
+        if abs(b[0] - a[0]) > _text_w(label, 5.5) + 10:
+            pg.text(min(a[0], b[0]) + 5, mid_y - 2, label, 5.5, "wire")
+        elif mid_y - a[1] > _text_w(label, 5.5) + 6:
+            pg.text(a[0] - 2, mid_y - 3, label, 5.5, "rotated", rot=90)
+
+def _table(pg: _Page, x0: float, y0: float, cw: float, ch: float):
+    rnd = pg.rnd
+    cols = ["针脚", "信号", "线色", "连接至"]
+    col_w = (cw - 20) / len(cols)
+    row_h = 11
+    n_rows = min(int((ch - 20) / row_h) - 1, 12)
+    x, y = x0 + 10, y0 + 10
+    for r in range(n_rows + 2):
+        pg.line((x, y + r * row_h), (x + col_w * len(cols), y + r * row_h), 0.4)
+    for c in range(len(cols) + 1):
+        pg.line((x + c * col_w, y), (x + c * col_w, y + (n_rows + 1) * row_h), 0.4)
+    for c, head in enumerate(cols):
+        pg.text(x + c * col_w + 3, y + row_h - 3, head, 7, "table")
+    for r in range(1, n_rows + 1):
+        cells = [_pin(rnd), rnd.choice(_SIGNALS), f"{rnd.choice(_COLORS)}/{rnd.choice(_COLORS)}", _connector(rnd)]
+        for c, cell in enumerate(cells):
+            pg.text(x + c * col_w + 3, y + (r + 1) * row_h - 3, cell, 6.5, "table")
+
+def _title_block(pg: _Page, page_no: int):
+    x, y = PAGE_W - 300, PAGE_H - 60
+    pg.page.draw_rect(fitz.Rect(x, y, PAGE_W - 20, PAGE_H - 20), color=(0, 0, 0), width=1)
+    pg.text(x + 8, y + 20, f"{pg.rnd.choice(_NAMES)}电路图", 14, "title")
+    pg.text(x + 8, y + 34, f"图号 EWD-{pg.rnd.randint(1000, 9999)}  第 {page_no} 页", 8, "title")
+
+def make_pdf(path: Path, pages: int = 4, seed: int = 0, scan_dpi: int = 0) -> Dict:
+    """
+    生成 path（PDF）与 path.with_suffix('.truth.json')（标注），返回标注。
+    标注格式：{seed, pages:[{page, w, h, labels:[{text, box:[x0,y0,x1,y1], rot, size, kind}]}]}，坐标为 PDF 点。
+    """
+    rnd = random.Random(seed)
+    doc = fitz.open()
+    truth = {"seed": seed, "scan_dpi": scan_dpi, "pages": []}
+    cw, ch = PAGE_W / GRID_COLS, (PAGE_H - 70) / GRID_ROWS
+    for k in range(pages):
+        pg = _Page(doc.new_page(width=PAGE_W, height=PAGE_H), rnd)
+        cells = [(c, r) for r in range(GRID_ROWS) for c in range(GRID_COLS)]
+        blank = set(rnd.sample(range(len(cells)), BLANK_CELLS))
+        table_at = rnd.choice([i for i in range(len(cells)) if i not in blank])
+        ends: List[Tuple[float, float]] = []
+        for i, (c, r) in enumerate(cells):
+            if i in blank:
+                continue
+            if i == table_at:
+                _table(pg, c * cw, r * ch, cw, ch)
+            else:
+                ends += _component(pg, c * cw, r * ch, cw, ch)
+        _wires(pg, ends)
+        _title_block(pg, k + 1)
+        truth["pages"].append({"page": k + 1, "w": PAGE_W, "h": PAGE_H, "labels": pg.truth})
+
+    if scan_dpi:
+        # 模拟扫描件：整页栅格化（灰度）后只留图片
+        scan = fitz.open()
+        for page in doc:
+            pix = page.get_pixmap(dpi=scan_dpi, colorspace=fitz.csGRAY, alpha=False)
+            scan.new_page(width=PAGE_W, height=PAGE_H).insert_image(fitz.Rect(0, 0, PAGE_W, PAGE_H), pixmap=pix)
+        doc.close()
+        doc = scan
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    doc.save(str(path), garbage=3, deflate=True)
+    doc.close()
+    path.with_suffix(".truth.json").write_text(json.dumps(truth, ensure_ascii=False), encoding="utf-8")
+    return truth
+
+def load_truth(pdf_path: Path) -> Optional[Dict]:
+    p = Path(pdf_path).with_suffix(".truth.json")
+    return json.loads(p.read_text("utf-8")) if p.exists() else None
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="生成合成电路图 PDF 与标注（*.truth.json）")
+    ap.add_argument("out", help="输出 PDF 路径")
+    ap.add_argument("--pages", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--scan-dpi", type=int, default=0, help="> 0 时栅格化为纯图片 PDF（模拟扫描件）")
+    args = ap.parse_args()
+    t = make_pdf(Path(args.out), args.pages, args.seed, args.scan_dpi)
+    print(f"{args.out}: {len(t['pages'])} 页, {sum(len(p['labels']) for p in t['pages'])} 条文字")
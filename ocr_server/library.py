@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+全库检索 / 问答：CACHE_DIR 下每个已 OCR（有列式整本）的文档是一个分片，分片索引就是该文档的 search_{dpi}.npz。
+
+- 分片登记：扫描 CACHE_DIR 的文档目录（目录列表变化或 OCR 完成时 refresh 后重扫），记文档名与所用 DPI
+- 检索：常驻线程池把查询扇出到各分片（各自 search_index.search），结果带 pdf_name，按分数合并取 top-k
+- 选文档（全库问答）：各分片按查询词的候选命中数打分 Σ idf × log(1 + 命中数)，idf 按“多少本里出现”算
+- 更新：分片内容的新鲜度仍由 search_index 按整本页摘要保证（OCR 每批都会增量更新）
+
+配置（环境变量）：
+  LIBRARY_WORKERS   扇出线程数（默认 8）
+  LIBRARY_QA_DOCS   全库问答最多取几本文档的上下文（默认 3）
+"""
+import os, math, time, threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import ocr_book, search_index
+
+_HERE = Path(__file__).resolve().parent
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", Path(os.environ.get("DATA_DIR", _HERE / "data")) / "cache")).resolve()
+LIBRARY_WORKERS = int(os.environ.get("LIBRARY_WORKERS", "8"))
+LIBRARY_QA_DOCS = int(os.environ.get("LIBRARY_QA_DOCS", "3"))
+DPI_DEFAULT = 500
+QA_MIN_RATIO = 0.3   # 全库问答：得分不到第一名这么多倍的文档不取（只沾到常见词）
+
+class Shard:
+    __slots__ = ("name", "root", "dpis")
+
+    def __init__(self, name: str, root: Path, dpis: List[int]):
+        self.name, self.root, self.dpis = name, root, dpis
+
+    def dpi(self, want: Optional[int] = None) -> int:
+        # 指定的 DPI 没做过就退到默认 DPI，再退到最高的那个
+        for d in (want, DPI_DEFAULT):
+            if d in self.dpis:
+                return d
+        return self.dpis[-1]
+
+_pool = ThreadPoolExecutor(max_workers=max(1, LIBRARY_WORKERS), thread_name_prefix="library")
+_shards: Optional[Dict[str, Shard]] = None
+_listing: Optional[Tuple[str, ...]] = None
+_lock = threading.Lock()
+
+def refresh():
+    """OCR 写完整本后调用：下次查询重扫分片（新文档、新 DPI 随之加入）"""
+    global _shards
+    with _lock:
+        _shards = None
+
+def shards(names: Optional[Iterable[str]] = None) -> List[Shard]:
+    """当前所有分片（names 给定时只取这些文档），按文档名排序"""
+    global _shards, _listing
+    listing = tuple(sorted(p.name for p in CACHE_DIR.iterdir() if p.is_dir() and not p.name.startswith("_"))) \
+        if CACHE_DIR.exists() else ()
+    with _lock:
+        if _shards is None or listing != _listing:
+            found = {}
+            for name in listing:
+                dpis = ocr_book.available_dpis(CACHE_DIR / name)
+                if dpis:
+                    found[name] = Shard(name, CACHE_DIR / name, dpis)
+            _shards, _listing = found, listing
+            # 扇出查询每次都会碰到所有分片：常驻的索引 / 整本句柄数至少要装得下它们
+            search_index.reserve(len(found))
+            ocr_book.reserve(len(found))
+        cur = _shards
+    if names is None:
+        return [cur[k] for k in sorted(cur)]
+    return [cur[k] for k in dict.fromkeys(names) if k in cur]
+
+def _fan_out(fn, items: List[Shard]) -> List:
+    # 单个分片出错（文件正被改写等）不影响其它分片：记为 None
+    def safe(sh):
+        try:
+            return fn(sh)
+        except Exception:
+            return None
+    return list(_pool.map(safe, items))
+
+# ---------------- 全库检索 ----------------
+def search(terms: List[str], dpi: Optional[int] = None, limit: int = 200,
+           names: Optional[Iterable[str]] = None) -> Dict:
+    """
+    terms 同 /search（查询词 + 同义词，任一命中即算）；每个分片取 limit 条，
+    合并后按 (分数降序, 文档名, 页, 序号) 取前 limit 条
+    """
+    t0 = time.perf_counter()
+    items = shards(names)
+    results = _fan_out(lambda sh: search_index.search(sh.root, sh.dpi(dpi), terms, limit=limit), items)
+    hits, docs = [], []
+    for sh, res in zip(items, results):
+        if not res or not res.get("indexed"):
+            continue
+        if res["total"]:
+            docs.append({"pdf_name": sh.name, "dpi": sh.dpi(dpi), "total": res["total"], "pages": res["pages"]})
+        hits.extend(dict(h, pdf_name=sh.name) for h in res["hits"])
+    hits.sort(key=lambda h: (-h["score"], h["pdf_name"], h["page"], h["index"]))
+    docs.sort(key=lambda d: (-d["total"], d["pdf_name"]))
+    return {"hits": hits[:limit], "total": sum(d["total"] for d in docs), "docs": docs,
+            "shards": len(items), "ms": round(1000 * (time.perf_counter() - t0), 1)}
+
+# ---------------- 全库问答：选文档 ----------------
+def rank_documents(tokens: List[str], dpi: Optional[int] = None, limit: int = LIBRARY_QA_DOCS,
+                   names: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+    """按查询词在各分片里的候选命中数给文档打分，返回 [(pdf_name, score)]；只含得分不低于第一名 QA_MIN_RATIO 倍的文档"""
+    items = shards(names)
+    tokens = [t for t in dict.fromkeys(tokens) if t]
+    if not items or not tokens:
+        return []
+    counts = _fan_out(lambda sh: search_index.term_counts(sh.root, sh.dpi(dpi), tokens), items)
+    rows = [(sh.name, c) for sh, c in zip(items, counts) if c]
+    n = len(rows)
+    df = [sum(1 for _, c in rows if c[j]) for j in range(len(tokens))]
+    idf = [math.log(1 + (n - d + 0.5) / (d + 0.5)) for d in df]
+    scored = [(name, sum(w * math.log1p(x) for w, x in zip(idf, c))) for name, c in rows]
+    scored = [(name, round(s, 4)) for name, s in scored if s > 0]
+    scored.sort(key=lambda x: (-x[1], x[0]))
+    return [(name, s) for name, s in scored[:limit] if s >= QA_MIN_RATIO * scored[0][1]]
+
+def stats() -> Dict:
+    items = shards()
+    out = []
+    for sh in items:
+        book = ocr_book.open_book(sh.root, sh.dpi())
+        out.append({"pdf_name": sh.name, "dpis": sh.dpis,
+                    "pages": book.n_pages if book is not None else 0,
+                    "hits": book.n_hits if book is not None else 0})
+    return {"shards": len(items), "workers": LIBRARY_WORKERS, "docs": out}
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 结果缓存（同义词 / QA 共用），单个 SQLite 文件：DATA_DIR/llm_cache.sqlite
+
+- 条目：key（kind:sha1(参数)）→ JSON 值，记创建/最近访问时间与字节数
+- 过期：创建后超过 LLM_CACHE_TTL_SEC 视为未命中并删除；写入时顺带批量清理
+- 容量：总字节超过 LLM_CACHE_MB 时按最近访问时间（LRU）删到 90%
+- 单飞：同一 key 的并发未命中只有一个线程请求上游，其余等它的结果（不落盘的失败也一并抛给等待者）
+- 统计：按 kind 的 hits / misses / shared（单飞搭车）/ errors，另有条目数、字节数、淘汰数
+
+配置（环境变量）：
+  LLM_CACHE_PATH      数据库路径（默认 DATA_DIR/llm_cache.sqlite）
+  LLM_CACHE_TTL_SEC   有效期（默认 7 天）
+  LLM_CACHE_MB        总大小上限（默认 64）
+"""
+import os, json, time, sqlite3, hashlib, threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+_HERE = Path(__file__).resolve().parent
+TTL_SEC = 7 * 24 * 3600   # 默认值；环境变量在 llm_cache() 首次建库时读（.env 可能晚于本模块导入才加载）
+MAX_MB = 64
+PURGE_EVERY = 64     # 每写这么多条清一次过期
+
+def make_key(kind: str, *parts: str) -> str:
+    h = hashlib.sha1("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f"{kind}:{h}"
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+class LLMCache:
+    def __init__(self, path: Path, ttl: int = TTL_SEC, max_bytes: int = MAX_MB * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL,"
+                         " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._flights_lock = threading.Lock()
+        self.bytes = int(self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0])
+        self.evictions = self.expired = 0
+        self._writes = 0
+        self._kinds: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, kind: str, field: str):
+        with self._lock:
+            c = self._kinds.setdefault(kind, {"hits": 0, "misses": 0, "shared": 0, "errors": 0})
+            c[field] += 1
+
+    # ---------------- 读写 ----------------
+    def get(self, key: str, count: bool = False) -> Optional[Any]:
+        """count=True 时计入该 kind 的 hits / misses（不经 get_or_compute 的直接查表用）"""
+        now = time.time()
+        value = None
+        with self._lock:
+            row = self._db.execute("SELECT value, size, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.bytes -= row[1]
+                self.expired += 1
+            elif row is not None:
+                self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+                value = json.loads(row[0])
+        if count:
+            self._count(key.split(":", 1)[0], "misses" if value is None else "hits")
+        return value
+
+    def put(self, key: str, value: Any, created: Optional[float] = None):
+        kind = key.split(":", 1)[0]
+        text = json.dumps(value, ensure_ascii=False)
+        size = len(text.encode("utf-8")) + len(key)
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO entries (key, kind, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, kind, text, size, created or now, now))
+            self.bytes += size - (old[0] if old else 0)
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._purge_expired(now)
+            if self.bytes > self.max_bytes:
+                self._evict()
+
+    def _purge_expired(self, now: float):
+        row = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE created < ?", (now - self.ttl,)).fetchone()
+        if row[0]:
+            self._db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+            self.expired += row[0]
+            self.bytes -= row[1]
+
+    def _evict(self):
+        # 按最近访问从旧到新删，直到降到上限的 90%（留余量，避免每次写都触发）
+        target = int(self.max_bytes * 0.9)
+        need = self.bytes - target
+        victims, freed = [], 0
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if freed >= need:
+                break
+            victims.append((key,))
+            freed += size
+        self._db.executemany("DELETE FROM entries WHERE key = ?", victims)
+        self.bytes -= freed
+        self.evictions += len(victims)
+
+    # ---------------- 单飞 ----------------
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """
+        命中直接返回；未命中时同 key 只调用一次 compute，结果写缓存并分给并发等待者。
+        compute 抛异常时不写缓存，异常原样抛给本次的所有调用方。
+        """
+        kind = key.split(":", 1)[0]
+        hit = self.get(key)
+        if hit is not None:
+            self._count(kind, "hits")
+            return hit
+        with self._flights_lock:
+            fl = self._flights.get(key)
+            leader = fl is None
+            if leader:
+                fl = self._flights[key] = _Flight()
+        if not leader:
+            fl.done.wait()
+            self._count(kind, "shared")
+            if fl.error is not None:
+                raise fl.error
+            return fl.value
+        try:
+            # 上一个同 key 的请求可能刚好在我们查缓存之后完成
+            hit = self.get(key)
+            if hit is not None:
+                self._count(kind, "hits")
+                fl.value = hit
+                return hit
+            self._count(kind, "misses")
+            fl.value = compute()
+            self.put(key, fl.value)
+            return fl.value
+        except BaseException as e:
+            fl.error = e
+            self._count(kind, "errors")
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(key, None)
+            fl.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n = int(self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0])
+            counts = {kind: dict(c) for kind, c in self._kinds.items()}
+        kinds = {}
+        for kind, c in counts.items():
+            total = c["hits"] + c["misses"] + c["shared"]
+            kinds[kind] = dict(c, hit_rate=round((c["hits"] + c["shared"]) / total, 3) if total else 0.0)
+        return {"entries": n, "mb": round(self.bytes / 1048576, 2), "max_mb": round(self.max_bytes / 1048576),
+                "ttl_sec": self.ttl, "evictions": self.evictions, "expired": self.expired,
+                "in_flight": len(self._flights), "kinds": kinds}
+
+    # ---------------- 旧缓存迁移 ----------------
+    def import_json_dir(self, root: Path, kind: str, flag: str) -> int:
+        """
+        一次性导入旧的“每条一个 JSON 文件”缓存：root/<分组>/<sha1>.json → key(kind, 分组, sha1)，
+        文件里的 _ts 作为创建时间。导入过（meta 里有 flag）就跳过。
+        """
+        root = Path(root)
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM meta WHERE name = ?", (flag,)).fetchone():
+                return 0
+            self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (flag, str(time.time())))
+        n = 0
+        for f in sorted(root.glob("*/*.json")) if root.exists() else []:
+            try:
+                obj = json.loads(f.read_text("utf-8"))
+            except (OSError, ValueError):
+                continue
+            ts = float(obj.pop("_ts", 0) or 0)
+            if time.time() - ts > self.ttl:
+                continue
+            self.put(make_key(kind, f.parent.name, f.stem), obj, created=ts)
+            n += 1
+        return n
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def llm_cache() -> LLMCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            path = os.environ.get("LLM_CACHE_PATH") or Path(os.environ.get("DATA_DIR", _HERE / "data")) / "llm_cache.sqlite"
+            ttl = int(os.environ.get("LLM_CACHE_TTL_SEC", str(TTL_SEC)))
+            max_mb = int(os.environ.get("LLM_CACHE_MB", str(MAX_MB)))
+            _cache = LLMCache(Path(path), ttl=ttl, max_bytes=max_mb * 1024 * 1024)
+        return _cache
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+共享的 LLM 调用层（同义词 / QA 共用一个客户端）。
+
+- 连接池：进程内只建一个 OpenAI 兼容客户端（底层 httpx 连接池 + keep-alive），不再每次握手 TLS
+- 并发上限：全局信号量限制同时在途的上游请求；排队超过 LLM_QUEUE_TIMEOUT_SEC 抛 LLMBusy
+- 截止时间：每次调用有总时限 LLM_TIMEOUT_SEC（含重试），每次尝试的超时取剩余时间
+- 重试：超时 / 连接错误 / 429 / 5xx 按指数退避 + 抖动重试，最多 LLM_MAX_RETRIES 次；其余错误直接抛
+- 地址可配：LLM_BASE_URL 可指向本地 mock 服务；设为 "stub" 时不发网络请求，返回固定 JSON（测试/压测用）
+
+配置（环境变量）：
+  LLM_BASE_URL           上游地址（默认 https://api.deepseek.com；stub = 内置桩）
+  LLM_API_KEY            密钥（默认取 OPENAI_API_KEY）
+  LLM_MODEL              模型（默认 deepseek-chat）
+  LLM_MAX_CONCURRENCY    同时在途的上游请求数（默认 4）
+  LLM_POOL_SIZE          HTTP 连接池大小（默认 16）
+  LLM_TIMEOUT_SEC        单次调用总时限，含重试（默认 60）
+  LLM_CONNECT_TIMEOUT_SEC 建连超时（默认 5）
+  LLM_MAX_RETRIES        最多重试次数（默认 2）
+  LLM_QUEUE_TIMEOUT_SEC  等并发名额的最长时间（默认 30）
+  LLM_STUB_LATENCY_MS    stub 模式的模拟延迟（默认 0）
+"""
+import os, json, time, random, threading
+from typing import Any, Dict, List, Optional
+import metrics
+
+BASE_URL = os.environ.get("LLM_BASE_URL", "https://api.deepseek.com")
+DEFAULT_MODEL = os.environ.get("LLM_MODEL", "deepseek-chat")
+MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", "16"))
+TIMEOUT_SEC = float(os.environ.get("LLM_TIMEOUT_SEC", "60"))
+CONNECT_TIMEOUT_SEC = float(os.environ.get("LLM_CONNECT_TIMEOUT_SEC", "5"))
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+QUEUE_TIMEOUT_SEC = float(os.environ.get("LLM_QUEUE_TIMEOUT_SEC", "30"))
+STUB_LATENCY_MS = int(os.environ.get("LLM_STUB_LATENCY_MS", "0"))
+BACKOFF_BASE = 0.5   # 第 n 次重试前等待 BACKOFF_BASE × 2^(n-1) 秒（±50% 抖动）
+
+# stub 的固定回复：同时带同义词与 QA 需要的字段
+STUB_REPLY = {"synonyms": [], "abbreviations": [], "english": [],
+              "answer": "stub", "pins": [], "pages": [], "evidence": [], "confidence": 0.0}
+
+class LLMBusy(RuntimeError):
+    """并发名额排队超时（上游变慢时不再无限堆积请求）"""
+
+class LLMUnavailable(RuntimeError):
+    """没有配置密钥/地址"""
+
+def _api_key() -> str:
+    return os.environ.get("LLM_API_KEY") or os.environ.get("OPENAI_API_KEY", "")
+
+def is_stub() -> bool:
+    return BASE_URL.strip().lower() == "stub"
+
+def configured() -> bool:
+    return is_stub() or bool(_api_key())
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = self.ok = self.errors = self.retries = self.busy = 0
+        self.in_flight = self.waiting = 0
+        self.upstream_sec = 0.0
+        self.queue_sec = 0.0
+        self.prompt_tokens = self.completion_tokens = 0
+
+    def add(self, **kw):
+        with self.lock:
+            for k, v in kw.items():
+                setattr(self, k, getattr(self, k) + v)
+
+_stats = _Stats()
+UPSTREAM_SECONDS = metrics.histogram("llm_upstream_seconds", "LLM 单次上游尝试耗时（ok / error）", ("outcome",))
+QUEUE_SECONDS = metrics.histogram("llm_queue_seconds", "LLM 请求等并发名额的时间")
+_sem = threading.BoundedSemaphore(max(1, MAX_CONCURRENCY))
+_client = None
+_client_lock = threading.Lock()
+
+def client():
+    """进程内唯一的 OpenAI 兼容客户端；重试由 chat() 自己做（带总时限），SDK 内部不再重试"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            import httpx
+            from openai import OpenAI
+            http = httpx.Client(
+                limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE, keepalive_expiry=60),
+                timeout=httpx.Timeout(TIMEOUT_SEC, connect=CONNECT_TIMEOUT_SEC),
+            )
+            _client = OpenAI(api_key=_api_key(), base_url=BASE_URL, http_client=http, max_retries=0)
+        return _client
+
+def _retriable(e: BaseException) -> bool:
+    try:
+        import openai
+    except ImportError:
+        return False
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and getattr(e, "status_code", 0) >= 500
+
+def _stub(messages: List[Dict[str, str]]) -> str:
+    if STUB_LATENCY_MS:
+        time.sleep(STUB_LATENCY_MS / 1000)
+    return json.dumps(STUB_REPLY, ensure_ascii=False)
+
+def chat(messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.0,
+         json_mode: bool = False, timeout: Optional[float] = None) -> str:
+    """发一次对话补全，返回 message.content（可能为空串）。排队超时抛 LLMBusy，重试用尽抛最后一次的异常。"""
+    if not configured():
+        raise LLMUnavailable("missing LLM_API_KEY / OPENAI_API_KEY")
+    deadline = time.monotonic() + (timeout or TIMEOUT_SEC)
+    _stats.add(calls=1, waiting=1)
+    t0 = time.monotonic()
+    got = _sem.acquire(timeout=max(0.0, min(QUEUE_TIMEOUT_SEC, deadline - t0)))
+    _stats.add(waiting=-1, queue_sec=time.monotonic() - t0)
+    QUEUE_SECONDS.observe(time.monotonic() - t0)
+    if not got:
+        _stats.add(busy=1, errors=1)
+        raise LLMBusy("too many concurrent LLM requests")
+    _stats.add(in_flight=1)
+    try:
+        kw: Dict[str, Any] = {"model": model or DEFAULT_MODEL, "temperature": temperature, "messages": messages}
+        if json_mode:
+            kw["response_format"] = {"type": "json_object"}
+        attempt = 0
+        while True:
+            t1 = time.monotonic()
+            try:
+                if is_stub():
+                    out = _stub(messages)
+                else:
+                    resp = client().with_options(timeout=max(0.1, deadline - t1)).chat.completions.create(**kw)
+                    out = resp.choices[0].message.content or ""
+                    usage = getattr(resp, "usage", None)
+                    if usage is not None:
+                        _stats.add(prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                                   completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+                _stats.add(ok=1, upstream_sec=time.monotonic() - t1)
+                UPSTREAM_SECONDS.observe(time.monotonic() - t1, outcome="ok")
+                return out
+            except Exception as e:
+                _stats.add(upstream_sec=time.monotonic() - t1)
+                UPSTREAM_SECONDS.observe(time.monotonic() - t1, outcome="error")
+                wait = BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5)
+                if attempt >= MAX_RETRIES or not _retriable(e) or time.monotonic() + wait >= deadline:
+                    _stats.add(errors=1)
+                    raise
+                attempt += 1
+                _stats.add(retries=1)
+                time.sleep(wait)
+    finally:
+        _sem.release()
+        _stats.add(in_flight=-1)
+
+def stats() -> Dict[str, Any]:
+    s = _stats
+    with s.lock:
+        return {
+            "base_url": "stub" if is_stub() else BASE_URL,
+            "max_concurrency": MAX_CONCURRENCY,
+            "calls": s.calls, "ok": s.ok, "errors": s.errors, "retries": s.retries, "busy": s.busy,
+            "in_flight": s.in_flight, "waiting": s.waiting,
+            "avg_upstream_ms": round(1000 * s.upstream_sec / max(1, s.ok + s.errors - s.busy), 1),
+            "avg_queue_ms": round(1000 * s.queue_sec / max(1, s.calls), 1),
+            "prompt_tokens": s.prompt_tokens, "completion_tokens": s.completion_tokens,
+        }
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
-import os, re, json
+import os, re, json, time, hashlib, threading, unicodedata
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 from dotenv import load_dotenv
+import numpy as np
+import ocr_book, ocr_layout, qa_index, library, metrics
+from llm_cache import llm_cache, make_key
 
 # ------- 环境加载 -------
 def _load_env_safely():
@@ -16,16 +20,21 @@ def _load_env_safely():
     os.environ.setdefault("CACHE_DIR", str(Path(os.environ.get("DATA_DIR", here / "data")) / "cache"))
 
 _load_env_safely()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
+import llm_client
+if not llm_client.configured():
     raise RuntimeError("Missing OPENAI_API_KEY in .env")
 
-from openai import OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY, base_url="https://api.deepseek.com")
-QA_MODEL = "deepseek-chat"
+QA_MODEL = llm_client.DEFAULT_MODEL
 
 ROOT = Path(__file__).resolve().parent
 CACHE_DIR = Path(os.environ.get("CACHE_DIR", ROOT / "data" / "cache")).resolve()
+QA_DOC_CACHE_MB = int(os.environ.get("QA_DOC_CACHE_MB", "256"))  # 文档缓存上限（估算字节）
+QA_ANSWER_CACHE = os.environ.get("QA_ANSWER_CACHE", "1") != "0"   # 答案级缓存开关
+# 检索/上下文拼装逻辑改动时加一：旧的答案缓存随之作废
+RETRIEVAL_VERSION = 2
+QA_CONTEXT_TOKENS = int(os.environ.get("QA_CONTEXT_TOKENS", "2000"))   # 上下文的估算 token 预算
+MIN_SPAN_TOKENS = 8      # 剩余预算低于此值就不再尝试
+PAGE_HEAD_TOKENS = 6     # 每页的 "[Page N]" 标题
 
 # ------- 工具 -------
 def _norm_name(s: str) -> str:
@@ -34,14 +43,28 @@ def _norm_name(s: str) -> str:
 def _normalize(s: str) -> str:
     return re.sub(r"\s+", "", (s or "").lower())
 
-def _list_ocr_pages(pdf_name: str) -> Tuple[List[Dict[str, Any]], int]:
-    safe = _norm_name(pdf_name)
-    root = CACHE_DIR / safe
+def _question_key(q: str) -> str:
+    """答案缓存用的问题规范化：全半角统一、去空白、去句末标点（“A12 几号脚？”≡“a12几号脚”）"""
+    q = _normalize(unicodedata.normalize("NFKC", q or ""))
+    return re.sub(r"[?？。.!！~～]+$", "", q)
+
+def _source(root: Path) -> Optional[Tuple[str, int, Any]]:
+    """
+    定位某文档的 OCR 来源，只做 stat 不解析：
+      ("book", dpi, OcrBook) 或 ("json", dpi, [页文件…])；没有缓存返回 None
+    """
     if not root.exists():
-        return [], 0
+        return None
+    # 优先列式整本（mmap，不逐页解析 JSON）
+    dpis = ocr_book.available_dpis(root)
+    if dpis:
+        dpi_used = 500 if 500 in dpis else dpis[-1]
+        book = ocr_book.open_book(root, dpi_used)
+        if book is not None:
+            return "book", dpi_used, book
     cands = sorted(root.glob("page_*_*_rapidocr.json"))
     if not cands:
-        return [], 0
+        return None
     def parse_dpi(p: Path) -> int:
         stem = p.stem  # page_0001_500_rapidocr
         parts = stem.split("_")
@@ -50,8 +73,39 @@ def _list_ocr_pages(pdf_name: str) -> Tuple[List[Dict[str, Any]], int]:
     for j in cands:
         by_dpi.setdefault(parse_dpi(j), []).append(j)
     dpi_used = 500 if 500 in by_dpi else sorted(by_dpi.keys())[-1]
+    return "json", dpi_used, sorted(by_dpi[dpi_used])
+
+def _signature(src: Tuple[str, int, Any]) -> tuple:
+    # 整本：文件 mtime/大小（每次更新都重写）；页 JSON：逐文件 (名, mtime, 大小)
+    kind, dpi, obj = src
+    if kind == "book":
+        st = obj.path.stat()
+        return kind, dpi, st.st_mtime_ns, st.st_size
+    sig = []
+    for p in obj:
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        sig.append((p.name, st.st_mtime_ns, st.st_size))
+    return kind, dpi, tuple(sig)
+
+def _version(src: Tuple[str, int, Any], sig: tuple) -> str:
+    """文档内容版本：整本用内容 ETag（只随页内容变），页 JSON 用文件签名；重新 OCR 后随之改变"""
+    kind, dpi, obj = src
+    if kind == "book":
+        return f"book:{dpi}:{obj.etag()}"
+    return "json:" + hashlib.sha1(repr(sig).encode("utf-8")).hexdigest()
+
+def _load_pages(src: Tuple[str, int, Any]) -> List[Dict[str, Any]]:
+    kind, _, obj = src
+    if kind == "book":
+        pages = obj.pages(with_extras=False)
+        for p in pages:
+            p["layout"] = obj.page_layout(p["page"])
+        return pages
     pages = []
-    for jp in sorted(by_dpi[dpi_used]):
+    for jp in obj:
         try:
             obj = json.loads(jp.read_text("utf-8"))
             hits = obj.get("hits") or obj.get("lines") or []
@@ -59,11 +113,13 @@ def _list_ocr_pages(pdf_name: str) -> Tuple[List[Dict[str, Any]], int]:
                 "page": int(obj.get("page") or 0),
                 "w": float(obj.get("w") or 0),
                 "h": float(obj.get("h") or 0),
-                "hits": hits
+                "hits": hits,
+                # 旧缓存没有 layout 字段：现算一次
+                "layout": ocr_layout.from_json(obj.get("layout"), len(hits)) or ocr_layout.analyze_hits(hits)
             })
         except Exception:
             continue
-    return pages, dpi_used
+    return pages
 
 # ------- 问题切词（包含针脚/连接器模式） -------
 def _terms_from_question(q: str) -> List[str]:
@@ -85,71 +141,32 @@ def _group_table_rows(p: Dict[str, Any]) -> List[List[Dict[str, Any]]]:
     把同页 hits（OCR 行）按 y 聚成行：
       - 每 5px 归一到一个 row bin
       - 行里条目数多、包含大量数字/短 token → 更像表格
+    分行与表格判定在 OCR 时已算好（layout 的 TABLE_ROW 标记），这里只按标记取行。
     返回：每个元素是一行（若干 OCR 命中）
     """
-    bins: Dict[int, List[Dict[str, Any]]] = {}
-    for i, h in enumerate(p.get("hits", [])):
-        box = h.get("box") or {}
-        y = float(box.get("y", 0.0))
-        key = int(round(y / 5.0))
-        item = {
-            "index": i,
-            "text": str(h.get("text") or ""),
-            "box": {k: float(box.get(k, 0.0)) for k in ("x","y","w","h")}
-        }
-        bins.setdefault(key, []).append(item)
+    hits = p.get("hits", [])
+    lay = p["layout"]["hits"]
+    xs = np.fromiter((float((h.get("box") or {}).get("x", 0.0)) for h in hits), np.float64, len(hits))
     rows = []
-    for key in sorted(bins.keys()):
-        row = sorted(bins[key], key=lambda t: t["box"]["x"])
-        # 行里至少 4 条、且包含较多数字/短token，视为“表格行”
-        txt = "".join(x["text"] for x in row)
-        digits = len(re.findall(r"[0-9A-Za-z\-]+", txt))
-        if len(row) >= 4 and digits >= 4:
-            rows.append(row)
+    for idx in ocr_layout.table_rows(lay["flags"], lay["row"], xs):
+        row = []
+        for i in idx.tolist():
+            box = hits[i].get("box") or {}
+            row.append({
+                "index": i,
+                "text": str(hits[i].get("text") or ""),
+                "box": {k: float(box.get(k, 0.0)) for k in ("x","y","w","h")}
+            })
+        rows.append(row)
     return rows
 
-def _harvest_table_context(pages: List[Dict[str, Any]], terms: List[str]) -> List[Tuple[int, str, List[Dict[str, Any]]]]:
-    """
-    返回命中问题术语的“表格行上下文”：
-      -> [(page, ctx_text, evidence_items), ...]
-    """
-    res = []
-    tset = { _normalize(t) for t in terms if t }
+def _table_lines(pages: List[Dict[str, Any]]) -> List[Tuple[int, str, List[Dict[str, Any]]]]:
+    """全部表格行：[(page, line_text, row_items)]，按页、行序排列；与问题无关，可按文档缓存"""
+    out = []
     for p in pages:
-        rows = _group_table_rows(p)
-        for row in rows:
-            line_txt = " | ".join(x["text"] for x in row)
-            norm_line = _normalize(line_txt)
-            if any(t in norm_line for t in tset):
-                res.append((int(p["page"]), line_txt, row))
-    return res
-
-# ------- 普通行打分（保留你之前的启发式） -------
-def _score_entries(terms: List[str], entries: List[Dict[str, Any]], pages_by_num: Dict[int, Dict[str, Any]]) -> List[Tuple[float, Dict[str, Any]]]:
-    tset = { _normalize(t) for t in terms if t }
-    scored = []
-    for e in entries:
-        t = _normalize(e["text"])
-        if not t:
-            continue
-        hit_cnt = sum(1 for kw in tset if kw in t)
-        if hit_cnt == 0:
-            continue
-        page = pages_by_num.get(e["page"], {})
-        heights = [h.get("box",{}).get("h",0) for h in page.get("hits",[])]
-        heights = sorted(float(x) for x in heights if x)
-        h90 = heights[max(0, int(len(heights)*0.9)-1)] if heights else 0.0
-        is_title = e["box"]["h"] >= h90
-        rows = {}
-        for h in page.get("hits",[]):
-            by = h.get("box",{}).get("y",0)
-            rows[round(by/5)] = rows.get(round(by/5),0)+1
-        row_den = rows.get(round(e["box"]["y"]/5),1)
-        is_tableish = row_den >= 12
-        score = hit_cnt + (3 if is_title else 0) + (1 if is_tableish else 0)
-        scored.append((float(score), e))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return scored
+        for row in _group_table_rows(p):
+            out.append((int(p["page"]), " | ".join(x["text"] for x in row), row))
+    return out
 
 def _collect_entries(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     entries = []
@@ -167,132 +184,261 @@ def _collect_entries(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
             })
     return entries
 
-def _build_context_from_rows(rows: List[Tuple[int, str, List[Dict[str, Any]]]], limit_pages:int=6) -> Tuple[str, List[Dict[str, Any]]]:
+# ------- 检索：BM25（普通行 + 表格行） -------
+def _build_index(entries: List[Dict[str, Any]], table_lines: List[Tuple[int, str, List[Dict[str, Any]]]],
+                 pages_by_num: Dict[int, Dict[str, Any]]) -> qa_index.BM25Index:
+    texts, kind, page, ref, boost = [], [], [], [], []
+    for k, e in enumerate(entries):
+        # 标题 / 表格行标记来自 OCR 时的版面分析；表格行里的 hit 由整行代表
+        flags = int(pages_by_num[e["page"]]["layout"]["hits"]["flags"][e["index"]])
+        if flags & ocr_layout.TABLE_ROW:
+            continue
+        texts.append(e["text"]); kind.append(qa_index.LINE); page.append(e["page"]); ref.append(k)
+        boost.append(qa_index.TITLE_BOOST if flags & ocr_layout.TITLE else 1.0)
+    for k, (pg, line_txt, _) in enumerate(table_lines):
+        texts.append(line_txt); kind.append(qa_index.ROW); page.append(pg); ref.append(k)
+        boost.append(qa_index.ROW_BOOST)
+    return qa_index.BM25Index(texts, kind, page, ref, boost)
+
+def _pack_context(docs: List["_Doc"], seeds: Sequence[Tuple[int, int]], window: int, budget: int,
+                  names: Optional[List[str]] = None) -> Tuple[str, List[Dict[str, Any]], str, int]:
     """
-    rows: [(page, line_text, row_items)]
-    组装上下文：每页最多取若干行；证据用 row_items
+    seeds 为按分数降序的 (文档序号, 单元 id)；从高到低装上下文，直到估算 token 用完：
+      普通行带上同页前后 window 条 hit，表格行带上同页上下各一行（表头/相邻针脚）；
+      带邻居放不下时只放它自己，仍放不下就跳过（后面更短的单元可能还放得下）
+    names 给定时（全库问答）段标题与证据带上文档名。
+    返回 (context, evidence, used, 估算 token 数)；输出按文档、页码、页内原顺序排列
     """
-    by_page: Dict[int, List[Tuple[str, List[Dict[str, Any]]]]] = {}
-    for pg, line_txt, items in rows:
-        by_page.setdefault(pg, []).append((line_txt, items))
+    lines: Dict[Tuple[int, int], set] = {}   # (文档, 页) → 已选 hit 下标
+    rows: Dict[Tuple[int, int], set] = {}    # (文档, 页) → 已选表格行下标
+    taken: List[Tuple[int, int]] = []
+    used = 0
+    for d, u in seeds:
+        if budget - used < MIN_SPAN_TOKENS:
+            break
+        doc = docs[d]
+        ix = doc.index
+        pg, ref = int(ix.page[u]), int(ix.ref[u])
+        head = 0 if (d, pg) in lines or (d, pg) in rows else PAGE_HEAD_TOKENS
+        if ix.kind[u] == qa_index.LINE:
+            hits = doc.pages_by_num[pg]["hits"]
+            i0 = doc.entries[ref]["index"]
+            have = lines.setdefault((d, pg), set())
+            spans = [range(max(0, i0 - window), min(len(hits), i0 + window + 1)), (i0,)]
+            text_of = lambda i, hits=hits: str(hits[i].get("text") or "")
+        else:
+            tl = doc.table_lines
+            have = rows.setdefault((d, pg), set())
+            near = (ref - 1, ref, ref + 1)
+            spans = [[j for j in near if 0 <= j < len(tl) and tl[j][0] == pg], (ref,)]
+            text_of = lambda j, tl=tl: tl[j][1]
+        for span in spans:
+            new = [i for i in span if i not in have]
+            cost = head + sum(qa_index.estimate_tokens(text_of(i)) for i in new)
+            if used + cost <= budget:
+                have.update(new)
+                used += cost
+                taken.append((d, u))
+                break
 
     chunks = []
+    for d, pg in sorted(set(lines) | set(rows)):
+        doc = docs[d]
+        title = f"{names[d]} · Page {pg}" if names else f"Page {pg}"
+        hits = doc.pages_by_num[pg]["hits"]
+        texts = [t for t in (str(hits[i].get("text") or "") for i in sorted(lines.get((d, pg), ()))) if t.strip()]
+        if texts:
+            chunks.append(f"[{title}]\n" + "\n".join(texts))
+        if rows.get((d, pg)):
+            chunks.append(f"[{title} · 表格]\n" + "\n".join(doc.table_lines[j][1] for j in sorted(rows[(d, pg)])))
+
+    # 证据：分数最高的若干单元（普通行取本条，表格行取行首一项）
     evidence = []
-    for pg in sorted(by_page.keys())[:limit_pages]:
-        lines = by_page[pg][:30]  # 每页最多 30 行
-        chunks.append(f"[Page {pg} · 表格]\n" + "\n".join(t for t,_ in lines))
-        # 每行挑一个代表项作为证据（文本+框）
-        for _, items in lines[:10]:
-            if not items: continue
-            it = items[min(0, len(items)-1)]
-            evidence.append({
-                "page": int(pg),
-                "text": it["text"],
-                "box": it["box"]
-            })
-    context = "\n\n".join(chunks)
-    return context, evidence[:12]
-
-def _build_context_from_entries(scored: List[Tuple[float, Dict[str, Any]]], pages_by_num: Dict[int, Dict[str, Any]], top_k:int=80, window:int=2) -> Tuple[str, List[Dict[str, Any]]]:
-    chosen = [e for _, e in scored[:top_k]]
-    keyset = set()
-    final_spans = []
-    for e in chosen:
-        k = (e["page"], e["index"])
-        if k in keyset: continue
-        keyset.add(k)
-        final_spans.append(e)
-    by_page: Dict[int, List[Dict[str, Any]]] = {}
-    for e in final_spans:
-        by_page.setdefault(e["page"], []).append(e)
-    chunks = []
-    evidence_out = []
-    for pg in sorted(by_page.keys()):
-        page = pages_by_num.get(pg, {})
-        hits = page.get("hits", [])
-        idxs = sorted({i for e in by_page[pg] for i in range(max(0, e["index"]-window), min(len(hits)-1, e["index"]+window)+1)})
-        texts = []
-        for i in idxs:
-            ht = hits[i]
-            txt = str(ht.get("text") or "")
-            if not txt.strip(): continue
-            texts.append(txt)
-        if not texts:
+    for d, u in taken[:12]:
+        doc = docs[d]
+        pg, ref = int(doc.index.page[u]), int(doc.index.ref[u])
+        if doc.index.kind[u] == qa_index.LINE:
+            it = doc.entries[ref]
+        elif doc.table_lines[ref][2]:
+            it = doc.table_lines[ref][2][0]
+        else:
             continue
-        chunks.append(f"[Page {pg}]\n" + "\n".join(texts[:50]))
-        for e in by_page[pg]:
-            evidence_out.append({
-                "page": int(pg),
-                "text": e["text"],
-                "box": e["box"]
-            })
-    context = "\n\n".join(chunks)
-    if len(context) > 6000:
-        context = context[:6000] + "\n...[截断]"
-    return context, evidence_out[:12]
+        ev = {"page": pg, "text": it["text"], "box": it["box"]}
+        if names:
+            ev["pdf_name"] = names[d]
+        evidence.append(ev)
+    kinds = {int(docs[d].index.kind[u]) for d, u in taken}
+    used_kind = "none" if not kinds else "tables" if kinds == {qa_index.ROW} else "lines" if kinds == {qa_index.LINE} else "mixed"
+    return "\n\n".join(chunks), evidence, used_kind, used
+
+# ------- 文档缓存：同一文档连续提问不再重复解析 -------
+class _Doc:
+    """一份文档解析后的页、扁平条目与派生结构（表格行）"""
+    __slots__ = ("sig", "version", "dpi", "pages", "pages_by_num", "entries", "table_lines", "index", "nbytes")
+
+    def __init__(self, sig: tuple, dpi: int, pages: List[Dict[str, Any]], version: str = ""):
+        self.sig, self.version, self.dpi, self.pages = sig, version, dpi, pages
+        self.pages_by_num = {int(p["page"]): p for p in pages}
+        self.entries = _collect_entries(pages)
+        self.table_lines = _table_lines(pages)
+        self.index = _build_index(self.entries, self.table_lines, self.pages_by_num)
+        # 粗估常驻字节：文本按 UTF-8 长度，每条 hit / 条目的字典开销按常数计，索引按数组实际大小
+        text = sum(len(e["text"].encode("utf-8")) for e in self.entries)
+        n_hits = sum(len(p["hits"]) for p in pages)
+        self.nbytes = (text + 600 * n_hits + 400 * len(self.entries) + 200 * len(self.table_lines)
+                       + 256 * len(pages) + self.index.nbytes)
+
+class _DocStore:
+    """按估算字节的 LRU；页文件/整本变化（mtime/大小）即失效重建"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._docs: "OrderedDict[str, _Doc]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pdf_name: str) -> Optional[_Doc]:
+        key = _norm_name(pdf_name)
+        src = _source(CACHE_DIR / key)
+        if src is None:
+            self.drop(key)
+            return None
+        sig = _signature(src)
+        with self._lock:
+            doc = self._docs.get(key)
+            if doc is not None and doc.sig == sig:
+                self._docs.move_to_end(key)
+                self.hits += 1
+                return doc
+            self.misses += 1
+            if doc is not None:
+                self.invalidations += 1
+        # 解析不持锁：其它文档的提问不被阻塞；同一文档并发未命中至多重复解析一次
+        doc = _Doc(sig, src[1], _load_pages(src), _version(src, sig))
+        with self._lock:
+            old = self._docs.pop(key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+            if doc.nbytes <= self.max_bytes:
+                self._docs[key] = doc
+                self.bytes += doc.nbytes
+                while self.bytes > self.max_bytes:
+                    _, ev = self._docs.popitem(last=False)
+                    self.bytes -= ev.nbytes
+                    self.evictions += 1
+        return doc
+
+    def drop(self, key: str):
+        with self._lock:
+            old = self._docs.pop(key, None)
+            if old is not None:
+                self.bytes -= old.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "docs": len(self._docs),
+                "mb": round(self.bytes / 1048576, 1),
+                "max_mb": round(self.max_bytes / 1048576),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+_store = _DocStore(QA_DOC_CACHE_MB * 1048576)
+
+def doc_cache_stats() -> Dict[str, Any]:
+    return _store.stats()
 
 # ------- 主流程 -------
-def qa_over_pdf(pdf_name: str, question: str, top_k:int=80, window:int=2) -> Dict[str, Any]:
-    pages, dpi_used = _list_ocr_pages(pdf_name)
-    pages_by_num = {int(p["page"]): p for p in pages}
-    entries = _collect_entries(pages)
+_SYS = (
+    "你是汽车电路图助手。只依据给定上下文回答连接性问题；"
+    "若上下文不足，请回答“无法确定”。优先抽取针脚号、连接器编号、端子标识。"
+    "输出 JSON：{answer:string, pins:string[], pages:int[], evidence:{page:int,text:string,box:{x:float,y:float,w:float,h:float}}[], confidence:number(0-1)}。"
+    "不要编造坐标和页码。"
+)
+# 全库问答：上下文来自多本手册
+_SYS_LIBRARY = _SYS + "上下文来自多本手册，每段标题里有文档名；evidence 每项加 pdf_name:string。"
 
-    base_terms = _terms_from_question(question)
-    terms = base_terms[:]  # 你也可以在这里并上 llm_synonyms 的扩展
+def _retrieve(docs: List[_Doc], tokens: List[str], top_k: int) -> List[Tuple[int, int]]:
+    """各文档 BM25 各取 top_k，合并后按分数降序取 top_k 个 (文档序号, 单元 id)"""
+    found = []
+    for d, doc in enumerate(docs):
+        ids, scores = doc.index.search(tokens, limit=top_k)
+        found.extend(zip(scores.tolist(), [d] * len(ids), ids.tolist()))
+    found.sort(key=lambda x: (-x[0], x[1], x[2]))
+    return [(d, u) for _, d, u in found[:top_k]]
 
-    # ① 表格优先：命中相关表格行
-    table_rows = _harvest_table_context(pages, terms)
-    context, evidence = ("", [])
-    if table_rows:
-        context, evidence = _build_context_from_rows(table_rows, limit_pages=8)
+def _timed(data: Dict[str, Any], route: str, timing: Dict[str, float]) -> Dict[str, Any]:
+    # 各阶段耗时：进 /metrics 直方图，也放进 debug.timing_ms（缓存命中的答案也是本次的耗时）
+    metrics.observe_stages(route, timing)
+    data.setdefault("debug", {})["timing_ms"] = {k: round(1000 * v, 2) for k, v in timing.items()}
+    return data
 
-    # ② 如果表格拿不到，再走普通行打分
-    if not context.strip():
-        scored = _score_entries(terms, entries, pages_by_num)
-        context, evidence = _build_context_from_entries(scored, pages_by_num, top_k=top_k, window=window)
+def _qa(docs: List[_Doc], question: str, top_k: int, window: int, names: Optional[List[str]] = None,
+        timing: Optional[Dict[str, float]] = None, route: str = "qa") -> Dict[str, Any]:
+    """timing 为调用方已计的阶段（load / rank，秒），本函数补上 answer_cache / retrieve / llm"""
+    timing = dict(timing or {})
+    n_pages = sum(len(doc.pages) for doc in docs)
+    n_entries = sum(len(doc.entries) for doc in docs)
 
-    # ③ 再兜底一层“宽松匹配”
-    if not context.strip():
-        qbag = set(terms)
-        qbag.update(re.findall(r"[A-Za-z]{2,}", question))
-        qbag.update(re.findall(r"\d{2,}", question))
-        norm_qbag = { _normalize(t) for t in qbag if t }
-        greedy = []
-        for e in entries:
-            t = _normalize(e["text"])
-            if any(k in t for k in norm_qbag):
-                greedy.append((1.0, e))
-        if greedy:
-            context, evidence = _build_context_from_entries(greedy, pages_by_num, top_k=200, window=3)
+    # 答案级缓存：同一文档版本 + 规范化问题 + 检索参数直接返回，不再检索、不再请求 LLM
+    answer_key = None
+    if QA_ANSWER_CACHE and docs and all(doc.version for doc in docs):
+        t0 = time.perf_counter()
+        answer_key = make_key("qa_answer", *[doc.version for doc in docs], *(names or ()), _question_key(question),
+                              top_k, window, RETRIEVAL_VERSION, QA_CONTEXT_TOKENS, QA_MODEL)
+        hit = llm_cache().get(answer_key, count=True)
+        timing["answer_cache"] = time.perf_counter() - t0
+        if hit is not None:
+            data = hit["data"]
+            data["cached"] = True
+            data.setdefault("debug", {})["context_hash"] = hit["context_hash"]
+            return _timed(data, route, timing)
+
+    t0 = time.perf_counter()
+    base_terms = _terms_from_question(question)
+    terms = base_terms[:]  # 你也可以在这里并上 llm_synonyms 的扩展
+
+    # 问题切词 + 针脚/连接器模式一起作为 BM25 查询；按分数装满 token 预算
+    tokens = qa_index.query_tokens(question, *terms)
+    seeds = _retrieve(docs, tokens, top_k)
+    context, evidence, used, ctx_tokens = _pack_context(docs, seeds, window=window, budget=QA_CONTEXT_TOKENS, names=names)
+    timing["retrieve"] = time.perf_counter() - t0
 
     if not context.strip():
-        return {
+        return _timed({
             "answer": "未从文档中检索到相关内容，无法作答。",
             "pins": [],
             "pages": [],
             "evidence": [],
             "confidence": 0.1,
-            "debug": {"pages": len(pages), "entries": len(entries), "terms": terms, "context_len": 0, "used": "none"}
-        }
-
-    sys = (
-        "你是汽车电路图助手。只依据给定上下文回答连接性问题；"
-        "若上下文不足，请回答“无法确定”。优先抽取针脚号、连接器编号、端子标识。"
-        "输出 JSON：{answer:string, pins:string[], pages:int[], evidence:{page:int,text:string,box:{x:float,y:float,w:float,h:float}}[], confidence:number(0-1)}。"
-        "不要编造坐标和页码。"
-    )
+            "cached": False,
+            "debug": {"pages": n_pages, "entries": n_entries, "terms": terms, "matched": len(seeds), "context_len": 0, "used": "none"}
+        }, route, timing)
+
+    sys = _SYS_LIBRARY if names else _SYS
     usr = (
         f"问题：{question}\n\n"
         f"上下文（可能包含针脚表/连接表的行）：\n{context}\n\n"
         f"请按 JSON 输出。"
     )
 
-    resp = client.chat.completions.create(
-        model=QA_MODEL,
-        temperature=0.2,
-        messages=[{"role":"system","content":sys},{"role":"user","content":usr}]
-    )
-    txt = resp.choices[0].message.content or ""
+    def ask() -> str:
+        return llm_client.chat(
+            [{"role":"system","content":sys},{"role":"user","content":usr}],
+            model=QA_MODEL,
+            temperature=0.2,
+        )
+
+    context_hash = hashlib.sha1(context.encode("utf-8")).hexdigest()[:16]
+    # 同一提示词（问题 + 检索到的上下文）直接复用；并发的相同提问只请求一次
+    t0 = time.perf_counter()
+    txt = llm_cache().get_or_compute(make_key("qa", QA_MODEL, sys, usr), ask)
+    timing["llm"] = time.perf_counter() - t0
     try:
         data = json.loads(txt)
     except Exception:
@@ -316,12 +462,55 @@ def qa_over_pdf(pdf_name: str, question: str, top_k:int=80, window:int=2) -> Dic
     except Exception:
         data["confidence"] = 0.5
 
+    if names:
+        data["docs"] = names
     data.setdefault("debug", {})
     data["debug"].update({
-        "pages": len(pages),
-        "entries": len(entries),
+        "pages": n_pages,
+        "entries": n_entries,
         "terms": terms[:30],
+        "matched": len(seeds),
         "context_len": len(context),
-        "used": "tables" if table_rows else "lines"
+        "context_tokens": ctx_tokens,
+        "context_hash": context_hash,
+        "used": used
     })
-    return data
+    if answer_key is not None:
+        llm_cache().put(answer_key, {"context_hash": context_hash, "data": data})
+    data["cached"] = False
+    return _timed(data, route, timing)
+
+def qa_over_pdf(pdf_name: str, question: str, top_k:int=80, window:int=2) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    doc = _store.get(pdf_name)
+    if doc is None:
+        doc = _Doc((), 0, [])
+    return _qa([doc], question, top_k, window, timing={"load": time.perf_counter() - t0})
+
+def qa_over_library(question: str, top_k:int=80, window:int=2, pdf_names: Optional[List[str]] = None,
+                    max_docs: int = library.LIBRARY_QA_DOCS) -> Dict[str, Any]:
+    """
+    全库问答：先按问题词在各文档分片里的命中给文档排序（pdf_names 给定时只在这些文档里选），
+    取前 max_docs 本，各自 BM25 检索后合并装上下文，调用一次 LLM；证据带 pdf_name
+    """
+    # 选文档只用两字以上的词：单字在每本手册里都有，区分不了文档
+    t0 = time.perf_counter()
+    tokens = [t for t in qa_index.query_tokens(question, *_terms_from_question(question)) if len(t) >= 2]
+    ranked = library.rank_documents(tokens, limit=max(1, max_docs), names=pdf_names)
+    t1 = time.perf_counter()
+    docs, names = [], []
+    for name, _ in ranked:
+        doc = _store.get(name)
+        if doc is not None:
+            docs.append(doc)
+            names.append(name)
+    timing = {"rank": t1 - t0, "load": time.perf_counter() - t1}
+    if not docs:
+        return _timed({
+            "answer": "未在文档库中找到相关文档，无法作答。",
+            "pins": [], "pages": [], "evidence": [], "confidence": 0.1, "docs": [], "cached": False,
+            "debug": {"pages": 0, "entries": 0, "terms": tokens[:30], "matched": 0, "context_len": 0, "used": "none"}
+        }, "library_qa", timing)
+    res = _qa(docs, question, top_k, window, names=names, timing=timing, route="library_qa")
+    res.setdefault("debug", {})["doc_scores"] = dict(ranked)
+    return res
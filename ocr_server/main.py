@@ -1,18 +1,10 @@
 # -*- coding: utf-8 -*-
-import os, json, gc, unicodedata, io
+import os, json, gzip, hashlib, unicodedata, threading, time
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, Optional
 from dotenv import load_dotenv
-import numpy as np
-from PIL import Image
-import requests
-import fitz  # PyMuPDF
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from paddleocr import PaddleOCR
-from llm_synonyms import llm_expand_synonyms, load_vocab_from_ocr_cache
-from llm_qa import qa_over_pdf
 # ---------------- 环境加固（保留你原有设置，不改动） ----------------
+# 必须在导入本地模块之前：ocr_pipeline / ocr_pool / mem_governor / pdf_source 等在导入时读取环境变量
 load_dotenv()
 def load_env_safely():
     here = Path(__file__).resolve().parent            # ocr_server/
@@ -32,16 +24,50 @@ def load_env_safely():
         loaded_from = "auto(find_dotenv)"
 
 load_env_safely()
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise RuntimeError("Missing OPENAI_API_KEY in .env")
 os.environ.setdefault("FLAGS_use_mkldnn", "0")
 os.environ.setdefault("CPU_NUM_THREADS", "4")
 os.environ.setdefault("OMP_NUM_THREADS", "4")
 
+from flask import Flask, request, jsonify, Response, g
+from flask_cors import CORS
+from ocr_pipeline import (get_engine, ocr_pages, write_json_atomic, OCR_CACHE_VERSION,
+                          TEXT_LAYER_DEFAULT, TILE_MIN_INK, TILE_MIN_CONTRAST, ORIENTATION_DEFAULT,
+                          DEDUP_DEFAULT, ADAPTIVE_DEFAULT)
+import page_cache
+import ocr_book
+import search_index
+import vocab_index
+import ocr_pool
+import pdf_source
+from mem_governor import governor
+from ocr_jobs import JobManager
+from llm_synonyms import llm_expand_synonyms, load_vocab_from_ocr_cache
+from llm_qa import qa_over_pdf, qa_over_library, doc_cache_stats
+import library
+from llm_cache import llm_cache
+import llm_client
+import metrics
+if not llm_client.configured():  # LLM_BASE_URL=stub 时可不配密钥
+    raise RuntimeError("Missing OPENAI_API_KEY in .env")
+
 # ---------------- Flask ----------------
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['ETag', 'X-Pages-Total', 'X-Page-Max'])
+
+# ---------------- 请求耗时（按路由模板，/metrics 输出） ----------------
+HTTP_SECONDS = metrics.histogram('http_request_seconds', '接口耗时（流式接口只算到响应头发出）', ('route', 'method', 'code'))
+
+@app.before_request
+def _req_start():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def _req_done(resp):
+    t0 = g.pop('t0', None)
+    if t0 is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_SECONDS.observe(time.perf_counter() - t0, route=route, method=request.method, code=resp.status_code)
+    return resp
 
 # ---------------- 默认参数（保持与前端一致） ----------------
 DPI_DEFAULT = 500
@@ -55,6 +81,9 @@ DATA_DIR  = Path(os.environ.get("DATA_DIR", ROOT_DIR / "data")).resolve()
 CACHE_DIR = Path(os.environ.get("CACHE_DIR", DATA_DIR / "cache")).resolve()
 os.environ.setdefault("CACHE_DIR", str(CACHE_DIR))
 
+# 前端 /api/proxy 代理的就是这个目录时，OCR 直接按文件名打开本地文件，不再经 HTTP 整本下载
+PDF_PREFER_LOCAL = os.environ.get("PDF_PREFER_LOCAL", "1") == "1"
+
 PDF_DIR.mkdir(parents=True, exist_ok=True)
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 CACHE_DIR.mkdir(parents=True, exist_ok=True)
@@ -72,237 +101,431 @@ def chunked(seq, n=10):
     for i in range(0, len(seq), n):
         yield seq[i:i+n]
 
-def write_json_atomic(path: Path, obj: dict):
-    tmp = path.with_suffix(path.suffix + '.tmp')
-    tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding='utf-8')
-    tmp.replace(path)
-
 # ---------------- OCR 引擎（保留你原有参数） ----------------
-ocr = PaddleOCR(
-    lang='ch',
-    use_angle_cls=True,
-    det_limit_side_len=2048,  # 速度/召回折中
-    use_gpu=False,
-    cpu_threads=4
-)
-
-# ---------------- 工具函数（保留并小修） ----------------
-def rotate_image(im: Image.Image, deg: int) -> Image.Image:
-    if deg == 0:
-        return im
-    return im.rotate(deg, expand=True)  # 逆时针为正
-
-def tiles(img: Image.Image, size=1400, overlap=0.12):
-    # 目前未直接使用（保留）
-    W, H = img.size
-    dx = int(size * (1 - overlap)); dy = dx
-    xs = list(range(0, max(1, W - size) + 1, dx))
-    ys = list(range(0, max(1, H - size) + 1, dy))
-    if W > size and (W - size) % dx != 0: xs.append(W - size)
-    if H > size and (H - size) % dy != 0: ys.append(H - size)
-    xs = sorted(set(xs)); ys = sorted(set(ys))
-    for xi in xs:
-        for yi in ys:
-            yield (xi, yi), img.crop((xi, yi, xi + size, yi + size))
-
-def safe_ocr_lines(im: Image.Image) -> list:
-    try:
-        res = ocr.ocr(np.array(im), cls=True)  # 期望 RGB
-        if not res or not isinstance(res, list):
-            return []
-        lines = res[0] if len(res) else []
-        return lines or []
-    except Exception:
-        app.logger.exception("OCR call failed")
-        return []
-
-def ocr_patch(patch: Image.Image):
-    """
-    针对小块做 OCR，尝试 0/90 两种角度，取 score 高的一种。
-    """
-    cands = []
-    for rot in [0, 90]:
-        imr = rotate_image(patch, rot)
-        if imr.mode != "RGB":
-            imr = imr.convert("RGB")  # 关键：确保 3 通道
-        lines = safe_ocr_lines(imr)
-        score = sum(max(0, float(t[1][1])) for t in lines) if lines else 0.0
-        cands.append((score, rot, lines))
-    cands.sort(key=lambda x: x[0], reverse=True)
-    return cands[0]
-
-def rotate_box_back(
-    box: List[List[float]],
-    rot_deg: int,
-    patch_w: int,
-    patch_h: int,
-    offset_xy: Tuple[int, int]
-):
-    """
-    将“在已旋转 patch 坐标系中的四点框”映射回“整页未旋转坐标系”，
-    再加上 patch 左上角在整页中的偏移。
-    约定：rot_deg 为逆时针角度；Pillow.rotate(deg) 同样是逆时针。
-    """
-    pts = np.array(box, dtype=np.float32)  # [[x',y'], ...] in ROTATED patch coords
-    x0, y0 = offset_xy
-
-    if rot_deg == 0:
-        xs, ys = pts[:, 0], pts[:, 1]
-    elif rot_deg == 90:
-        # 逆时针90°：x' = y, y' = W - x ；反变换：x = W - y', y = x'
-        xs = patch_w - pts[:, 1]
-        ys = pts[:, 0]
-    elif rot_deg == 180:
-        # 180°：x' = W - x, y' = H - y ；反变换：x = W - x', y = H - y'
-        xs = patch_w - pts[:, 0]
-        ys = patch_h - pts[:, 1]
-    elif rot_deg == 270:
-        # 逆时针270°（=顺时针90°）：x' = H - y, y' = x ；反变换：x = y', y = H - x'
-        xs = pts[:, 1]
-        ys = patch_h - pts[:, 0]
-    else:
-        xs, ys = pts[:, 0], pts[:, 1]
-
-    # 加回整页偏移
-    xs = xs + x0; ys = ys + y0
-    xmin, ymin = float(xs.min()), float(ys.min())
-    xmax, ymax = float(xs.max()), float(ys.max())
-    return xmin, ymin, xmax - xmin, ymax - ymin
-
-# ---------------- 单页 OCR：按 clip 分块渲染 → OCR → 坐标还原 ----------------
-def ocr_one_page(doc, page_index: int, dpi: int, tile: int, overlap: float):
-    """
-    返回：
-    {
-      'page': 1-based 页码,
-      'w': 整页像素宽(基于dpi),
-      'h': 整页像素高(基于dpi),
-      'hits': [ {'text':str,'conf':float,'box':{'x':int,'y':int,'w':int,'h':int}}, ... ]
+# 进程池模式下由各工作进程自行加载引擎，主进程不占这份内存
+if not ocr_pool.enabled():
+    get_engine()
+
+# ---------------- OCR 主流程：每 10 页一批（同步接口与任务队列共用） ----------------
+# 引擎/进程池同一时刻只服务一个文档，内存上限不随并发请求叠加
+_ocr_doc_lock = threading.Lock()
+
+def parse_ocr_spec(data: dict) -> dict:
+    return {
+        'pdf_url':  data.get('pdf_url', ''),
+        'pdf_name': norm(data.get('pdf_name', 'doc.pdf')),
+        'local':    bool(data.get('local', PDF_PREFER_LOCAL)),  # PDF_DIR 有同名文件时直接读本地
+        'dpi':      int(data.get('dpi', DPI_DEFAULT)),
+        'tile':     int(data.get('tile', TILE_SIZE_DEFAULT)),
+        'overlap':  float(data.get('overlap', OVERLAP_DEFAULT)),
+        'pages':    data.get('pages'),  # 可无；有就只处理这些页（1-based）
+        'force':    bool(data.get('force')),
+        'text_layer': bool(data.get('text_layer', TEXT_LAYER_DEFAULT)),  # 矢量文字层快速通道
+        'min_ink':  float(data.get('tile_min_ink', TILE_MIN_INK)),         # 空白块预筛阈值
+        'min_contrast': int(data.get('tile_min_contrast', TILE_MIN_CONTRAST)),
+        # 方向判定：auto / horizontal（已知全横排的文档）/ dual（旧的双向）
+        'orientation': data.get('orientation') if data.get('orientation') in ('auto', 'horizontal', 'dual') else ORIENTATION_DEFAULT,
+        'dedup':    bool(data.get('dedup', DEDUP_DEFAULT)),  # 跨块去重 + 碎片拼接
+        'adaptive': bool(data.get('adaptive', ADAPTIVE_DEFAULT)),  # 粗到细：只对小字区域按 dpi 重渲
     }
-    坐标单位：整页像素，与前端 mapBox 的 (w,h) 对齐。
-    """
-    page = doc.load_page(page_index)
-    scale = dpi / 72.0
-    rect = page.rect
-    W = int(rect.width * scale)
-    H = int(rect.height * scale)
-
-    step = max(1, int(tile - tile * overlap))  # 实际步长
-    mtx = fitz.Matrix(scale, scale)
-    hits = []
-
-    for y0 in range(0, H, step):
-        y1 = min(y0 + tile, H)
-        for x0 in range(0, W, step):
-            x1 = min(x0 + tile, W)
-            clip = fitz.Rect(x0/scale, y0/scale, x1/scale, y1/scale)
 
+def has_pdf_source(spec: dict) -> bool:
+    return bool(spec['pdf_url']) or (spec['local'] and pdf_source.local_pdf(PDF_DIR, spec['pdf_name']) is not None)
+
+# 透传给 ocr_one_page 的流水线选项及其默认值
+OCR_OPTS_DEFAULT = {'text_layer': TEXT_LAYER_DEFAULT, 'min_ink': TILE_MIN_INK, 'min_contrast': TILE_MIN_CONTRAST,
+                    'orientation': ORIENTATION_DEFAULT, 'dedup': DEDUP_DEFAULT, 'adaptive': ADAPTIVE_DEFAULT}
+
+def ocr_opts(spec: dict) -> dict:
+    return {k: spec.get(k, v) for k, v in OCR_OPTS_DEFAULT.items()}
+
+def ocr_version(opts: dict) -> str:
+    # 只有偏离默认值的选项进入缓存 key，新增选项不会让已有缓存整体失效
+    return OCR_CACHE_VERSION + ''.join(f'/{k}={v}' for k, v in sorted(opts.items()) if v != OCR_OPTS_DEFAULT.get(k))
+
+def page_json_path(pdf_name: str, page_no: int, dpi: int) -> Path:
+    return CACHE_DIR / pdf_name / f'page_{page_no:04d}_{dpi}_rapidocr.json'
+
+def read_pages(pdf_name: str, dpi: int, pages_idx) -> list:
+    # 统一按页序读回
+    result_pages = []
+    for i in pages_idx:
+        jpath = page_json_path(pdf_name, i + 1, dpi)
+        if jpath.exists():
             try:
-                # 只渲 clip，灰度、无 alpha（显著省内存）
-                pix = page.get_pixmap(matrix=mtx, clip=clip, colorspace=fitz.csGRAY, alpha=False)
-                im = Image.frombytes("L", (pix.w, pix.h), pix.samples)  # 灰度
+                result_pages.append(json.loads(jpath.read_text('utf-8')))
             except Exception:
-                fitz.TOOLS.store_shrink(1); gc.collect()
                 continue
+    return result_pages
 
-            # 单块 OCR（会转 RGB，并尝试 0/90）
-            score, rot, lines = ocr_patch(im)
-
-            for ln in (lines or []):
+def run_ocr_document(spec: dict, job=None) -> list:
+    """
+    按 spec OCR 一个文档，返回涉及的页下标（0-based）。
+    job（ocr_jobs.Job）非空时：回报进度、页间响应取消。
+    未 force 时缓存命中的页不再 OCR（重启续跑也靠这一点）。
+    """
+    pdf_name, dpi, tile, overlap = spec['pdf_name'], spec['dpi'], spec['tile'], spec['overlap']
+    pages_arg = spec.get('pages')
+
+    # 打开 PDF：PDF_DIR 里有同名文件就直接用（句柄与 sha1 跨请求缓存），否则把 pdf_url 下载到临时文件
+    with _ocr_doc_lock, pdf_source.open_pdf(pdf_name, spec.get('pdf_url', ''), PDF_DIR, DATA_DIR,
+                                            spec.get('local', PDF_PREFER_LOCAL)) as src:
+        doc, sha1 = src.doc, src.sha1
+        total = doc.page_count
+
+        # 需要处理的页（0-based 下标）
+        if pages_arg:
+            pages_idx = sorted({max(0, min(total-1, int(p)-1)) for p in pages_arg})
+        else:
+            pages_idx = list(range(total))
+
+        # 缓存目录（与原有命名保持兼容）
+        root = (CACHE_DIR / pdf_name)
+        root.mkdir(parents=True, exist_ok=True)
+        (root / 'meta.json').write_text(json.dumps({'name': pdf_name, 'sha1': sha1, 'pages': total}, ensure_ascii=False), 'utf-8')
+
+        # 若 force，清理旧页与旧合并缓存
+        if spec.get('force'):
+            for j in root.glob(f'page_*_{dpi}_rapidocr.json'):
+                try:
+                    j.unlink()
+                except:
+                    pass
+            for p in (Path(cache_path(pdf_name, dpi, tile, overlap)), page_cache.key_index_path(root, dpi)):
                 try:
-                    poly = ln[0]
-                    txt, conf = ln[1][0], ln[1][1]
-                    bx, by, bw, bh = rotate_box_back(poly, rot, im.width, im.height, (x0, y0))
-                    hits.append({
-                        'text': str(txt),
-                        'conf': float(conf) if conf is not None else 0.0,
-                        'box': {'x': int(bx), 'y': int(by), 'w': int(max(1, bw)), 'h': int(max(1, bh))}
-                    })
+                    p.unlink()
                 except Exception:
-                    continue
-
-            # 释放这一块
-            del im, pix
-            fitz.TOOLS.store_shrink(1); gc.collect()
-
-    del page
-    fitz.TOOLS.store_shrink(1); gc.collect()
+                    pass
+
+        def page_json(i: int) -> Path:
+            return page_json_path(pdf_name, i + 1, dpi)
+
+        # 内容寻址：key 由页内容 + 参数 + 模型版本决定；未 force 时只 OCR 缺失/变化的页
+        opts = ocr_opts(spec)
+        version = ocr_version(opts)
+        keys = {i: page_cache.cache_key(page_cache.page_fingerprint(doc, i), dpi, tile, overlap, version)
+                for i in pages_idx}
+        index = page_cache.load_key_index(root, dpi)
+        saved_index = dict(index)
+        if spec.get('force'):
+            todo = list(pages_idx)
+        else:
+            todo = resolve_cached_pages(root, pages_idx, dpi, keys, index)
+        metrics.OCR_PAGES.inc(len(pages_idx) - len(todo), source='cache')
+        if job is not None:
+            job.set_total(len(todo), skipped=len(pages_idx) - len(todo))
+            pending = set(todo)
+            for i in pages_idx:
+                if i not in pending:
+                    job.page_cached(i + 1)
+
+        def on_page_written(i: int):
+            page_store.put(keys[i], page_json(i))
+            index[i + 1] = keys[i]
+            if job is not None:
+                job.page_done(i + 1)
+
+        failed = []
+
+        def on_page_failed(i: int, exc: BaseException):
+            failed.append(i + 1)
+            if job is not None:
+                job.page_failed(i + 1, exc)
+
+        def stopped() -> bool:
+            return job is not None and job.cancelled
+
+        def refresh_book():
+            # 整本合并缓存：增量更新列式整本（只解析新写的页，其余页按字节搬运）；
+            # 旧的整本 JSON 不再每次重写，/ocr_cache 在没有整本时才回退读它。
+            # 搜索倒排随之按页摘要只重算变化的页。每批调用一次，OCR 进行中也能检索已完成的页
+            ocr_book.update_from_json(root, dpi)
+            # 页码 → key 索引在整本写好之后才落盘，且没变就不写（中途失败时下次按内容寻址区补回）
+            if index != saved_index:
+                page_cache.save_key_index(root, dpi, index)
+                saved_index.clear()
+                saved_index.update(index)
+            search_index.update(root, dpi)
+            library.refresh()  # 新文档/新 DPI 的整本出现后，全库检索重扫分片
+
+        if ocr_pool.enabled():
+            # === 进程池：各 worker 按路径自开文档句柄（本地文件，或下载的临时文件） ===
+            for batch in chunked(todo, 10):
+                if stopped():
+                    break
+                # 取消时由 ocr_pages_parallel 停止派新页、把在途的页跑完，这里不提前跳出
+                for page_no in ocr_pool.ocr_pages_parallel(str(src.path), batch, dpi, tile, overlap, page_json,
+                                                           extra_for=lambda i: {'cache_key': keys[i]}, opts=opts,
+                                                           stopped=stopped, on_error=on_page_failed):
+                    on_page_written(page_no - 1)
+                refresh_book()
+        else:
+            # === 分批 OCR：每 10 页一批（组内按 OCR_BATCH_PAGES 合批识别） ===
+            for batch in chunked(todo, 10):
+                if stopped():
+                    break
+                for out in ocr_pages(doc, batch, dpi=dpi, tile=tile, overlap=overlap, **opts):
+                    i = out['page'] - 1
+                    out['cache_key'] = keys[i]
+                    t0 = time.perf_counter()
+                    write_json_atomic(page_json(i), out)
+                    metrics.observe_ocr_page(metrics.page_summary(out, time.perf_counter() - t0))
+                    on_page_written(i)
+
+                    # 当页完成即释放（回收交给 ocr_pages 里的内存检查点）
+                    del out
+                    if stopped():
+                        break
+
+                refresh_book()
+                if stopped():
+                    break
+
+        refresh_book()  # 全部命中缓存（没有批）时也要生成
+        vocab_index.update(root, dpi)  # 同义词候选词表：整本到齐后建一次（内容未变不重建）
+
+        governor().release()
+        if job is not None:
+            job.mem = mem_stats()
+    if failed:
+        # 其余页已写盘并进了整本；失败的页不在缓存里，重新提交时只补这些页
+        raise RuntimeError(f"OCR failed on pages {sorted(failed)}")
+    return pages_idx
+
+def mem_stats() -> dict:
+    return {'main': governor().stats(), 'workers': ocr_pool.worker_mem_stats()}
+
+# ---------------- 内容寻址页缓存 ----------------
+page_store = page_cache.PageCache(CACHE_DIR / '_pages')
+
+def resolve_cached_pages(root: Path, pages_idx, dpi: int, keys: dict, index: dict) -> list:
+    """
+    命中（页文件 key 一致 / 内容寻址区已有）的页直接落盘，返回仍需 OCR 的页下标。
+    没有 cache_key 的旧版页文件无法核对来源（同名替换、尺寸相同也认不出），一律重跑，
+    不进内容寻址区。
+    """
+    todo = []
+    for i in pages_idx:
+        key, dest = keys[i], page_json_path(root.name, i + 1, dpi)
+        if dest.exists() and index.get(i + 1) == key:
+            continue
+        if page_store.has(key) and page_store.materialize(key, i + 1, dest):
+            index[i + 1] = key
+            continue
+        todo.append(i)
+    return todo
 
-    return {'page': page_index + 1, 'w': W, 'h': H, 'hits': hits}
+# ---------------- 异步任务队列：服务重启后自动续跑 ----------------
+jobs = JobManager(run_ocr_document, DATA_DIR / 'jobs', opts_fn=ocr_opts)
+jobs.start()
 
 # ---------------- 路由：每 10 页一批 OCR（参数不变） ----------------
 @app.post('/ocr_pdf')
 def ocr_pdf():
     data = request.get_json(force=True) or {}
-    pdf_url   = data.get('pdf_url', '')
-    pdf_name  = norm(data.get('pdf_name', 'doc.pdf'))
-    dpi       = int(data.get('dpi', DPI_DEFAULT))
-    tile      = int(data.get('tile', TILE_SIZE_DEFAULT))
-    overlap   = float(data.get('overlap', OVERLAP_DEFAULT))
-    pages_arg = data.get('pages')  # 可无；有就只处理这些页（1-based）
-
-    # 打开 PDF（前端已做本地代理 URL）
-    buf = io.BytesIO(requests.get(pdf_url, timeout=30).content)
-    doc = fitz.open(stream=buf, filetype='pdf')
-    total = doc.page_count
-
-    # 需要处理的页（0-based 下标）
-    if pages_arg:
-        pages_idx = sorted({max(0, min(total-1, int(p)-1)) for p in pages_arg})
-    else:
-        pages_idx = list(range(total))
-
-    # 缓存目录（与原有命名保持兼容）
-    root = (CACHE_DIR / pdf_name)
-    root.mkdir(parents=True, exist_ok=True)
-    (root / 'meta.json').write_text(json.dumps({'name': pdf_name}, ensure_ascii=False), 'utf-8')
-
-    # 若 force，清理旧页与旧合并缓存
-    if data.get('force'):
-        for j in root.glob(f'page_*_{dpi}_rapidocr.json'):
-            try:
-                j.unlink()
-            except:
-                pass
-        try:
-            Path(cache_path(pdf_name, dpi, tile, overlap)).unlink()
-        except Exception:
-            pass
+    spec = parse_ocr_spec(data)
+    if not has_pdf_source(spec):
+        return jsonify({"error": "pdf_url required (or a pdf_name present in PDF_DIR)"}), 400
+    if data.get('async'):
+        job = jobs.submit(spec)
+        return jsonify(job.to_dict()), 202
+    if data.get('stream') in ('ndjson', 'sse'):
+        return stream_job(jobs.submit(spec), data['stream'])
+    try:
+        pages_idx = run_ocr_document(spec)
+    except Exception as e:
+        app.logger.exception("OCR failed")
+        return jsonify({"error": "ocr_failed", "detail": str(e)}), 500
+    return jsonify(read_pages(spec['pdf_name'], spec['dpi'], pages_idx))
 
-    # === 分批 OCR：每 10 页一批 ===
-    for batch in chunked(pages_idx, 10):
-        for i in batch:
-            out = ocr_one_page(doc, i, dpi=dpi, tile=tile, overlap=overlap)
-            jpath = root / f'page_{i+1:04d}_{dpi}_rapidocr.json'
-            write_json_atomic(jpath, out)
+# ---------------- 流式输出：每页写盘即推送 ----------------
+STREAM_KEEPALIVE_SEC = 15
 
-            # 当页完成即释放
-            del out
-            fitz.TOOLS.store_shrink(1)
-            gc.collect()
+def stream_job(job, fmt: str) -> Response:
+    """
+    NDJSON：每行一条 JSON；SSE：event + data。记录依次为
+      {type:'job', ...}      开始时及总页数确定后各一条（含 job_id，可用于取消/轮询）
+      页对象                  与 /ocr_cache 中的元素相同（无 type 字段），缓存命中的页最先到
+      {type:'summary', ...}  结束时一条（status/pages_done/pages_skipped/error…）
+    任务本身在后台队列执行：客户端断开不影响任务，重连可用 /ocr_jobs/<id>/stream 续看。
+    """
+    pdf_name, dpi = job.spec['pdf_name'], job.spec['dpi']
+
+    def rec(kind: str, obj: dict) -> str:
+        body = json.dumps(obj, ensure_ascii=False)
+        return f"event: {kind}\ndata: {body}\n\n" if fmt == 'sse' else body + "\n"
+
+    def gen():
+        seen, total = 0, None
+        yield rec('job', {'type': 'job', **job.to_dict()})
+        while True:
+            active = job.status in ('queued', 'running')
+            fresh = job.wait_pages(seen, STREAM_KEEPALIVE_SEC)
+            if job.pages_total + job.pages_skipped and (job.pages_total, job.pages_skipped) != total:
+                total = (job.pages_total, job.pages_skipped)
+                yield rec('job', {'type': 'job', **job.to_dict()})
+            for page_no in fresh:
+                try:
+                    obj = json.loads(page_json_path(pdf_name, page_no, dpi).read_text('utf-8'))
+                except Exception:
+                    continue
+                yield rec('page', obj)
+            seen += len(fresh)
+            if not active and not fresh:
+                break
+            if not fresh:
+                yield ": keepalive\n\n" if fmt == 'sse' else "\n"
+        yield rec('summary', {'type': 'summary', **job.to_dict()})
+
+    mimetype = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+    return Response(gen(), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.post('/ocr_jobs')
+def ocr_jobs_submit():
+    data = request.get_json(force=True) or {}
+    spec = parse_ocr_spec(data)
+    if not has_pdf_source(spec):
+        return jsonify({"error": "pdf_url required (or a pdf_name present in PDF_DIR)"}), 400
+    job = jobs.submit(spec)
+    return jsonify(job.to_dict()), 202
+
+@app.get('/ocr_jobs')
+def ocr_jobs_list():
+    pdf_name = request.args.get('pdf_name')
+    return jsonify([j.to_dict() for j in jobs.list(norm(pdf_name) if pdf_name else None)])
+
+@app.get('/ocr_jobs/<job_id>')
+def ocr_jobs_get(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "not_found"}), 404
+    return jsonify(job.to_dict())
 
-        # 批尾再收一次
-        fitz.TOOLS.store_shrink(1); gc.collect()
+@app.get('/ocr_jobs/<job_id>/stream')
+def ocr_jobs_stream(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "not_found"}), 404
+    fmt = request.args.get('format', 'ndjson')
+    return stream_job(job, fmt if fmt in ('ndjson', 'sse') else 'ndjson')
 
-    # 统一按页序读回（也作为返回值）
-    result_pages = []
-    for i in pages_idx:
-        jpath = root / f'page_{i+1:04d}_{dpi}_rapidocr.json'
-        if jpath.exists():
-            try:
-                result_pages.append(json.loads(jpath.read_text('utf-8')))
-            except Exception:
-                continue
+@app.post('/ocr_jobs/<job_id>/cancel')
+def ocr_jobs_cancel(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "not_found"}), 404
+    return jsonify(job.to_dict())
+
+@app.get('/llm_cache_stats')
+def llm_cache_stats():
+    return jsonify(llm_cache().stats())
+
+@app.get('/llm_client_stats')
+def llm_client_stats():
+    return jsonify(llm_client.stats())
+
+# 内存：峰值 RSS / GC 次数与耗时 / 当前压力等级（主进程 + 各工作进程）
+@app.get('/mem_stats')
+def mem_stats_get():
+    return jsonify(dict(mem_stats(), qa_docs=doc_cache_stats()))
+
+# Prometheus 抓取：直方图/计数器之外，上面几个 *_stats 的数字在抓取时现读
+def _collect_metrics():
+    MB = 1048576
+    gov = governor()
+    procs = [('main', gov.stats())] + list(ocr_pool.worker_mem_stats().items())
+    yield ('ocr_process_rss_bytes', 'gauge', '进程当前 RSS（main + 各 OCR 工作进程最近上报）',
+           [({'process': p}, st['rss_mb'] * MB) for p, st in procs])
+    yield ('ocr_process_peak_rss_bytes', 'gauge', '进程峰值 RSS', [({'process': p}, st['peak_rss_mb'] * MB) for p, st in procs])
+    yield ('ocr_mem_level', 'gauge', '内存压力等级（0 正常 / 1 超软线 / 2 超硬线）', [({'process': p}, st['level']) for p, st in procs])
+    yield ('ocr_gc_seconds_total', 'counter', '内存回收（store 收缩 + gc.collect）累计耗时', [({'process': p}, st['gc_ms'] / 1000) for p, st in procs])
+
+    cache = llm_cache()
+    c = cache.stats()
+    yield ('llm_cache_requests_total', 'counter', 'LLM 缓存查询（hit / miss / shared 单飞搭车 / error），按 kind',
+           [({'kind': k, 'result': r}, v[f]) for k, v in sorted(c['kinds'].items())
+            for r, f in (('hit', 'hits'), ('miss', 'misses'), ('shared', 'shared'), ('error', 'errors'))])
+    yield ('llm_cache_entries', 'gauge', 'LLM 缓存条目数', [({}, c['entries'])])
+    yield ('llm_cache_bytes', 'gauge', 'LLM 缓存大小', [({}, cache.bytes)])
+    yield ('llm_cache_evictions_total', 'counter', 'LLM 缓存淘汰数', [({}, c['evictions'])])
+
+    d = pdf_source.doc_cache().stats()
+    yield ('pdf_doc_cache_requests_total', 'counter', '打开的 PDF 句柄缓存查询（本地文件）',
+           [({'result': 'hit'}, d['hits']), ({'result': 'miss'}, d['misses'])])
+    yield ('pdf_doc_cache_docs', 'gauge', '常驻的 PDF 句柄数', [({}, d['docs'])])
+
+    q = doc_cache_stats()
+    yield ('qa_doc_cache_requests_total', 'counter', 'QA 文档缓存查询', [({'result': 'hit'}, q['hits']), ({'result': 'miss'}, q['misses'])])
+    yield ('qa_doc_cache_bytes', 'gauge', 'QA 文档缓存估算大小', [({}, q['mb'] * MB)])
+
+    s = llm_client.stats()
+    yield ('llm_requests_total', 'counter', 'LLM 上游调用（ok / error / busy 排队超时，busy 也计入 error）',
+           [({'outcome': 'ok'}, s['ok']), ({'outcome': 'error'}, s['errors']), ({'outcome': 'busy'}, s['busy'])])
+    yield ('llm_retries_total', 'counter', 'LLM 上游重试次数', [({}, s['retries'])])
+    yield ('llm_tokens_total', 'counter', 'LLM token 用量（上游 usage；stub 不计）',
+           [({'type': 'prompt'}, s['prompt_tokens']), ({'type': 'completion'}, s['completion_tokens'])])
+    yield ('llm_in_flight', 'gauge', '在途 LLM 请求', [({}, s['in_flight'])])
+    yield ('llm_waiting', 'gauge', '排队等并发名额的 LLM 请求', [({}, s['waiting'])])
+
+    by_status: Dict[str, int] = {}
+    for j in jobs.list():
+        by_status[j.status] = by_status.get(j.status, 0) + 1
+    yield ('ocr_jobs', 'gauge', 'OCR 任务数（按状态）', [({'status': k}, v) for k, v in sorted(by_status.items())])
+
+metrics.register(_collect_metrics)
+
+@app.get('/metrics')
+def metrics_get():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-    # 写“整本合并缓存”（兼容 /ocr_cache）
-    combine_path = Path(cache_path(pdf_name, dpi, tile, overlap))
-    write_json_atomic(combine_path, result_pages)
+# ---------------- 读取整本合并缓存（兼容旧前端） ----------------
+GZIP_MIN_BYTES = 2048
+_gz_cache: Dict[str, bytes] = {}   # ETag → 压缩后的响应体（同一份内容只压一次）
+_GZ_CACHE_MAX = 32
+_gz_lock = threading.Lock()
 
-    doc.close()
-    fitz.TOOLS.store_shrink(1); gc.collect()
-    return jsonify(result_pages)
+def parse_page_sel(args):
+    """
+    pages=1,3,5-8 或 from/to（闭区间，1-based）；都没有 = 整本。
+    返回 (page_nos 或 None, start, end)
+    """
+    raw = (args.get("pages") or "").strip()
+    if raw:
+        nums = set()
+        for part in raw.split(","):
+            part = part.strip()
+            if "-" in part:
+                a, b = part.split("-", 1)
+                nums.update(range(int(a), int(b) + 1))
+            elif part:
+                nums.add(int(part))
+        return sorted(nums), None, None
+    start, end = args.get("from"), args.get("to")
+    return None, (int(start) if start else None), (int(end) if end else None)
+
+def cached_json_response(make_body, etag: str, headers: dict = None) -> Response:
+    # ETag 复验 + 按需 gzip；304 时不序列化
+    etag_q = f'"{etag}"'
+    base = {"ETag": etag_q, "Cache-Control": "no-cache", "Vary": "Accept-Encoding", **(headers or {})}
+    if etag_q in [t.strip() for t in (request.headers.get("If-None-Match") or "").split(",")]:
+        return Response(status=304, headers=base)
+    gz = "gzip" in (request.headers.get("Accept-Encoding") or "")
+    body = _gz_cache.get(etag) if gz else None
+    if body is None:
+        body = json.dumps(make_body(), ensure_ascii=False).encode("utf-8")
+        if gz and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body, 6)
+            with _gz_lock:
+                _gz_cache[etag] = body
+                while len(_gz_cache) > _GZ_CACHE_MAX:
+                    _gz_cache.pop(next(iter(_gz_cache)))
+        else:
+            gz = False
+    if gz:
+        base["Content-Encoding"] = "gzip"
+    return Response(body, mimetype="application/json", headers=base)
 
-# ---------------- 读取整本合并缓存（兼容旧前端） ----------------
 @app.get("/ocr_cache")
 def ocr_cache_get():
     pdf_name = request.args.get("pdf_name")
@@ -311,11 +534,93 @@ def ocr_cache_get():
     overlap = float(request.args.get("overlap", OVERLAP_DEFAULT))
     if not pdf_name:
         return jsonify({"error": "pdf_name required"}), 400
+    try:
+        page_nos, start, end = parse_page_sel(request.args)
+    except ValueError:
+        return jsonify({"error": "bad page selection"}), 400
+
+    book = ocr_book.open_book(CACHE_DIR / norm(pdf_name), dpi)
+    if book is not None:
+        nums = book.page_numbers
+        info = {"X-Pages-Total": str(book.n_pages), "X-Page-Max": str(int(nums[-1]) if len(nums) else 0)}
+        if page_nos is not None:
+            make = lambda: [p for p in map(book.page, page_nos) if p is not None]
+        else:
+            make = lambda: book.pages(start, end)
+        return cached_json_response(make, book.etag(page_nos, start, end), info)
+
+    # 回退：旧的整本 JSON 文件
     p = cache_path(pdf_name, dpi, tile, overlap)
     if not os.path.exists(p):
         return jsonify({"error": "not_found"}), 404
-    with open(p, "r", encoding="utf-8") as f:
-        return jsonify(json.load(f))
+    st = os.stat(p)
+    etag = hashlib.sha1(f"{p}|{st.st_mtime_ns}|{st.st_size}|{page_nos}|{start}|{end}".encode()).hexdigest()
+
+    def make():
+        with open(p, "r", encoding="utf-8") as f:
+            arr = json.load(f)
+        if page_nos is not None:
+            want = set(page_nos)
+            return [x for x in arr if x.get("page") in want]
+        return [x for x in arr if (start is None or x.get("page", 0) >= start) and (end is None or x.get("page", 0) <= end)]
+    return cached_json_response(make, etag)
+
+# ---------------- 服务端检索（倒排索引，不必把整本 OCR 下发到浏览器） ----------------
+@app.post("/search")
+def search():
+    data = request.get_json(force=True) or {}
+    pdf_name = norm(str(data.get("pdf_name") or "").strip())
+    query = str(data.get("query") or "").strip()
+    if not pdf_name or not query:
+        return jsonify({"error": "pdf_name & query required"}), 400
+    dpi = int(data.get("dpi", DPI_DEFAULT))
+    terms = [query] + [str(t) for t in (data.get("terms") or [])]  # 前端展开的同义词
+    limit = max(1, min(int(data.get("limit", 500)), 5000))
+    res = search_index.search(CACHE_DIR / pdf_name, dpi, terms, limit=limit)
+    if not res.get("indexed"):
+        return jsonify({**res, "error": "not_indexed"}), 404
+    return jsonify(res)
+
+# ---------------- 全库检索 / 问答 ----------------
+def _names_arg(v) -> Optional[list]:
+    # docs 可为列表或逗号分隔串；缺省即全库
+    if not v:
+        return None
+    items = v if isinstance(v, list) else str(v).split(",")
+    return [norm(str(x).strip()) for x in items if str(x).strip()] or None
+
+@app.get("/library")
+def library_list():
+    return jsonify(library.stats())
+
+@app.post("/library/search")
+def library_search():
+    data = request.get_json(force=True) or {}
+    query = str(data.get("query") or "").strip()
+    if not query:
+        return jsonify({"error": "query required"}), 400
+    dpi = int(data["dpi"]) if data.get("dpi") else None
+    terms = [query] + [str(t) for t in (data.get("terms") or [])]
+    limit = max(1, min(int(data.get("limit", 200)), 5000))
+    return jsonify(library.search(terms, dpi=dpi, limit=limit, names=_names_arg(data.get("docs"))))
+
+@app.post("/library/qa")
+def library_qa():
+    data = request.get_json(force=True) or {}
+    question = str(data.get("question") or "").strip()
+    if not question:
+        return jsonify({"error": "question required"}), 400
+    top_k = int(data.get("top_k", 80))
+    window = int(data.get("window", 2))
+    max_docs = max(1, min(int(data.get("max_docs", library.LIBRARY_QA_DOCS)), 10))
+    try:
+        return jsonify(qa_over_library(question, top_k=top_k, window=window,
+                                       pdf_names=_names_arg(data.get("docs")), max_docs=max_docs))
+    except llm_client.LLMBusy as e:
+        return jsonify({"error": "llm_busy", "detail": str(e)}), 503
+    except Exception as e:
+        app.logger.exception("library QA failed")
+        return jsonify({"error": "qa_failed", "detail": str(e)}), 500
 
 # ---------------- LLM 同义词（保留） ----------------
 @app.post("/synonyms")
@@ -326,8 +631,11 @@ def synonyms():
     if not query:
         return jsonify({"synonyms": [], "abbreviations": [], "english": []})
 
-    vocab = load_vocab_from_ocr_cache(pdf_name) if pdf_name else []
+    t0 = time.perf_counter()
+    vocab = load_vocab_from_ocr_cache(pdf_name, query) if pdf_name else []
+    t1 = time.perf_counter()
     res = llm_expand_synonyms(query, vocab, pdf_key=(pdf_name or "global"))
+    metrics.observe_stages("synonyms", {"vocab": t1 - t0, "llm": time.perf_counter() - t1})
     return jsonify(res)
 
 @app.get("/cache_stats")
@@ -343,8 +651,9 @@ def cache_stats():
     if not root.exists():
         return jsonify({"error": "cache_dir_not_found"}), 404
 
-    stats = []
-    for j in sorted(root.glob(f"page_*_{dpi}_rapidocr.json")):
+    book = ocr_book.open_book(root, dpi)
+    stats = book.page_stats() if book is not None else []
+    for j in ([] if book is not None else sorted(root.glob(f"page_*_{dpi}_rapidocr.json"))):
         try:
             obj = json.loads(j.read_text('utf-8'))
             stats.append({"page": obj.get("page"), "hits": len(obj.get("hits") or [])})
@@ -369,7 +678,9 @@ def cache_stats():
         "nonzero_pages": sum(1 for s in stats if s["hits"] > 0),
         "total_hits": sum(s["hits"] for s in stats),
         "first_10": stats[:10],
-        "combine": comb
+        "combine": comb,
+        "book": ({"file": book.path.name, "bytes": book.path.stat().st_size, "pages": book.n_pages, "hits": book.n_hits}
+                 if book is not None else None)
     })
 
 @app.post("/qa")
@@ -384,6 +695,9 @@ def qa_endpoint():
     try:
         res = qa_over_pdf(pdf_name, question, top_k=top_k, window=window)
         return jsonify(res)
+    except llm_client.LLMBusy as e:
+        # 上游排队已满：让前端稍后重试，而不是一直挂着
+        return jsonify({"error": "llm_busy", "detail": str(e)}), 503
     except Exception as e:
         app.logger.exception("QA failed")
         return jsonify({"error": "qa_failed", "detail": str(e)}), 500
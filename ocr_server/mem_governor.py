@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+内存预算调度：取代“每块都 store_shrink + gc.collect”。
+
+每个检查点（块 / 页 / 批结束）只读一下 RSS 和 MuPDF 缓存大小：
+  - MuPDF store 超过 OCR_STORE_BUDGET_MB → 只收缩 store
+  - RSS 超过 预算 × OCR_MEM_SOFT → 收缩 store + 整体 GC
+  - 收完仍超过软线/硬线 → 压力等级 1/2，后续页改用更小的块、更少的合批页数，并提前送识别
+一个进程一份（工作进程各自统计），stats() 给出峰值 RSS 与 GC 耗时等计数。
+
+配置（环境变量）：
+  OCR_MEM_BUDGET_MB    进程内存预算（默认 3072）
+  OCR_MEM_SOFT         软线比例（默认 0.7）
+  OCR_MEM_HARD         硬线比例（默认 0.9）
+  OCR_STORE_BUDGET_MB  MuPDF 资源缓存上限（默认 256）
+  OCR_MIN_TILE         压力下块尺寸的下限（默认 800）
+"""
+import os, gc, time, threading
+from typing import Dict
+import fitz  # PyMuPDF
+
+MEM_BUDGET_MB = int(os.environ.get("OCR_MEM_BUDGET_MB", "3072"))
+MEM_SOFT = float(os.environ.get("OCR_MEM_SOFT", "0.7"))
+MEM_HARD = float(os.environ.get("OCR_MEM_HARD", "0.9"))
+STORE_BUDGET_MB = int(os.environ.get("OCR_STORE_BUDGET_MB", "256"))
+MIN_TILE = int(os.environ.get("OCR_MIN_TILE", "800"))
+
+_MB = 1024 * 1024
+try:
+    _PAGE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE = 4096
+
+def rss_bytes() -> int:
+    # Linux 直接读 /proc（零依赖、微秒级）；其它平台退回 getrusage 的峰值
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import resource, sys
+        ru = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return ru if sys.platform == "darwin" else ru * 1024
+    except Exception:
+        return 0
+
+def store_bytes() -> int:
+    # PyMuPDF 不同版本里 store_size 是属性或方法
+    try:
+        v = fitz.TOOLS.store_size
+        return int(v() if callable(v) else v)
+    except Exception:
+        return 0
+
+class MemoryGovernor:
+    def __init__(self, budget_mb: int = MEM_BUDGET_MB, soft: float = MEM_SOFT, hard: float = MEM_HARD,
+                 store_budget_mb: int = STORE_BUDGET_MB):
+        self.budget = budget_mb * _MB
+        self.soft = self.budget * soft
+        self.hard = self.budget * hard
+        self.store_budget = store_budget_mb * _MB
+        self.level = 0              # 0 正常 / 1 超软线 / 2 超硬线
+        self.peak_rss = 0
+        self.checks = 0
+        self.shrinks = 0
+        self.collections = 0
+        self.gc_sec = 0.0
+        self._lock = threading.Lock()
+
+    def checkpoint(self) -> int:
+        """读数并按需回收；返回当前压力等级"""
+        with self._lock:
+            self.checks += 1
+            rss = rss_bytes()
+            self.peak_rss = max(self.peak_rss, rss)
+            if store_bytes() > self.store_budget:
+                fitz.TOOLS.store_shrink(50)
+                self.shrinks += 1
+            if rss >= self.soft:
+                t0 = time.perf_counter()
+                fitz.TOOLS.store_shrink(100)
+                gc.collect()
+                self.gc_sec += time.perf_counter() - t0
+                self.shrinks += 1
+                self.collections += 1
+                rss = rss_bytes()
+            self.level = 2 if rss >= self.hard else 1 if rss >= self.soft else 0
+            return self.level
+
+    def release(self):
+        # 一份文档/任务结束：无条件归还，不计入压力
+        with self._lock:
+            t0 = time.perf_counter()
+            fitz.TOOLS.store_shrink(100)
+            gc.collect()
+            self.gc_sec += time.perf_counter() - t0
+            self.collections += 1
+            self.level = 0
+
+    # ---- 压力下的自适应 ----
+    def tile_size(self, tile: int) -> int:
+        if self.level >= 2:
+            return max(MIN_TILE, tile // 2)
+        if self.level == 1:
+            return max(MIN_TILE, int(tile * 0.75))
+        return tile
+
+    def batch_pages(self, n: int) -> int:
+        return 1 if self.level else n
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "budget_mb": round(self.budget / _MB),
+            "rss_mb": round(rss_bytes() / _MB, 1),
+            "peak_rss_mb": round(self.peak_rss / _MB, 1),
+            "store_mb": round(store_bytes() / _MB, 1),
+            "level": self.level,
+            "checks": self.checks,
+            "shrinks": self.shrinks,
+            "gc_count": self.collections,
+            "gc_ms": round(self.gc_sec * 1000, 1),
+        }
+
+_gov = None
+
+def governor() -> MemoryGovernor:
+    global _gov
+    if _gov is None:
+        _gov = MemoryGovernor()
+    return _gov
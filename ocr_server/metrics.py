@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+进程内指标，/metrics 以 Prometheus 文本格式（0.0.4）输出；零依赖，不引入 prometheus_client。
+
+- Counter / Histogram：带标签、线程安全；直方图按累计桶（le）输出，另有 _sum / _count
+- 采集回调（register）：已有的统计（内存调度、LLM 缓存、QA 文档缓存、LLM 客户端在途数、任务队列…）
+  在抓取时现读，不重复记账
+- OCR 分阶段：每页 JSON 的 timing（毫秒）在主进程汇入 ocr_stage_seconds；
+  进程池模式下工作进程随结果带回同样的摘要（page_summary），主进程统一记
+"""
+import math, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 秒：从单块检测的毫秒级到整本同步 OCR 的分钟级
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_metrics: Dict[str, "_Metric"] = {}
+_collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _fmt(v: float) -> str:
+    if isinstance(v, float):
+        if math.isinf(v):
+            return "+Inf" if v > 0 else "-Inf"
+        if v.is_integer() and abs(v) < 1e15:
+            return str(int(v))
+        return repr(v)
+    return str(v)
+
+def _labels(pairs: Sequence[Tuple[str, object]]) -> str:
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values: Dict[tuple, object] = {}
+
+    def _key(self, labels: Dict[str, object]) -> tuple:
+        return tuple(str(labels.get(k, "")) for k in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if amount <= 0:
+            return
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with _lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(list(zip(self.labelnames, k)))} {_fmt(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)   # 第一个 ≥ value 的桶（le 语义）
+        with _lock:
+            st = self._values.get(key)
+            if st is None:
+                st = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            st[0][i] += 1
+            st[1] += value
+            st[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self) -> List[str]:
+        with _lock:
+            items = sorted((k, (list(st[0]), st[1], st[2])) for k, st in self._values.items())
+        out = []
+        for key, (counts, total, n) in items:
+            base = list(zip(self.labelnames, key))
+            acc = 0
+            for le, c in zip(self.buckets + (math.inf,), counts):
+                acc += c
+                out.append(f"{self.name}_bucket{_labels(base + [('le', _fmt(float(le)))])} {acc}")
+            out.append(f"{self.name}_sum{_labels(base)} {_fmt(round(total, 6))}")
+            out.append(f"{self.name}_count{_labels(base)} {n}")
+        return out
+
+def _get(cls, name: str, *args, **kw):
+    # 同名重复声明返回已有的那个（模块重载 / 多处引用）
+    with _lock:
+        m = _metrics.get(name)
+        if m is None:
+            m = _metrics[name] = cls(name, *args, **kw)
+    return m
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return _get(Counter, name, help, labels)
+
+def histogram(name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = BUCKETS) -> Histogram:
+    return _get(Histogram, name, help, labels, buckets)
+
+def register(fn: Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]):
+    """fn() 产出 (name, type, help, [(labels, value)])；抓取时调用，出错的回调跳过"""
+    _collectors.append(fn)
+
+def render() -> str:
+    lines: List[str] = []
+    for m in list(_metrics.values()):
+        body = m.render()
+        if body:
+            lines += m.header() + body
+    for fn in list(_collectors):
+        try:
+            families = list(fn())
+        except Exception:
+            continue
+        for name, kind, help, samples in families:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_labels(sorted(lab.items()))} {_fmt(float(v))}" for lab, v in samples]
+    return "\n".join(lines) + "\n"
+
+# ---------------- 各路由的分阶段耗时（问答 / 同义词） ----------------
+ROUTE_STAGE = histogram("route_stage_seconds", "接口内各阶段耗时（load/rank/retrieve/llm/vocab…）", ("route", "stage"))
+
+def observe_stages(route: str, timing: Dict[str, float]):
+    """timing 为 {阶段: 秒}"""
+    for stage, sec in timing.items():
+        ROUTE_STAGE.observe(sec, route=route, stage=stage)
+
+# ---------------- OCR ----------------
+OCR_STAGE = histogram("ocr_stage_seconds", "OCR 每页各阶段耗时（render/blank/to_image/detect/recognize/restore/dedup/layout/gc/write…）", ("stage",))
+OCR_PAGE = histogram("ocr_page_seconds", "OCR 每页各阶段合计耗时")
+OCR_PAGES = counter("ocr_pages_total", "处理的页数（ocr = 实际识别，cache = 缓存命中）", ("source",))
+OCR_TILES = counter("ocr_tiles_total", "分块数（ocr = 送识别，blank = 空白预筛跳过，no_raster = 文字层覆盖跳过）", ("result",))
+OCR_HITS = counter("ocr_hits_total", "产出的文字条目数（ocr / text_layer）", ("source",))
+
+def page_summary(out: dict, write_sec: float = 0.0) -> dict:
+    """从页结果里取记指标要用的部分（小、可 pickle，供工作进程带回主进程）"""
+    timing = dict(out.get("timing") or {})
+    if write_sec:
+        timing["write"] = round(1000 * write_sec, 2)
+    tiles = out.get("tiles") or {}
+    n_layer = int(out.get("text_layer_hits") or 0)
+    return {"timing": timing, "tiles": {k: int(tiles.get(k, 0)) for k in ("ocr", "blank", "no_raster")},
+            "hits": len(out.get("hits") or []) - n_layer, "text_layer_hits": n_layer}
+
+def observe_ocr_page(summary: Optional[dict]):
+    if not summary:
+        return
+    OCR_PAGES.inc(source="ocr")
+    timing = summary.get("timing") or {}
+    for stage, ms in timing.items():
+        OCR_STAGE.observe(ms / 1000, stage=stage)
+    if timing:
+        OCR_PAGE.observe(sum(timing.values()) / 1000)
+    for k, v in (summary.get("tiles") or {}).items():
+        OCR_TILES.inc(v, result=k)
+    OCR_HITS.inc(summary.get("hits", 0), source="ocr")
+    OCR_HITS.inc(summary.get("text_layer_hits", 0), source="text_layer")
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+整本 OCR 结果的列式二进制存储（CACHE_DIR/<pdf_name>/book_{dpi}.ocrb）。
+
+逐页 JSON 仍是写入时的事实来源；一份文档 OCR 完成后从页 JSON 增量更新本文件
+（只解析新写的页，其余页按字节从旧文件搬过来），读取方（/ocr_cache、/cache_stats、QA、词表）优先走它：mmap 打开，不整本解析。
+
+布局（小端，各段 8 字节对齐）：
+  header 256B  magic 'OCRB' | version u32 | n_pages u32 | 保留 u32 | n_hits u64 | 7 × (offset u64, length u64)
+  pages        结构化数组 (page i4, w i4, h i4, n u4, start u8, digest u8, h90 f4)，按页码升序；digest 为该页内容摘要（ETag 用）
+  boxes        i4[n_hits, 4]   x, y, w, h
+  conf         f4[n_hits]
+  text_off     u8[n_hits + 1]  text 段内的字节偏移
+  text         UTF-8 字符串表
+  layout       ocr_layout.HIT_DTYPE[n_hits]  行号 / 行密度 / 标题·表格标记（页 JSON 的 layout 字段，旧页现算）
+  meta         JSON：每页除 page/w/h/hits/layout 以外的字段（tiles、dedup、cache_key…）
+
+页/页段切片直接是 mmap 上的 NumPy 视图（零拷贝）；文本按需解码。
+转换已有缓存：python ocr_book.py <CACHE_DIR> [--dpi 500]
+"""
+import os, json, mmap, struct, hashlib, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import ocr_layout
+
+MAGIC = b"OCRB"
+VERSION = 3
+_SECTIONS = ("pages", "boxes", "conf", "text_off", "text", "layout", "meta")
+_HEADER = struct.Struct(f"<4sIIIQ{2 * len(_SECTIONS)}Q")
+HEADER_SIZE = 256
+PAGE_DTYPE = np.dtype([("page", "<i4"), ("w", "<i4"), ("h", "<i4"), ("n", "<u4"), ("start", "<u8"), ("digest", "<u8"),
+                       ("h90", "<f4")])
+
+def book_path(doc_root: Path, dpi: int) -> Path:
+    return Path(doc_root) / f"book_{dpi}.ocrb"
+
+def page_json_files(doc_root: Path, dpi: int) -> List[Path]:
+    return sorted(Path(doc_root).glob(f"page_*_{dpi}_rapidocr.json"))
+
+# ---------------- 写 ----------------
+class _Part:
+    """一页的紧凑表示：既可由页 JSON 生成，也可从旧书原样切出（增量更新时不解码）"""
+    __slots__ = ("page", "w", "h", "boxes", "conf", "text", "offs", "extras", "h90", "layout")
+
+    def digest(self) -> int:
+        h = hashlib.blake2b(digest_size=8)
+        h.update(struct.pack("<ii", self.w, self.h))
+        h.update(np.ascontiguousarray(self.boxes, "<i4").tobytes())
+        h.update(np.ascontiguousarray(self.conf, "<f4").tobytes())
+        h.update((np.asarray(self.offs, "<u8") - np.uint64(self.offs[0])).tobytes())
+        h.update(self.text)
+        h.update(json.dumps(self.extras, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+        return int.from_bytes(h.digest(), "little")
+
+def _part_from_obj(obj: dict) -> _Part:
+    hits = obj.get("hits") or []
+    p = _Part()
+    p.page, p.w, p.h = int(obj.get("page") or 0), int(obj.get("w") or 0), int(obj.get("h") or 0)
+    p.boxes = np.zeros((len(hits), 4), dtype="<i4")
+    p.conf = np.zeros(len(hits), dtype="<f4")
+    texts, offs, pos = [], [0], 0
+    for k, h in enumerate(hits):
+        box = h.get("box") or {}
+        p.boxes[k] = (box.get("x", 0), box.get("y", 0), box.get("w", 0), box.get("h", 0))
+        p.conf[k] = float(h.get("conf") or 0.0)
+        t = str(h.get("text", "")).encode("utf-8")
+        texts.append(t)
+        pos += len(t)
+        offs.append(pos)
+    p.text, p.offs = b"".join(texts), np.asarray(offs, dtype="<u8")
+    p.extras = {k: v for k, v in obj.items() if k not in ("page", "w", "h", "hits", "layout")}
+    # 版面特征由内容决定，不进摘要；OCR 时已算好就直接用，旧缓存的页现算
+    lay = ocr_layout.from_json(obj.get("layout"), len(hits)) or ocr_layout.analyze(p.boxes, [h.get("text", "") for h in hits])
+    p.h90, p.layout = lay["h90"], lay["hits"]
+    return p
+
+def write_book(path: Path, pages: Iterable) -> int:
+    """pages 为页 JSON 对象或 _Part（可混用、可为生成器），只累积紧凑数组；返回写入的页数"""
+    parts = sorted((x if isinstance(x, _Part) else _part_from_obj(x) for x in pages), key=lambda p: p.page)
+    rows, offs, n_hits, text_len = [], [np.zeros(1, "<u8")], 0, 0
+    for p in parts:
+        n = len(p.conf)
+        rows.append((p.page, p.w, p.h, n, n_hits, p.digest(), p.h90))
+        offs.append(p.offs[1:] - p.offs[0] + text_len)
+        n_hits += n
+        text_len += len(p.text)
+    blobs = [
+        np.array(rows, dtype=PAGE_DTYPE).tobytes(),
+        (np.concatenate([p.boxes for p in parts]) if parts else np.zeros((0, 4))).astype("<i4").tobytes(),
+        (np.concatenate([p.conf for p in parts]) if parts else np.zeros(0)).astype("<f4").tobytes(),
+        np.concatenate(offs).astype("<u8").tobytes(),
+        b"".join(p.text for p in parts),
+        (np.concatenate([p.layout for p in parts]) if parts else np.zeros(0, ocr_layout.HIT_DTYPE)).tobytes(),
+        json.dumps([p.extras for p in parts], ensure_ascii=False).encode("utf-8"),
+    ]
+    table, pos = [], HEADER_SIZE
+    for blob in blobs:
+        table += [pos, len(blob)]
+        pos += len(blob) + (-len(blob)) % 8
+
+    path = Path(path)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(rows), 0, n_hits, *table).ljust(HEADER_SIZE, b"\0"))
+        for blob in blobs:
+            f.write(blob)
+            f.write(b"\0" * ((-len(blob)) % 8))
+    tmp.replace(path)
+    return len(rows)
+
+def _read_page_json(p: Path) -> Optional[dict]:
+    try:
+        return json.loads(p.read_text("utf-8"))
+    except Exception:
+        return None
+
+def build_from_json(doc_root: Path, dpi: int) -> Optional[Path]:
+    """把某 dpi 的全部页 JSON 汇成一本；没有页时删除旧文件"""
+    files = page_json_files(doc_root, dpi)
+    out = book_path(doc_root, dpi)
+    if not files:
+        if out.exists():
+            out.unlink()
+        return None
+    write_book(out, (obj for obj in map(_read_page_json, files) if obj is not None))
+    return out
+
+def update_from_json(doc_root: Path, dpi: int) -> Optional[Path]:
+    """
+    增量更新：只解析不早于书的页 JSON（mtime 纳秒严格比较），其余页从旧书按字节切出原样写回；
+    页 JSON 已删除的页随之去掉。没有旧书（或版本不符）时整本生成。
+    """
+    out = book_path(doc_root, dpi)
+    try:
+        old = OcrBook(out) if out.exists() else None
+    except (OSError, ValueError):
+        old = None
+    if old is None:
+        return build_from_json(doc_root, dpi)
+    built = out.stat().st_mtime_ns
+    files = page_json_files(doc_root, dpi)
+    if not files:
+        old.close()
+        out.unlink()
+        return None
+    parts, fresh = [], 0
+    for f in files:
+        try:
+            page_no = int(f.stem.split("_")[1])
+        except (IndexError, ValueError):
+            continue
+        k = old._index(page_no)
+        # 与书同一时间刻写的页不能确定早于书（粗粒度时间戳的文件系统上更常见）：按新页重读
+        if k is not None and f.stat().st_mtime_ns < built:
+            parts.append(old._part(k))
+            continue
+        obj = _read_page_json(f)
+        if obj is not None:
+            part = _part_from_obj(obj)
+            parts.append(part)
+            # 重读后内容摘要与书里一致（同一时间刻写的旧页）不算更新，免得无谓重写整本
+            if k is None or part.digest() != int(old.pages_arr[k]["digest"]):
+                fresh += 1
+    if fresh or len(parts) != old.n_pages:
+        write_book(out, parts)
+    # 内容未变不碰文件：mtime 不变，QA 文档缓存、搜索索引等按 mtime 判失效的读者照旧命中
+    del parts
+    old.close()
+    return out
+
+# ---------------- 读 ----------------
+class OcrBook:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, ver, n_pages, _, n_hits, *table = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or ver != VERSION:
+            self._mm.close()
+            raise ValueError(f"not an OCR book (v{VERSION}): {self.path}")
+        sec = {name: (table[2 * i], table[2 * i + 1]) for i, name in enumerate(_SECTIONS)}
+        self._buf = buf = memoryview(self._mm)
+        self.n_pages, self.n_hits = n_pages, n_hits
+        self.pages_arr = np.frombuffer(buf, PAGE_DTYPE, n_pages, sec["pages"][0])
+        self.boxes = np.frombuffer(buf, "<i4", n_hits * 4, sec["boxes"][0]).reshape(n_hits, 4)
+        self.conf = np.frombuffer(buf, "<f4", n_hits, sec["conf"][0])
+        self.text_off = np.frombuffer(buf, "<u8", n_hits + 1, sec["text_off"][0])
+        self._text_base = sec["text"][0]
+        self.layout = np.frombuffer(buf, ocr_layout.HIT_DTYPE, n_hits, sec["layout"][0])
+        self._meta_sec = sec["meta"]
+        self._meta: Optional[List[dict]] = None
+
+    def close(self):
+        """
+        释放映射：先丢掉本对象持有的 NumPy 视图与 memoryview，再关 mmap。
+        只给独占持有者用（如 update_from_json 里的旧书）；调用方仍握着切片时关不掉，交给 GC。
+        """
+        self.pages_arr = self.boxes = self.conf = self.text_off = self.layout = None
+        try:
+            self._buf.release()
+            self._mm.close()
+        except BufferError:
+            pass
+
+    @property
+    def page_numbers(self) -> np.ndarray:
+        return self.pages_arr["page"]
+
+    def _index(self, page_no: int) -> Optional[int]:
+        k = int(np.searchsorted(self.pages_arr["page"], page_no))
+        return k if k < self.n_pages and int(self.pages_arr["page"][k]) == page_no else None
+
+    def _range(self, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        nums = self.pages_arr["page"]
+        lo = 0 if start is None else int(np.searchsorted(nums, start, "left"))
+        hi = self.n_pages if end is None else int(np.searchsorted(nums, end, "right"))
+        return lo, max(lo, hi)
+
+    def text(self, i: int) -> str:
+        a, b = int(self.text_off[i]), int(self.text_off[i + 1])
+        return self._mm[self._text_base + a:self._text_base + b].decode("utf-8", "replace")
+
+    def _texts_of(self, s: int, e: int) -> List[str]:
+        # 一段连续 hit 的文本：整块读出再按偏移切，比逐条切 mmap 快
+        offs = self.text_off[s:e + 1].tolist()
+        if not offs:
+            return []
+        base = offs[0]
+        blob = self._mm[self._text_base + base:self._text_base + offs[-1]]
+        return [blob[a - base:b - base].decode("utf-8", "replace") for a, b in zip(offs, offs[1:])]
+
+    def texts(self, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[str]:
+        """按页码区间逐条产出文本（词表/索引用，不构造 hit 字典）"""
+        lo, hi = self._range(start, end)
+        if lo >= hi:
+            return
+        for k in range(lo, hi):
+            s = int(self.pages_arr["start"][k])
+            yield from self._texts_of(s, s + int(self.pages_arr["n"][k]))
+
+    def hit_arrays(self, page_no: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """(boxes 视图, conf 视图, 首条 hit 的全局序号)；页不存在返回空数组"""
+        k = self._index(page_no)
+        if k is None:
+            return self.boxes[:0], self.conf[:0], 0
+        s, n = int(self.pages_arr["start"][k]), int(self.pages_arr["n"][k])
+        return self.boxes[s:s + n], self.conf[s:s + n], s
+
+    def page_layout(self, page_no: int) -> dict:
+        """版面特征 {h90, hits: HIT_DTYPE 视图}，结构同 ocr_layout.analyze"""
+        k = self._index(page_no)
+        if k is None:
+            return {"h90": 0.0, "hits": self.layout[:0]}
+        s, n = int(self.pages_arr["start"][k]), int(self.pages_arr["n"][k])
+        return {"h90": float(self.pages_arr["h90"][k]), "hits": self.layout[s:s + n]}
+
+    def extras(self, k: int) -> dict:
+        if self._meta is None:
+            off, ln = self._meta_sec
+            self._meta = json.loads(self._mm[off:off + ln].decode("utf-8")) if ln else []
+        return self._meta[k] if k < len(self._meta) else {}
+
+    def _page_obj(self, k: int, with_extras: bool) -> dict:
+        row = self.pages_arr[k]
+        s, n = int(row["start"]), int(row["n"])
+        bx, cf = self.boxes[s:s + n].tolist(), self.conf[s:s + n].astype(float).round(6).tolist()
+        hits = [{"text": t, "conf": c, "box": {"x": b[0], "y": b[1], "w": b[2], "h": b[3]}}
+                for t, c, b in zip(self._texts_of(s, s + n), cf, bx)]
+        obj = {"page": int(row["page"]), "w": int(row["w"]), "h": int(row["h"]), "hits": hits}
+        if with_extras:
+            obj.update(self.extras(k))
+            obj["layout"] = ocr_layout.to_json({"h90": float(row["h90"]), "hits": self.layout[s:s + n]})
+        return obj
+
+    def page(self, page_no: int, with_extras: bool = True) -> Optional[dict]:
+        k = self._index(page_no)
+        return None if k is None else self._page_obj(k, with_extras)
+
+    def pages(self, start: Optional[int] = None, end: Optional[int] = None, with_extras: bool = True) -> List[dict]:
+        """页码闭区间 [start, end]，与页 JSON 同结构"""
+        lo, hi = self._range(start, end)
+        return [self._page_obj(k, with_extras) for k in range(lo, hi)]
+
+    def _part(self, k: int) -> _Part:
+        row = self.pages_arr[k]
+        s, n = int(row["start"]), int(row["n"])
+        p = _Part()
+        p.page, p.w, p.h = int(row["page"]), int(row["w"]), int(row["h"])
+        p.boxes, p.conf = self.boxes[s:s + n], self.conf[s:s + n]
+        p.offs = self.text_off[s:s + n + 1]
+        a, b = int(p.offs[0]), int(p.offs[-1])
+        p.text = self._mm[self._text_base + a:self._text_base + b]
+        p.extras = self.extras(k)
+        p.h90, p.layout = float(row["h90"]), self.layout[s:s + n]
+        return p
+
+    def etag(self, page_nos: Optional[Iterable[int]] = None, start: Optional[int] = None, end: Optional[int] = None) -> str:
+        """所选页的内容摘要合成 ETag：与文件重写无关，只随页内容变化"""
+        if page_nos is not None:
+            ks = [k for k in (self._index(int(p)) for p in sorted(set(page_nos))) if k is not None]
+            rows = self.pages_arr[ks]
+        else:
+            lo, hi = self._range(start, end)
+            rows = self.pages_arr[lo:hi]
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.ascontiguousarray(rows["page"]).tobytes())
+        h.update(np.ascontiguousarray(rows["digest"]).tobytes())
+        return h.hexdigest()
+
+    def page_stats(self) -> List[Dict[str, int]]:
+        return [{"page": int(p), "hits": int(n)} for p, n in zip(self.pages_arr["page"], self.pages_arr["n"])]
+
+# ---------------- 打开（按 mtime 区分版本 + 小 LRU） ----------------
+BOOK_LRU = int(os.environ.get("OCR_BOOK_LRU", "16"))   # 常驻句柄数下限；全库检索登记分片时抬到分片数
+_capacity = BOOK_LRU
+_open: "OrderedDict[Tuple[str, int, int], OcrBook]" = OrderedDict()
+_open_lock = threading.Lock()
+
+def reserve(n: int):
+    """全库检索登记分片后调用：常驻句柄至少覆盖全部分片"""
+    global _capacity
+    with _open_lock:
+        _capacity = max(BOOK_LRU, n)
+
+def open_book(doc_root: Path, dpi: int) -> Optional[OcrBook]:
+    """
+    打开当前的整本。书总是写临时文件再原子替换，OCR 进行中读到的是上一批结束时的完整版本，
+    新页随每批的 update_from_json 出现。
+    被淘汰的句柄不主动 close：别的线程可能还在读，最后一个引用释放时映射随之解除。
+    """
+    p = book_path(doc_root, dpi)
+    try:
+        st = p.stat()
+        key = (str(p), st.st_mtime_ns, st.st_ino)   # 原子替换必换 inode：同一时间刻重写的书也认得出
+    except OSError:
+        return None
+    with _open_lock:
+        book = _open.get(key)
+        if book is not None:
+            _open.move_to_end(key)
+            return book
+        try:
+            book = OcrBook(p)
+        except (OSError, ValueError):
+            return None
+        # 同一路径的旧版本随之淘汰
+        for k in [k for k in _open if k[0] == key[0]]:
+            del _open[k]
+        _open[key] = book
+        while len(_open) > _capacity:
+            _open.popitem(last=False)
+        return book
+
+def available_dpis(doc_root: Path) -> List[int]:
+    out = []
+    for p in Path(doc_root).glob("book_*.ocrb"):
+        try:
+            out.append(int(p.stem.split("_")[1]))
+        except (IndexError, ValueError):
+            continue
+    return sorted(out)
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="把 CACHE_DIR 下已有的页 JSON 转成 book_{dpi}.ocrb")
+    ap.add_argument("cache_dir", nargs="?", default=os.environ.get("CACHE_DIR", str(Path(__file__).resolve().parent / "data" / "cache")))
+    ap.add_argument("--dpi", type=int, default=None, help="只转换该 dpi（默认全部）")
+    args = ap.parse_args()
+    for root in sorted(Path(args.cache_dir).iterdir()):
+        if not root.is_dir() or root.name.startswith("_"):
+            continue
+        dpis = {args.dpi} if args.dpi else {int(p.stem.split("_")[2]) for p in root.glob("page_*_*_rapidocr.json")}
+        for dpi in sorted(dpis):
+            out = build_from_json(root, dpi)
+            if out:
+                print(f"{root.name} dpi={dpi} → {out.name} ({out.stat().st_size // 1024} KB)")
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+异步 OCR 任务队列：提交即返回 job_id，后台线程逐个执行。
+
+- 进度：每页回调更新 pages_done / pages/sec / ETA
+- 取消：置位后在页与页之间生效（已写盘的页保留）
+- 续跑：任务描述落盘到 jobs_dir/<id>.json；服务重启后未完成的任务重新入队，
+  已存在于 CACHE_DIR/<pdf_name>/ 且缓存 key 一致的页直接跳过
+- 流式：emitted 按完成顺序记录已可读的页（含缓存命中），wait_pages() 供流式接口回放 + 跟随
+"""
+import json, time, uuid, threading, queue, logging
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+ACTIVE = ("queued", "running")
+
+class Job:
+    def __init__(self, spec: Dict[str, Any], job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.spec = spec
+        self.status = "queued"          # queued / running / done / failed / cancelled
+        self.error: Optional[str] = None
+        self.pages_total = 0            # 本次需要 OCR 的页数（不含已缓存跳过的）
+        self.pages_skipped = 0          # 缓存命中、无需 OCR 的页
+        self.pages_done = 0
+        self.pages_failed: List[int] = []   # 进程池模式下单页失败（其余页照常完成）
+        self.last_page: Optional[int] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.resume = False
+        self.mem: Optional[Dict[str, Any]] = None  # 结束时的内存统计（峰值 RSS / GC 耗时）
+        self.emitted: List[int] = []    # 已写盘可读的页（1-based，按完成顺序）
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+
+    # ---- 由 runner 回调 ----
+    def set_total(self, total: int, skipped: int = 0):
+        self.pages_total = total
+        self.pages_skipped = skipped
+
+    def page_done(self, page_no: int):
+        self.pages_done += 1
+        self.last_page = page_no
+        self._emit(page_no)
+
+    def page_failed(self, page_no: int, exc: BaseException):
+        self.pages_failed.append(page_no)
+        log.warning("OCR job %s: page %d failed: %s", self.id, page_no, exc)
+
+    def page_cached(self, page_no: int):
+        # 缓存命中的页：不计进度，但流式接口也要输出
+        self._emit(page_no)
+
+    def _emit(self, page_no: int):
+        with self._cond:
+            self.emitted.append(page_no)
+            self._cond.notify_all()
+
+    def notify(self):
+        # 状态变化（开始/结束/取消）唤醒等待者
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait_pages(self, seen: int, timeout: float) -> List[int]:
+        """返回 emitted[seen:]；没有新页且任务未结束时最多等 timeout 秒"""
+        with self._cond:
+            if len(self.emitted) <= seen and self.status in ACTIVE:
+                self._cond.wait(timeout)
+            return self.emitted[seen:]
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    # ---- 序列化 ----
+    def to_dict(self) -> Dict[str, Any]:
+        now = self.finished_at or time.time()
+        elapsed = (now - self.started_at) if self.started_at else 0.0
+        rate = (self.pages_done / elapsed) if elapsed > 0 and self.pages_done else 0.0
+        remaining = max(0, self.pages_total - self.pages_done)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "pdf_name": self.spec.get("pdf_name"),
+            "params": {k: self.spec.get(k) for k in ("dpi", "tile", "overlap", "pages")},
+            "pages_total": self.pages_total,
+            "pages_skipped": self.pages_skipped,
+            "pages_done": self.pages_done,
+            "pages_failed": sorted(self.pages_failed),
+            "last_page": self.last_page,
+            "resumed": self.resume,
+            "progress": round(self.pages_done / self.pages_total, 4) if self.pages_total else (1.0 if self.status == "done" else 0.0),
+            "elapsed_sec": round(elapsed, 1),
+            "pages_per_sec": round(rate, 4),
+            "eta_sec": round(remaining / rate, 1) if rate > 0 and self.status == "running" else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "mem": self.mem,
+        }
+
+    def persist_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "spec": self.spec,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+        }
+
+class JobManager:
+    """
+    run_fn(spec, job) 负责实际 OCR：
+      - 调 job.set_total() 报告总页数
+      - 每写完一页调 job.page_done(page_no)
+      - 每页之前检查 job.cancelled
+      - 未 force 时跳过缓存命中的页（重启续跑即依赖这一点）
+    opts_fn(spec) 返回影响 OCR 结果的选项（补齐默认值），进入去重 key：选项不同的提交不会挂到已有任务上
+    """
+    def __init__(self, run_fn: Callable[[Dict[str, Any], "Job"], Any], jobs_dir: Path, keep_finished: int = 200,
+                 opts_fn: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None):
+        self.run_fn = run_fn
+        self.opts_fn = opts_fn
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.keep_finished = keep_finished
+        self._jobs: Dict[str, Job] = {}
+        self._q: "queue.Queue[str]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    # ---------------- 生命周期 ----------------
+    def start(self):
+        if self._worker is not None:
+            return
+        self._restore()
+        self._worker = threading.Thread(target=self._loop, name="ocr-jobs", daemon=True)
+        self._worker.start()
+
+    def _restore(self):
+        # 重启续跑：queued/running 的任务重新入队；force 只在首次执行时生效
+        for p in sorted(self.jobs_dir.glob("*.json"), key=lambda x: x.stat().st_mtime):
+            try:
+                obj = json.loads(p.read_text("utf-8"))
+            except Exception:
+                continue
+            job = Job(obj.get("spec") or {}, job_id=obj.get("job_id") or p.stem)
+            job.created_at = obj.get("created_at") or job.created_at
+            job.status = obj.get("status") or "failed"
+            job.error = obj.get("error")
+            self._jobs[job.id] = job
+            if job.status in ACTIVE:
+                job.status = "queued"
+                job.resume = True
+                job.spec["force"] = False
+                self._save(job)
+                self._q.put(job.id)
+                log.info("resuming OCR job %s (%s)", job.id, job.spec.get("pdf_name"))
+
+    def _save(self, job: Job):
+        p = self.jobs_dir / f"{job.id}.json"
+        tmp = p.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(job.persist_dict(), ensure_ascii=False), encoding="utf-8")
+        tmp.replace(p)
+
+    # ---------------- 对外接口 ----------------
+    def submit(self, spec: Dict[str, Any]) -> Job:
+        key = self._spec_key(spec)
+        with self._lock:
+            # 同一文档同一参数已在排队/执行：直接复用，避免重复 OCR
+            if not spec.get("force"):
+                for j in self._jobs.values():
+                    if j.status in ACTIVE and self._spec_key(j.spec) == key:
+                        return j
+            job = Job(dict(spec))
+            self._jobs[job.id] = job
+            self._save(job)
+            self._gc_finished()
+        self._q.put(job.id)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self, pdf_name: Optional[str] = None) -> List[Job]:
+        jobs = [j for j in self._jobs.values() if not pdf_name or j.spec.get("pdf_name") == pdf_name]
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            job.cancel()
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                self._save(job)
+        job.notify()
+        return job
+
+    # ---------------- 内部 ----------------
+    def _spec_key(self, spec: Dict[str, Any]):
+        pages = spec.get("pages")
+        opts = self.opts_fn(spec) if self.opts_fn else {}
+        return (spec.get("pdf_name"), spec.get("dpi"), spec.get("tile"), spec.get("overlap"),
+                tuple(sorted(int(p) for p in pages)) if pages else None,
+                tuple(sorted(opts.items())))
+
+    def _gc_finished(self):
+        done = [j for j in self._jobs.values() if j.status not in ACTIVE]
+        if len(done) <= self.keep_finished:
+            return
+        done.sort(key=lambda j: j.created_at)
+        for j in done[:len(done) - self.keep_finished]:
+            self._jobs.pop(j.id, None)
+            try:
+                (self.jobs_dir / f"{j.id}.json").unlink()
+            except OSError:
+                pass
+
+    def _loop(self):
+        while True:
+            job_id = self._q.get()
+            job = self._jobs.get(job_id)
+            if job is None or job.status != "queued" or job.cancelled:
+                continue
+            job.status = "running"
+            job.started_at = time.time()
+            self._save(job)
+            job.notify()
+            try:
+                self.run_fn(job.spec, job)
+                job.status = "cancelled" if job.cancelled else "done"
+            except Exception as e:
+                log.exception("OCR job %s failed", job.id)
+                job.status = "failed"
+                job.error = str(e)
+            job.finished_at = time.time()
+            with self._lock:
+                self._save(job)
+            job.notify()
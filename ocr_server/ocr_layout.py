@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+页面版面特征（OCR 出页时算一次，写进页 JSON 的 layout 字段，整本里存成逐 hit 的列）。
+
+QA 打分、/search 排序、表格行上下文原先各自在每次请求里重算：排序框高求 h90、按 y 分行统计密度……
+页内 hit 上千时每条命中都重算一遍是 O(n²)。这里统一算好：
+  h90     本页框高的 90 分位（框高 ≥ 它视为标题）
+  row     每条 hit 的行号：round(y / 5)（与前端 Math.round 一致）
+  row_n   每条 hit 所在行的框数（行密度）
+  flags   位标记：TITLE 标题 / TABLE 密集行（行密度 ≥ 12）/ TABLE_ROW 表格行（行内 ≥ 4 条且 ≥ 4 个数字/字母串，QA 取表格上下文用）
+"""
+import re
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+LAYOUT_VERSION = 1
+ROW_BIN = 5          # 同行判定：y / 5 取整
+TABLE_ROW_MIN = 12   # 同一行框数 ≥ 此值视为密集（表格）行
+TITLE_PCT = 0.9      # 框高 ≥ 本页该分位视为标题
+QA_ROW_MIN = 4       # 表格行：行内至少这么多条
+QA_ROW_TOKENS = 4    # 且拼起来的文本里至少这么多个数字/字母串
+
+TITLE, TABLE, TABLE_ROW = 1, 2, 4
+
+HIT_DTYPE = np.dtype([("row", "<i4"), ("row_n", "<u2"), ("flags", "u1"), ("_pad", "u1")])
+
+_TOKEN = re.compile(r"[0-9A-Za-z\-]+")
+
+def analyze(boxes: np.ndarray, texts: Sequence[str]) -> Dict:
+    """boxes 为 (n, 4) 的 x, y, w, h；返回 {h90, hits: HIT_DTYPE 数组}"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    n = len(boxes)
+    out = np.zeros(n, dtype=HIT_DTYPE)
+    if not n:
+        return {"h90": 0, "hits": out}
+    hs = np.sort(boxes[:, 3])
+    h90 = float(hs[max(0, int(n * TITLE_PCT) - 1)])
+    rows = np.floor(boxes[:, 1] / ROW_BIN + 0.5).astype(np.int64)
+    _, inv, cnt = np.unique(rows, return_inverse=True, return_counts=True)
+    inv = inv.reshape(-1)
+    flags = np.where(boxes[:, 3] >= h90, TITLE, 0) | np.where(cnt[inv] >= TABLE_ROW_MIN, TABLE, 0)
+
+    # 表格行要看文本：整页按 (行, x) 排一次，只对条数够的行拼文本
+    order = np.lexsort((boxes[:, 0], inv))
+    for members in np.split(order, np.cumsum(cnt)[:-1]):
+        if len(members) >= QA_ROW_MIN and len(_TOKEN.findall("".join(str(texts[i]) for i in members))) >= QA_ROW_TOKENS:
+            flags[members] |= TABLE_ROW
+
+    out["row"] = rows
+    out["row_n"] = np.minimum(cnt[inv], 0xFFFF)
+    out["flags"] = flags
+    return {"h90": h90, "hits": out}
+
+def analyze_hits(hits: List[Dict]) -> Dict:
+    boxes = [[(h.get("box") or {}).get(k, 0) for k in ("x", "y", "w", "h")] for h in hits]
+    return analyze(np.asarray(boxes, dtype=np.float64), [h.get("text") or "" for h in hits])
+
+def to_json(lay: Dict) -> Dict:
+    """写进页 JSON 的形式（列存，省体积）"""
+    a = lay["hits"]
+    return {"v": LAYOUT_VERSION, "h90": lay["h90"], "row": a["row"].tolist(),
+            "row_n": a["row_n"].tolist(), "flags": a["flags"].tolist()}
+
+def from_json(obj: Dict, n: int) -> Optional[Dict]:
+    """页 JSON 里的 layout → analyze 的结构；版本/条数对不上返回 None（调用方重算）"""
+    if not isinstance(obj, dict) or obj.get("v") != LAYOUT_VERSION or len(obj.get("flags") or ()) != n:
+        return None
+    out = np.zeros(n, dtype=HIT_DTYPE)
+    out["row"], out["row_n"], out["flags"] = obj["row"], obj["row_n"], obj["flags"]
+    return {"h90": float(obj.get("h90") or 0), "hits": out}
+
+def weights(flags: np.ndarray) -> np.ndarray:
+    """/search 的排序权重（同旧前端 performSearch）：1 + 密集行 + 3 × 标题"""
+    flags = np.asarray(flags)
+    return (1 + ((flags & TABLE) > 0) + 3 * ((flags & TITLE) > 0)).astype(np.uint8)
+
+def table_rows(flags: np.ndarray, rows: np.ndarray, xs: np.ndarray) -> List[np.ndarray]:
+    """TABLE_ROW 的 hit 按行分组（行号升序、行内 x 升序），返回每行的 hit 下标数组"""
+    idx = np.nonzero(np.asarray(flags) & TABLE_ROW)[0]
+    if not len(idx):
+        return []
+    idx = idx[np.lexsort((np.asarray(xs)[idx], np.asarray(rows)[idx]))]
+    r = np.asarray(rows)[idx]
+    cuts = np.nonzero(np.diff(r))[0] + 1
+    return np.split(idx, cuts)
@@ -0,0 +1,795 @@
+# -*- coding: utf-8 -*-
+"""
+OCR 流水线：引擎 + 分块渲染 + 坐标还原。
+从 main.py 拆出，既供 Flask 进程内串行调用，也供 ocr_pool 的工作进程各自加载。
+"""
+import os, json, copy, time, logging
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+import fitz  # PyMuPDF
+from paddleocr import PaddleOCR
+from ocr_postprocess import postprocess_hits
+from mem_governor import governor
+import ocr_layout
+try:
+    # paddleocr 导入时已把自身目录加入 sys.path，内部模块按它自己的方式引用
+    from tools.infer.utility import get_rotate_crop_image
+    from tools.infer.predict_system import sorted_boxes
+    _HAS_STAGES = True
+except Exception:  # 版本不符时退回整图 ocr() 调用
+    _HAS_STAGES = False
+
+log = logging.getLogger(__name__)
+
+# 单个引擎的 CPU 线程数（工作进程里由 ocr_pool 覆盖）
+OCR_CPU_THREADS = int(os.environ.get("OCR_CPU_THREADS", "4"))
+
+# 矢量文字层快速通道：有可用文字层的页直接抽字，只对图片区域做栅格 OCR
+TEXT_LAYER_DEFAULT = os.environ.get("OCR_TEXT_LAYER", "1") != "0"
+TEXT_LAYER_MIN_CHARS = int(os.environ.get("OCR_TEXT_LAYER_MIN_CHARS", "20"))
+TEXT_LAYER_MAX_BAD = float(os.environ.get("OCR_TEXT_LAYER_MAX_BAD", "0.1"))  # 乱码字符占比上限
+RASTER_MIN_SIDE_PT = 24.0   # 小于此边长的图片（图标/线条）不单独 OCR
+
+# 空白块预筛：灰度块里“墨迹”占比太低或整块几乎同色就不送 OCR
+TILE_INK_LEVEL = int(os.environ.get("OCR_TILE_INK_LEVEL", "160"))             # 灰度低于此值算墨迹
+TILE_MIN_INK = float(os.environ.get("OCR_TILE_MIN_INK", "0.0001"))           # 墨迹像素占比下限
+TILE_MIN_CONTRAST = int(os.environ.get("OCR_TILE_MIN_CONTRAST", "48"))       # 最亮-最暗 下限（纯色块）
+
+# 方向判定：先只跑检测，按文本框长宽比决定 0°/90°，只对需要的方向做识别
+#   auto       按块判定，混排时分区域，置信度低回退双向
+#   horizontal 已知全横排的文档：只做 0°
+#   dual       旧行为：每块 0°/90° 各跑一遍取高分
+ORIENTATION_DEFAULT = os.environ.get("OCR_ORIENTATION", "auto")
+ORIENT_TALL_RATIO = 1.5     # h/w ≥ 此值视为竖向框（竖排中文 / 侧转标注）
+ORIENT_MINORITY = 0.05      # 少数方向框占比不超过此值 → 多数方向为主（可回退），少数方向的框单独识别
+ORIENT_LOW_CONF = float(os.environ.get("OCR_ORIENT_LOW_CONF", "0.6"))  # 平均置信度低于此值回退双向
+
+# 批量识别：所有块（可跨页）的文本行小图汇总后一次送识别器
+OCR_REC_BATCH = int(os.environ.get("OCR_REC_BATCH", "32"))      # 识别器内部每批行数（rec_batch_num）
+OCR_BATCH_PAGES = int(os.environ.get("OCR_BATCH_PAGES", "1"))   # 几页的小图合成一组识别
+
+# 跨块去重 + 碎片拼接（见 ocr_postprocess）；关掉即保留各块原始结果
+DEDUP_DEFAULT = os.environ.get("OCR_DEDUP", "1") != "0"
+
+# 粗到细（自适应 DPI）：先按 OCR_COARSE_DPI 渲染检测，字够大的就在粗图上识别；
+# 检测框“线高”不到 OCR_ADAPT_MIN_PX（粗图像素）的区域才按请求 DPI 裁剪重渲后识别
+ADAPTIVE_DEFAULT = os.environ.get("OCR_ADAPTIVE", "0") != "0"
+COARSE_DPI = int(os.environ.get("OCR_COARSE_DPI", "200"))
+ADAPT_MIN_PX = float(os.environ.get("OCR_ADAPT_MIN_PX", "24"))
+ADAPT_CELL = 32   # 小字区域掩码的格子边长（整页像素）
+
+# 每页 JSON 带 timing：各阶段耗时（毫秒），/metrics 的分阶段直方图也由它汇总
+PAGE_TIMING = os.environ.get("OCR_PAGE_TIMING", "1") != "0"
+
+# 进入页缓存 key：换模型或改动流水线输出时递增，旧缓存自动失效
+PIPELINE_VERSION = 5
+OCR_CACHE_VERSION = f"{os.environ.get('OCR_MODEL_VERSION', 'paddleocr-2.7.0.3-ch')}/p{PIPELINE_VERSION}"
+
+def write_json_atomic(path: Path, obj):
+    tmp = path.with_suffix(path.suffix + '.tmp')
+    tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding='utf-8')
+    tmp.replace(path)
+
+# ---------------- OCR 引擎（每个进程一份，懒加载） ----------------
+_ocr = None
+
+def init_engine(cpu_threads: int = OCR_CPU_THREADS) -> PaddleOCR:
+    global _ocr
+    _ocr = PaddleOCR(
+        lang='ch',
+        use_angle_cls=True,
+        det_limit_side_len=2048,  # 速度/召回折中
+        use_gpu=False,
+        cpu_threads=cpu_threads,
+        rec_batch_num=OCR_REC_BATCH,
+        cls_batch_num=OCR_REC_BATCH
+    )
+    return _ocr
+
+def get_engine() -> PaddleOCR:
+    if _ocr is None:
+        init_engine()
+    return _ocr
+
+# ---------------- 工具函数（保留并小修） ----------------
+def rotate_image(im: Image.Image, deg: int) -> Image.Image:
+    if deg == 0:
+        return im
+    return im.rotate(deg, expand=True)  # 逆时针为正
+
+def tiles(img: Image.Image, size=1400, overlap=0.12):
+    # 目前未直接使用（保留）
+    W, H = img.size
+    dx = int(size * (1 - overlap)); dy = dx
+    xs = list(range(0, max(1, W - size) + 1, dx))
+    ys = list(range(0, max(1, H - size) + 1, dy))
+    if W > size and (W - size) % dx != 0: xs.append(W - size)
+    if H > size and (H - size) % dy != 0: ys.append(H - size)
+    xs = sorted(set(xs)); ys = sorted(set(ys))
+    for xi in xs:
+        for yi in ys:
+            yield (xi, yi), img.crop((xi, yi, xi + size, yi + size))
+
+def safe_ocr_lines(im: Image.Image) -> list:
+    try:
+        res = get_engine().ocr(np.array(im), cls=True)  # 期望 RGB
+        if not res or not isinstance(res, list):
+            return []
+        lines = res[0] if len(res) else []
+        return lines or []
+    except Exception:
+        log.exception("OCR call failed")
+        return []
+
+# ---------------- 分阶段调用：检测 / 识别 ----------------
+def detect_boxes(img: np.ndarray) -> list:
+    """只跑文本检测，返回四点框（np.ndarray，按阅读顺序排序）"""
+    try:
+        res = get_engine().text_detector(img)
+        dt_boxes = res[0] if isinstance(res, tuple) else res
+        if dt_boxes is None or len(dt_boxes) == 0:
+            return []
+        return list(sorted_boxes(dt_boxes))
+    except Exception:
+        log.exception("OCR detection failed")
+        return []
+
+def crop_boxes(img: np.ndarray, boxes: list) -> list:
+    return [get_rotate_crop_image(img, copy.deepcopy(b)) for b in boxes]
+
+def recognize_crops(crops: list, cls: bool = True) -> list:
+    """
+    批量识别文本行小图，返回 [(text, score)]，与 crops 一一对应。
+    引擎内部按 rec_batch_num 切批，这里一次喂得越多，单次调用开销摊得越薄。
+    """
+    if not crops:
+        return []
+    eng = get_engine()
+    try:
+        if cls and getattr(eng, "use_angle_cls", False):
+            crops, _, _ = eng.text_classifier(crops)
+        rec_res, _ = eng.text_recognizer(crops)
+        return [(str(t), float(sc)) for t, sc in rec_res]
+    except Exception:
+        log.exception("OCR recognition failed")
+        return [("", 0.0)] * len(crops)
+
+def _drop_score() -> float:
+    return float(getattr(get_engine(), "drop_score", 0.5))
+
+def recognize_boxes(img: np.ndarray, boxes: list, cls: bool = True) -> list:
+    """对已检测的框裁图识别，返回与 ocr() 相同的 [[poly, (text, score)], ...]"""
+    if not boxes:
+        return []
+    rec = recognize_crops(crop_boxes(img, boxes), cls=cls)
+    drop = _drop_score()
+    return [[b.tolist(), (t, sc)] for b, (t, sc) in zip(boxes, rec) if sc >= drop]
+
+def _lines_score(lines) -> float:
+    return sum(max(0, float(t[1][1])) for t in lines) if lines else 0.0
+
+def _mean_conf(lines) -> float:
+    return _lines_score(lines) / len(lines) if lines else 0.0
+
+def _is_tall(b) -> bool:
+    b = np.asarray(b, dtype=np.float32)
+    w = float(np.linalg.norm(b[1] - b[0])); h = float(np.linalg.norm(b[2] - b[1]))
+    return h >= ORIENT_TALL_RATIO * max(1.0, w)
+
+def _thickness(b) -> float:
+    # 文本行的“线高”：四点框两条边长取短的（横排即框高，竖排即框宽）
+    b = np.asarray(b, dtype=np.float32)
+    return min(float(np.linalg.norm(b[1] - b[0])), float(np.linalg.norm(b[2] - b[1])))
+
+def _to_rgb(im: Image.Image) -> Image.Image:
+    return im if im.mode == "RGB" else im.convert("RGB")  # 关键：确保 3 通道
+
+def ocr_patch_dual(patch: Image.Image):
+    """
+    针对小块做 OCR，尝试 0/90 两种角度，取 score 高的一种。
+    """
+    cands = []
+    for rot in [0, 90]:
+        imr = _to_rgb(rotate_image(patch, rot))
+        lines = safe_ocr_lines(imr)
+        cands.append((_lines_score(lines), rot, lines))
+    cands.sort(key=lambda x: x[0], reverse=True)
+    return cands[0]
+
+# ---------------- 批量引擎：检测逐块做，识别跨块/跨页汇总成大批 ----------------
+class _Pass:
+    """一块在某个方向上的一次识别：检测框 + 裁好的小图，识别结果回填到 rec"""
+    __slots__ = ("rot", "boxes", "crops", "rec")
+
+    def __init__(self, rot: int, boxes: list, crops: list):
+        self.rot, self.boxes, self.crops, self.rec = rot, boxes, crops, None
+
+    def lines(self, drop: float) -> list:
+        return [[b.tolist(), (t, sc)] for b, (t, sc) in zip(self.boxes, self.rec or []) if sc >= drop]
+
+class _Tile:
+    __slots__ = ("x0", "y0", "w", "h", "clip", "k", "keep", "mode", "fixed", "passes", "backup", "groups")
+
+    def __init__(self, x0: int, y0: int, w: int, h: int, clip=None, k: float = 1):
+        # (x0, y0) 为整页像素；w/h 为渲染出的块图尺寸，k = 整页像素 / 块图像素（粗图 > 1）
+        self.x0, self.y0, self.w, self.h, self.clip, self.k = x0, y0, w, h, clip, k
+        self.keep = None                      # 只保留框中心满足 keep(x, y)（整页像素）的框
+        self.mode = "none"
+        self.fixed = False                    # 方向由调用方指定（horizontal），不做回退
+        self.passes: List[_Pass] = []
+        self.backup: Optional[_Pass] = None   # 置信度低时的另一方向（"v" 模式下提前裁好）
+        self.groups: List[Tuple[int, list]] = []
+
+def _detect_pass(im: Image.Image, rot: int, keep=None) -> _Pass:
+    arr = np.array(_to_rgb(rotate_image(im, rot)))
+    boxes = detect_boxes(arr)
+    if keep is not None:
+        boxes = [b for b in boxes if keep(b)]
+    return _Pass(rot, boxes, crop_boxes(arr, boxes))
+
+def plan_tile(t: _Tile, im: Image.Image, orientation: str = ORIENTATION_DEFAULT):
+    """
+    只做检测和方向判定，把要识别的小图挂到 t.passes 上（识别留给 BatchRecognizer 统一做）。
+
+    auto：先在 0° 上只跑一次检测，按框的长宽比统计方向——
+      - 几乎全是横向框：横向框在 0° 识别（h）
+      - 几乎全是竖向框：整块转 90° 检测识别（v）
+      - 混排：横向框在 0° 识别，90° 只保留原图里竖向的那部分框（mixed）
+      - 选定方向平均置信度过低：在 resolve 阶段回退到另一方向比较（fallback）
+    h / v 只决定块内多数文字的方向；零星的少数方向框（稀疏的竖排中文标注等）同样按各自方向
+    另挂一个 pass 识别，不因占比低被当成多数方向丢掉。passes[0] 为多数方向，回退只比较它。
+    """
+    if not _HAS_STAGES:
+        score, rot, lines = ocr_patch_dual(im)
+        t.mode, t.groups = "dual", [(rot, lines)]
+        return
+    if orientation in ("dual", "horizontal"):
+        t.mode = "dual" if orientation == "dual" else "h"
+        t.fixed = orientation == "horizontal"
+        t.passes = [_detect_pass(im, rot) for rot in ([0, 90] if orientation == "dual" else [0])]
+        return
+
+    arr0 = np.array(_to_rgb(im))
+    boxes = detect_boxes(arr0)
+    if not boxes:
+        return
+    tall = [b for b in boxes if _is_tall(b)]
+    flat = [b for b in boxes if not _is_tall(b)]
+    if len(tall) <= ORIENT_MINORITY * len(boxes):
+        t.mode, t.passes = "h", [_Pass(0, flat, crop_boxes(arr0, flat))]
+        if tall:
+            t.passes.append(_detect_pass(im, 90, keep=lambda b: not _is_tall(b)))
+    elif len(flat) <= ORIENT_MINORITY * len(boxes):
+        t.mode = "v"
+        t.passes = [_detect_pass(im, 90, keep=(lambda b: not _is_tall(b)) if flat else None)]
+        if flat:
+            t.passes.append(_Pass(0, flat, crop_boxes(arr0, flat)))
+        t.backup = _Pass(0, boxes, crop_boxes(arr0, boxes))
+    else:
+        # 旋转后变“宽”的框对应原图里的竖向文字
+        t.mode = "mixed"
+        t.passes = [_Pass(0, flat, crop_boxes(arr0, flat)), _detect_pass(im, 90, keep=lambda b: not _is_tall(b))]
+
+class BatchRecognizer:
+    """
+    收集多块（可跨页）的 _Pass，一次性批量分类+识别，再把结果散回各自的块。
+    add 时给了 timing（所属页的阶段计时）则按小图数分摊这批的识别耗时
+    """
+    def __init__(self):
+        self.pending: List[_Pass] = []
+        self.owners: List[Optional[dict]] = []
+
+    def add(self, p: _Pass, timing: Optional[dict] = None):
+        if p.crops:
+            self.pending.append(p)
+            self.owners.append(timing)
+        else:
+            p.rec = []
+
+    def flush(self):
+        if not self.pending:
+            return
+        crops = [c for p in self.pending for c in p.crops]
+        t0 = time.perf_counter()
+        rec = recognize_crops(crops)
+        per_crop = (time.perf_counter() - t0) / len(crops)
+        k = 0
+        for p, tm in zip(self.pending, self.owners):
+            n = len(p.crops)
+            p.rec, p.crops = rec[k:k + n], []   # 识别完即释放小图
+            k += n
+            if tm is not None:
+                tm['recognize'] += per_crop * n
+        self.pending, self.owners = [], []
+
+def resolve_tile(t: _Tile, drop: float) -> bool:
+    """
+    识别结果回来后定下 t.groups；需要回退另一方向时把 backup 挂好并返回 True。
+    """
+    if t.groups or not t.passes:
+        return False
+    if t.mode == "dual":
+        best = max(t.passes, key=lambda p: _lines_score(p.lines(drop)))
+        t.groups = [(best.rot, best.lines(drop))]
+    elif t.mode in ("mixed", "coarse"):
+        t.groups = [(p.rot, p.lines(drop)) for p in t.passes]
+    elif t.backup is None or t.backup.rec is None:
+        lines = t.passes[0].lines(drop)
+        if t.fixed or _mean_conf(lines) >= ORIENT_LOW_CONF:
+            t.groups = [(p.rot, p.lines(drop)) for p in t.passes]
+        else:
+            return True
+    else:
+        # 回退：两个方向都识别过了，取总分高的；另一方向胜出时它是整块重检，已含少数方向的框
+        cands = [t.passes[0], t.backup]
+        best = max(cands, key=lambda p: _lines_score(p.lines(drop)))
+        t.mode = "fallback"
+        t.groups = [(best.rot, best.lines(drop))]
+        if best is t.passes[0]:
+            t.groups += [(p.rot, p.lines(drop)) for p in t.passes[1:]]
+    return False
+
+def ocr_patch(patch: Image.Image, orientation: str = ORIENTATION_DEFAULT):
+    """
+    单块 OCR（兼容入口）：返回 (score, [(rot, lines), ...], mode)；
+    同一块可能有 0° 与 90° 两组结果（混排）。mode: none / h / v / mixed / fallback / dual。
+    """
+    t = _Tile(0, 0, patch.width, patch.height)
+    plan_tile(t, patch, orientation)
+    br = BatchRecognizer()
+    for p in t.passes:
+        br.add(p)
+    br.flush()
+    drop = _drop_score() if _HAS_STAGES else 0.0
+    if resolve_tile(t, drop):
+        if t.backup is None:
+            t.backup = _detect_pass(patch, 90 if t.passes[0].rot == 0 else 0)
+        br.add(t.backup); br.flush()
+        resolve_tile(t, drop)
+    return sum(_lines_score(ls) for _, ls in t.groups), t.groups, t.mode
+
+def rotate_box_back(
+    box: List[List[float]],
+    rot_deg: int,
+    patch_w: int,
+    patch_h: int,
+    offset_xy: Tuple[int, int]
+):
+    """
+    将“在已旋转 patch 坐标系中的四点框”映射回“整页未旋转坐标系”，
+    再加上 patch 左上角在整页中的偏移。
+    约定：rot_deg 为逆时针角度；Pillow.rotate(deg) 同样是逆时针。
+    """
+    pts = np.array(box, dtype=np.float32)  # [[x',y'], ...] in ROTATED patch coords
+    x0, y0 = offset_xy
+
+    if rot_deg == 0:
+        xs, ys = pts[:, 0], pts[:, 1]
+    elif rot_deg == 90:
+        # 逆时针90°：x' = y, y' = W - x ；反变换：x = W - y', y = x'
+        xs = patch_w - pts[:, 1]
+        ys = pts[:, 0]
+    elif rot_deg == 180:
+        # 180°：x' = W - x, y' = H - y ；反变换：x = W - x', y = H - y'
+        xs = patch_w - pts[:, 0]
+        ys = patch_h - pts[:, 1]
+    elif rot_deg == 270:
+        # 逆时针270°（=顺时针90°）：x' = H - y, y' = x ；反变换：x = y', y = H - x'
+        xs = pts[:, 1]
+        ys = patch_h - pts[:, 0]
+    else:
+        xs, ys = pts[:, 0], pts[:, 1]
+
+    # 加回整页偏移
+    xs = xs + x0; ys = ys + y0
+    xmin, ymin = float(xs.min()), float(ys.min())
+    xmax, ymax = float(xs.max()), float(ys.max())
+    return xmin, ymin, xmax - xmin, ymax - ymin
+
+# ---------------- 矢量文字层：PyMuPDF 抽字 → 与 OCR 同结构的 hits ----------------
+def _is_bad_char(ch: str) -> bool:
+    # 缺 ToUnicode 时常见：替换符 / 私用区 / 控制符
+    o = ord(ch)
+    return ch == "\ufffd" or 0xE000 <= o <= 0xF8FF or (o < 32 and ch not in "\t\n")
+
+def _join_words(words: List[str]) -> str:
+    out = ""
+    for w in words:
+        if out and out[-1].isascii() and out[-1].isalnum() and w[:1].isascii() and w[:1].isalnum():
+            out += " "
+        out += w
+    return out
+
+def text_layer_hits(page, scale: float):
+    """
+    返回 (hits, usable, raster_regions)：
+      - hits：按行（大间距再切开）聚合的文字层命中，坐标为整页像素
+      - usable：文字层是否可信（字数够、乱码少）
+      - raster_regions：需要栅格 OCR 的图片区域 [(x0,y0,x1,y1)]（整页像素）；
+        被文字层覆盖的图片（如已带隐藏文字层的扫描件）不计入
+    坐标：get_text / get_image_info 给的是未旋转坐标，需经 rotation_matrix 映射到渲染坐标。
+    """
+    rot = page.rotation_matrix
+    words = page.get_text("words")
+    chars = "".join(w[4] for w in words)
+    bad = sum(1 for ch in chars if _is_bad_char(ch))
+    usable = len(chars) >= TEXT_LAYER_MIN_CHARS and bad <= TEXT_LAYER_MAX_BAD * max(1, len(chars))
+
+    def to_px(x0, y0, x1, y1):
+        r = fitz.Rect(x0, y0, x1, y1) * rot
+        return r.x0 * scale, r.y0 * scale, r.x1 * scale, r.y1 * scale
+
+    hits = []
+    if usable:
+        lines: dict = {}
+        for x0, y0, x1, y1, txt, bno, lno, _ in words:
+            lines.setdefault((bno, lno), []).append((x0, y0, x1, y1, txt))
+        for ws in lines.values():
+            ws.sort(key=lambda w: w[0])
+            seg = [ws[0]]
+            for w in ws[1:]:
+                prev = seg[-1]
+                lh = max(1.0, prev[3] - prev[1])
+                if w[0] - prev[2] > 2.0 * lh:  # 同一行里隔得很远 → 视为不同标注
+                    hits.append(_seg_hit(seg, to_px))
+                    seg = [w]
+                else:
+                    seg.append(w)
+            hits.append(_seg_hit(seg, to_px))
+        hits = [h for h in hits if h['text'].strip()]
+
+    regions = []
+    for info in page.get_image_info():
+        bx0, by0, bx1, by1 = info.get("bbox", (0, 0, 0, 0))
+        if min(bx1 - bx0, by1 - by0) < RASTER_MIN_SIDE_PT:
+            continue
+        if usable:
+            inside = sum(1 for w in words if bx0 <= (w[0] + w[2]) / 2 <= bx1 and by0 <= (w[1] + w[3]) / 2 <= by1)
+            if inside >= 3:
+                continue
+        x0, y0, x1, y1 = to_px(bx0, by0, bx1, by1)
+        regions.append((min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)))
+    return hits, usable, regions
+
+def _seg_hit(seg, to_px) -> dict:
+    x0 = min(w[0] for w in seg); y0 = min(w[1] for w in seg)
+    x1 = max(w[2] for w in seg); y1 = max(w[3] for w in seg)
+    px0, py0, px1, py1 = to_px(x0, y0, x1, y1)
+    bx, by = min(px0, px1), min(py0, py1)
+    return {
+        'text': _join_words([w[4] for w in seg]),
+        'conf': 1.0,
+        'box': {'x': int(bx), 'y': int(by), 'w': int(max(1, abs(px1 - px0))), 'h': int(max(1, abs(py1 - py0)))}
+    }
+
+# ---------------- 空白块预筛 ----------------
+def tile_is_blank(pix, min_ink: float = TILE_MIN_INK, min_contrast: int = TILE_MIN_CONTRAST) -> bool:
+    """
+    灰度 pixmap 上的廉价预筛：
+      - 墨迹占比过低（白边/空白区、零星噪点）
+      - 对比度过低（纯色/底纹块；注意不能用方差，稀疏小字的块方差本来就很小）
+    隔行隔列采样，500 DPI 下笔画宽度足够，不会漏掉小字。
+    """
+    a = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.stride)[::2, :pix.w:2]
+    if a.size == 0:
+        return True
+    if int(a.max()) - int(a.min()) < min_contrast:
+        return True
+    ink = np.count_nonzero(a < TILE_INK_LEVEL) / a.size
+    return ink < min_ink
+
+def _intersects(a, b) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+# ---------------- 多页 OCR：按 clip 分块渲染 → 检测 → 批量识别 → 坐标还原 ----------------
+def _keep_pass(t: _Tile, p: Optional[_Pass]):
+    """按 t.keep 过滤一次识别的框与小图（在送识别之前）"""
+    if p is None or t.keep is None or not p.boxes:
+        return
+    idx = []
+    for j, b in enumerate(p.boxes):
+        bx, by, bw, bh = rotate_box_back(b, p.rot, t.w, t.h, (t.x0, t.y0))
+        if t.keep(bx + bw / 2, by + bh / 2):
+            idx.append(j)
+    p.boxes = [p.boxes[j] for j in idx]
+    p.crops = [p.crops[j] for j in idx]
+
+def plan_coarse_tile(t: _Tile, im: Image.Image, small: list):
+    """
+    粗图块：只识别线高 ≥ ADAPT_MIN_PX 的框（横排在 0°，竖排转 90°）；
+    更小的框换算成整页像素矩形追加到 small，留给细图重渲
+    """
+    arr0 = np.array(_to_rgb(im))
+    big = []
+    for b in detect_boxes(arr0):
+        th = _thickness(b)
+        if th >= ADAPT_MIN_PX:
+            big.append(b)
+            continue
+        xs, ys = b[:, 0] * t.k + t.x0, b[:, 1] * t.k + t.y0
+        pad = th * t.k  # 外扩约一个线高：框贴着字，细图检测要留边
+        small.append((float(xs.min()) - pad, float(ys.min()) - pad, float(xs.max()) + pad, float(ys.max()) + pad))
+    t.mode, t.fixed = "coarse", True
+    flat = [b for b in big if not _is_tall(b)]
+    if flat:
+        t.passes.append(_Pass(0, flat, crop_boxes(arr0, flat)))
+    if len(flat) < len(big):
+        t.passes.append(_detect_pass(im, 90, keep=lambda b: not _is_tall(b) and _thickness(b) >= ADAPT_MIN_PX))
+
+class _PageJob:
+    __slots__ = ("index", "page", "scale", "W", "H", "hits", "regions", "n_layer", "stats", "tiles", "timing")
+
+# 页内各阶段（秒，累加；识别是成批做的，按小图数分摊到页）
+_STAGES = ("text_layer", "render", "blank", "to_image", "detect", "recognize", "restore", "dedup", "layout", "gc")
+
+def _render_tile(pj: _PageJob, clip, min_ink: float, min_contrast: int, scale: Optional[float] = None) -> Optional[Image.Image]:
+    mtx = fitz.Matrix(scale or pj.scale, scale or pj.scale)
+    tm = pj.timing
+    try:
+        # 只渲 clip，灰度、无 alpha（显著省内存）
+        t0 = time.perf_counter()
+        pix = pj.page.get_pixmap(matrix=mtx, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+        t1 = time.perf_counter()
+        blank = tile_is_blank(pix, min_ink, min_contrast)
+        t2 = time.perf_counter()
+        tm['render'] += t1 - t0
+        tm['blank'] += t2 - t1
+        pj.stats['mpx'] += pix.w * pix.h / 1e6
+        if blank:
+            pj.stats['blank'] += 1
+            return None
+        im = Image.frombytes("L", (pix.w, pix.h), pix.samples)  # 灰度
+        del pix
+        tm['to_image'] += time.perf_counter() - t2
+        return im
+    except Exception:
+        governor().release()
+        return None
+
+def _grid(W: int, H: int, tile: int, overlap: float):
+    step = max(1, int(tile - tile * overlap))  # 实际步长
+    for y0 in range(0, H, step):
+        y1 = min(y0 + tile, H)
+        for x0 in range(0, W, step):
+            yield x0, y0, min(x0 + tile, W), y1
+
+def _add_tile(pj: _PageJob, x0: int, y0: int, x1: int, y1: int, min_ink: float, min_contrast: int,
+              plan, br: BatchRecognizer, k: float = 1) -> Optional[_Tile]:
+    """渲染整页像素 (x0,y0)-(x1,y1) 这一块（k > 1 时按 1/k 分辨率），plan(t, im) 只做检测；识别小图挂到批量队列"""
+    clip = fitz.Rect(x0/pj.scale, y0/pj.scale, x1/pj.scale, y1/pj.scale)
+    im = _render_tile(pj, clip, min_ink, min_contrast, pj.scale / k)
+    if im is None:
+        return None
+    pj.stats['ocr'] += 1
+    tm = pj.timing
+    t = _Tile(x0, y0, im.width, im.height, clip, k)
+    t0 = time.perf_counter()
+    plan(t, im)
+    t1 = time.perf_counter()
+    tm['detect'] += t1 - t0
+    for p in t.passes:
+        br.add(p, tm)
+    pj.tiles.append(t)
+
+    # 释放这一块；超预算才回收，吃紧时把已攒的小图先送识别
+    del im
+    level = governor().checkpoint()
+    tm['gc'] += time.perf_counter() - t1
+    if level:
+        br.flush()
+    return t
+
+def _plan_adaptive(pj: _PageJob, coarse_dpi: int, tile: int, overlap: float, min_ink: float, min_contrast: int,
+                   orientation: str, br: BatchRecognizer):
+    """
+    粗到细：整页按 coarse_dpi 分块（块图仍为 tile 像素，覆盖的页面更大）检测，大字就地识别；
+    小字框画进格子掩码，再按请求 DPI 的常规网格只渲含小字的块（收紧到掩码范围），
+    细图里只保留中心落在掩码内的框（大字已在粗图识别过）。坐标统一为请求 DPI 的整页像素
+    """
+    k = pj.scale / (coarse_dpi / 72.0)
+    small: list = []
+    for x0, y0, x1, y1 in _grid(pj.W, pj.H, int(tile * k), overlap):
+        pj.stats['total'] += 1
+        if pj.regions is not None and not any(_intersects((x0, y0, x1, y1), r) for r in pj.regions):
+            pj.stats['no_raster'] += 1
+            continue
+        _add_tile(pj, x0, y0, x1, y1, min_ink, min_contrast, lambda t, im: plan_coarse_tile(t, im, small), br, k)
+    if not small:
+        return
+
+    C = ADAPT_CELL
+    mask = np.zeros((pj.H // C + 1, pj.W // C + 1), dtype=bool)
+    for x0, y0, x1, y1 in small:
+        mask[max(0, int(y0) // C):max(0, int(y1) // C) + 1, max(0, int(x0) // C):max(0, int(x1) // C) + 1] = True
+    mh, mw = mask.shape
+
+    def keep(x: float, y: float) -> bool:
+        return bool(mask[min(mh - 1, max(0, int(y) // C)), min(mw - 1, max(0, int(x) // C))])
+
+    def plan_fine(t: _Tile, im: Image.Image):
+        t.keep = keep
+        plan_tile(t, im, orientation)
+        for p in t.passes:
+            _keep_pass(t, p)
+        _keep_pass(t, t.backup)
+        if not any(p.boxes for p in t.passes):
+            t.passes, t.backup = [], None
+
+    for x0, y0, x1, y1 in _grid(pj.W, pj.H, tile, overlap):
+        sub = mask[y0 // C:(y1 - 1) // C + 1, x0 // C:(x1 - 1) // C + 1]
+        if not sub.any():
+            continue
+        rows, cols = np.nonzero(sub.any(axis=1))[0], np.nonzero(sub.any(axis=0))[0]
+        fx0, fx1 = max(x0, (x0 // C + int(cols[0])) * C), min(x1, (x0 // C + int(cols[-1]) + 1) * C)
+        fy0, fy1 = max(y0, (y0 // C + int(rows[0])) * C), min(y1, (y0 // C + int(rows[-1]) + 1) * C)
+        if fx1 <= fx0 or fy1 <= fy0:
+            continue
+        pj.stats['total'] += 1
+        pj.stats['fine'] += 1
+        _add_tile(pj, fx0, fy0, fx1, fy1, min_ink, min_contrast, plan_fine, br)
+
+def _plan_page(doc, page_index: int, dpi: int, tile: int, overlap: float, text_layer: bool,
+               min_ink: float, min_contrast: int, orientation: str, br: BatchRecognizer,
+               adaptive: bool = False) -> _PageJob:
+    pj = _PageJob()
+    pj.index = page_index
+    pj.page = doc.load_page(page_index)
+    pj.scale = scale = dpi / 72.0
+    rect = pj.page.rect
+    pj.W = W = int(rect.width * scale)
+    pj.H = H = int(rect.height * scale)
+    pj.hits, pj.tiles = [], []
+    gov = governor()
+    tile = gov.tile_size(tile)  # 内存吃紧时后续页改用小块
+    pj.stats = {'total': 0, 'ocr': 0, 'blank': 0, 'no_raster': 0, 'modes': {}, 'tile': tile, 'mpx': 0.0}
+    pj.timing = tm = dict.fromkeys(_STAGES, 0.0)
+
+    pj.regions = None  # None = 整页栅格 OCR
+    if text_layer:
+        t0 = time.perf_counter()
+        try:
+            layer_hits, usable, raster = text_layer_hits(pj.page, scale)
+            if usable:
+                pj.hits.extend(layer_hits)
+                pj.regions = raster
+        except Exception:
+            log.exception("text layer extraction failed")
+        tm['text_layer'] += time.perf_counter() - t0
+    pj.n_layer = len(pj.hits)
+
+    if adaptive and dpi > COARSE_DPI:
+        pj.stats.update(coarse_dpi=COARSE_DPI, fine=0)
+        _plan_adaptive(pj, COARSE_DPI, tile, overlap, min_ink, min_contrast, orientation, br)
+        return pj
+    plan = lambda t, im: plan_tile(t, im, orientation)
+    for x0, y0, x1, y1 in _grid(W, H, tile, overlap):
+        pj.stats['total'] += 1
+        if pj.regions is not None and not any(_intersects((x0, y0, x1, y1), r) for r in pj.regions):
+            pj.stats['no_raster'] += 1
+            continue
+        _add_tile(pj, x0, y0, x1, y1, min_ink, min_contrast, plan, br)
+    return pj
+
+def _finish_page(pj: _PageJob, dedup: bool = True) -> dict:
+    # 块边界（页内侧）：断在这些线上的碎片才考虑拼接
+    cut_xs = {e for t in pj.tiles for e in (t.x0, t.x0 + int(t.w * t.k)) if 0 < e < pj.W}
+    cut_ys = {e for t in pj.tiles for e in (t.y0, t.y0 + int(t.h * t.k)) if 0 < e < pj.H}
+    tm = pj.timing
+    t0 = time.perf_counter()
+    for t in pj.tiles:
+        pj.stats['modes'][t.mode] = pj.stats['modes'].get(t.mode, 0) + 1
+        for rot, lines in t.groups:
+            for ln in (lines or []):
+                try:
+                    poly = ln[0]
+                    txt, conf = ln[1][0], ln[1][1]
+                    if t.k == 1:
+                        bx, by, bw, bh = rotate_box_back(poly, rot, t.w, t.h, (t.x0, t.y0))
+                    else:
+                        # 粗图块：块图像素 → 整页像素
+                        bx, by, bw, bh = rotate_box_back(poly, rot, t.w, t.h, (0, 0))
+                        bx, by, bw, bh = t.x0 + bx * t.k, t.y0 + by * t.k, bw * t.k, bh * t.k
+                    if pj.regions is not None:
+                        # 混合页：图片区域外的字已由文字层给出，避免重复
+                        cx, cy = bx + bw / 2, by + bh / 2
+                        if not any(r[0] <= cx <= r[2] and r[1] <= cy <= r[3] for r in pj.regions):
+                            continue
+                    pj.hits.append({
+                        'text': str(txt),
+                        'conf': float(conf) if conf is not None else 0.0,
+                        'box': {'x': int(bx), 'y': int(by), 'w': int(max(1, bw)), 'h': int(max(1, bh))}
+                    })
+                except Exception:
+                    continue
+    t1 = time.perf_counter()
+    dd = {'removed': 0, 'merged': 0}
+    if dedup and len(pj.hits) - pj.n_layer > 1:
+        # 文字层的条目不参与：它们不会跨块重复
+        ocr_hits, dd = postprocess_hits(pj.hits[pj.n_layer:], sorted(cut_xs), sorted(cut_ys))
+        pj.hits = pj.hits[:pj.n_layer] + ocr_hits
+    t2 = time.perf_counter()
+    layout = ocr_layout.to_json(ocr_layout.analyze_hits(pj.hits))
+    tm['restore'] += t1 - t0
+    tm['dedup'] += t2 - t1
+    tm['layout'] += time.perf_counter() - t2
+    pj.stats['mpx'] = round(pj.stats['mpx'], 2)
+    out = {'page': pj.index + 1, 'w': pj.W, 'h': pj.H, 'hits': pj.hits,
+           'text_layer_hits': pj.n_layer, 'tiles': pj.stats, 'dedup': dd, 'layout': layout}
+    if PAGE_TIMING:
+        out['timing'] = {k: round(1000 * v, 2) for k, v in tm.items() if v >= 5e-6}
+    pj.page = None; pj.tiles = []
+    return out
+
+def ocr_pages(doc, page_indices: List[int], dpi: int, tile: int, overlap: float,
+              text_layer: bool = TEXT_LAYER_DEFAULT, min_ink: float = TILE_MIN_INK,
+              min_contrast: int = TILE_MIN_CONTRAST, orientation: str = ORIENTATION_DEFAULT,
+              batch_pages: int = None, dedup: bool = DEDUP_DEFAULT, adaptive: bool = ADAPTIVE_DEFAULT) -> Iterator[dict]:
+    """
+    按页序 yield 与 ocr_one_page 相同结构的结果。
+    每 batch_pages 页为一组：先逐块渲染+检测，再把整组所有文本行小图合成大批识别，
+    置信度过低需要换方向的块再补一轮，最后散回各块做坐标还原。
+    batch_pages 越大批越满，但同时驻留的小图也越多。
+    adaptive：粗到细渲染（见 _plan_adaptive），dpi 不高于 OCR_COARSE_DPI 时照常整页分块。
+    """
+    batch_pages = max(1, batch_pages or OCR_BATCH_PAGES)
+    gov = governor()
+    k = 0
+    while k < len(page_indices):
+        group = page_indices[k:k + gov.batch_pages(batch_pages)]
+        k += len(group)
+        br = BatchRecognizer()
+        jobs = [_plan_page(doc, i, dpi, tile, overlap, text_layer, min_ink, min_contrast, orientation, br, adaptive)
+                for i in group]
+        br.flush()
+
+        # 第二轮：低置信度块补另一方向
+        drop = _drop_score() if _HAS_STAGES else 0.0
+        retry = []
+        for pj in jobs:
+            for t in pj.tiles:
+                if resolve_tile(t, drop):
+                    if t.backup is None:
+                        im = _render_tile(pj, t.clip, 0.0, 0, pj.scale / t.k)
+                        t0 = time.perf_counter()
+                        t.backup = _detect_pass(im, 90) if im is not None else _Pass(90, [], [])
+                        _keep_pass(t, t.backup)
+                        pj.timing['detect'] += time.perf_counter() - t0
+                        del im
+                    br.add(t.backup, pj.timing)
+                    retry.append(t)
+        br.flush()
+        for t in retry:
+            resolve_tile(t, drop)
+
+        for pj in jobs:
+            yield _finish_page(pj, dedup)
+            gov.checkpoint()
+
+def ocr_one_page(doc, page_index: int, dpi: int, tile: int, overlap: float, **opts):
+    """
+    返回：
+    {
+      'page': 1-based 页码,
+      'w': 整页像素宽(基于dpi),
+      'h': 整页像素高(基于dpi),
+      'hits': [ {'text':str,'conf':float,'box':{'x':int,'y':int,'w':int,'h':int}}, ... ],
+      'text_layer_hits': 来自 PDF 文字层的条数,
+      'tiles': {'total','ocr','blank','no_raster','modes','tile','mpx'} 分块统计（modes 为方向判定结果计数，
+               tile 为实际块尺寸：内存吃紧时会小于请求值；mpx 为渲染的总像素，百万；
+               自适应模式另有 coarse_dpi 与 fine：按请求 DPI 重渲的块数）,
+      'dedup': {'removed','merged'} 跨块去重删掉的条数 / 拼接合并的碎片数,
+      'layout': {'v','h90','row','row_n','flags'} 版面特征（逐 hit 列存），见 ocr_layout,
+      'timing': {阶段: 毫秒} 本页各阶段耗时（OCR_PAGE_TIMING=0 时没有；只列非零阶段，识别按小图数分摊）
+    }
+    坐标单位：整页像素，与前端 mapBox 的 (w,h) 对齐。
+    opts 同 ocr_pages：
+      text_layer=True 且页有可用文字层时，只对图片区域做栅格 OCR；
+      min_ink/min_contrast：空白块预筛阈值，见 tile_is_blank；
+      orientation：auto / horizontal / dual，见 plan_tile；
+      dedup：跨块去重与碎片拼接，见 ocr_postprocess；
+      adaptive：粗到细渲染，见 _plan_adaptive。
+    """
+    opts['batch_pages'] = 1
+    return next(ocr_pages(doc, [page_index], dpi, tile, overlap, **opts))
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+多进程并行 OCR：每个工作进程持有自己的 PaddleOCR 引擎和 fitz 文档句柄，
+按页分发，结果照旧写到 page_XXXX_{dpi}_rapidocr.json。
+
+配置（环境变量）：
+  OCR_WORKERS         工作进程数；0 = 关闭进程池，走进程内串行（旧行为）
+  OCR_WORKER_THREADS  每个工作进程的 cpu_threads（建议 workers * threads ≈ 物理核数）
+"""
+import os, time, logging
+import multiprocessing as mp
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+import metrics
+
+log = logging.getLogger(__name__)
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "0"))
+OCR_WORKER_THREADS = int(os.environ.get("OCR_WORKER_THREADS", "2"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_worker_mem: Dict[int, dict] = {}   # pid → 该工作进程最近一次上报的内存统计
+
+# ---------------- 工作进程侧 ----------------
+_docs = None
+
+def _init_worker(cpu_threads: int):
+    # 限制底层 BLAS/OMP 线程，避免 workers × threads 超卖
+    for k in ("OMP_NUM_THREADS", "CPU_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[k] = str(cpu_threads)
+    os.environ.setdefault("FLAGS_use_mkldnn", "0")
+    import ocr_pipeline
+    ocr_pipeline.init_engine(cpu_threads=cpu_threads)
+
+def _open_doc(pdf_path: str):
+    # 每个进程只保留一份文档句柄；换文档或同路径文件被替换（mtime/大小变化）时重开
+    global _docs
+    if _docs is None:
+        import pdf_source
+        _docs = pdf_source.DocCache(1)
+    return _docs.get(pdf_path)
+
+def _ocr_page_task(pdf_path: str, page_index: int, dpi: int, tile: int, overlap: float, out_path: str,
+                   extra: Optional[dict] = None, opts: Optional[dict] = None):
+    from ocr_pipeline import ocr_one_page, write_json_atomic
+    from mem_governor import governor
+    doc = _open_doc(pdf_path)
+    out = ocr_one_page(doc, page_index, dpi=dpi, tile=tile, overlap=overlap, **(opts or {}))
+    if extra:
+        out.update(extra)
+    t0 = time.perf_counter()
+    write_json_atomic(Path(out_path), out)
+    summary = metrics.page_summary(out, time.perf_counter() - t0)
+    del out
+    gov = governor()
+    gov.checkpoint()
+    # 指标在主进程记：把本页的耗时/计数摘要带回去
+    return page_index + 1, os.getpid(), gov.stats(), summary
+
+# ---------------- 主进程侧 ----------------
+def enabled() -> bool:
+    return OCR_WORKERS > 0
+
+def get_pool() -> ProcessPoolExecutor:
+    # 进程池常驻：引擎加载只付一次
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=OCR_WORKERS,
+            mp_context=mp.get_context("spawn"),  # 不 fork 已加载 Paddle 的父进程
+            initializer=_init_worker,
+            initargs=(OCR_WORKER_THREADS,),
+        )
+    return _pool
+
+def worker_mem_stats() -> Dict[str, dict]:
+    return {str(pid): st for pid, st in sorted(_worker_mem.items())}
+
+def shutdown():
+    global _pool, _worker_mem
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _worker_mem = {}
+
+def ocr_pages_parallel(
+    pdf_path: str,
+    pages_idx: List[int],
+    dpi: int,
+    tile: int,
+    overlap: float,
+    out_path_for: Callable[[int], Path],
+    extra_for: Optional[Callable[[int], dict]] = None,
+    opts: Optional[dict] = None,
+    stopped: Optional[Callable[[], bool]] = None,
+    on_error: Optional[Callable[[int, BaseException], None]] = None,
+) -> Iterator[int]:
+    """
+    把 pages_idx（0-based）分发给进程池，每完成一页 yield 其 1-based 页码。
+    同时在途的页数不超过 workers 数，内存上限 ≈ workers × 单页峰值。
+    extra_for(i) 返回的字段会合并进该页 JSON（如 cache_key）；opts 原样传给 ocr_one_page。
+    stopped() 为真后不再派新页，已在途的页照常 yield 完（写了盘的页都交给调用方记账）；
+    单页失败调 on_error(i, exc) 后继续其余页。
+    """
+    pool = get_pool()
+    todo = list(pages_idx)
+    inflight: Dict[Future, int] = {}
+    try:
+        while todo or inflight:
+            while todo and len(inflight) < OCR_WORKERS and not (stopped and stopped()):
+                i = todo.pop(0)
+                extra = extra_for(i) if extra_for else None
+                inflight[pool.submit(_ocr_page_task, pdf_path, i, dpi, tile, overlap, str(out_path_for(i)), extra, opts)] = i
+            if not inflight:
+                break
+            done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+            for f in done:
+                i = inflight.pop(f)
+                try:
+                    page_no, pid, mem, summary = f.result()
+                except BrokenProcessPool:
+                    # 工作进程被杀（多半是 OOM）：丢弃整个池，下次请求重建
+                    shutdown()
+                    raise
+                except Exception as e:
+                    log.exception("OCR worker task failed (page %d)", i + 1)
+                    if on_error is not None:
+                        on_error(i, e)
+                    continue
+                _worker_mem[pid] = mem
+                metrics.observe_ocr_page(summary)
+                yield page_no
+    finally:
+        # 调用方提前退出（异常 / 关闭生成器）：没开始的取消，已在跑的等它结束，返回后不再有页文件被写
+        for f in inflight:
+            f.cancel()
+        if inflight:
+            wait(list(inflight))
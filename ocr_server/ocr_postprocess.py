@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+整页 OCR 结果后处理（所有块识别完之后跑一次）：
+  1) 去重：重叠带里同一段字会被 2~4 个相邻块各识别一次 → 框 IoU / 包含度 + 文本相似判重，保留置信度高的
+  2) 拼接：被块边界切开的碎片（同一行、相邻、断口贴着块边界）合并成一条
+框运算用 NumPy 向量化，文本比较只在框有交集的少量候选上做。
+"""
+import re
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+DEDUP_IOU = 0.5          # IoU ≥ 此值且文本相似 → 重复
+DEDUP_IOU_STRICT = 0.8   # IoU ≥ 此值无论文本 → 重复（同一位置的误读）
+DEDUP_CONTAIN = 0.85     # 小框被大框包含的比例 ≥ 此值且文本被包含 → 重复
+PREFER_LONGER_SLACK = 0.15  # 更长的完整文本置信度低不超过此值时，优先保留完整的那条
+
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", "", (s or "").lower())
+
+def _arrays(hits: List[Dict]):
+    b = np.array([[h['box']['x'], h['box']['y'], h['box']['w'], h['box']['h']] for h in hits], dtype=np.float32).reshape(-1, 4)
+    x0, y0 = b[:, 0], b[:, 1]
+    x1, y1 = x0 + b[:, 2], y0 + b[:, 3]
+    conf = np.array([float(h.get('conf') or 0.0) for h in hits], dtype=np.float32)
+    return x0, y0, x1, y1, conf
+
+def dedup_hits(hits: List[Dict]) -> Tuple[List[Dict], int]:
+    """贪心 NMS（按置信度降序）；返回 (保留的 hits, 去掉的条数)"""
+    n = len(hits)
+    if n < 2:
+        return hits, 0
+    x0, y0, x1, y1, conf = _arrays(hits)
+    area = np.maximum(1.0, (x1 - x0) * (y1 - y0))
+    texts = [_norm(h.get('text')) for h in hits]
+    order = np.argsort(-conf, kind="stable")
+    alive = np.ones(n, dtype=bool)
+    keep = []
+    for i in order:
+        if not alive[i]:
+            continue
+        alive[i] = False
+        iw = np.minimum(x1[i], x1) - np.maximum(x0[i], x0)
+        ih = np.minimum(y1[i], y1) - np.maximum(y0[i], y0)
+        cand = np.nonzero(alive & (iw > 0) & (ih > 0))[0]
+        cand = cand[np.argsort(-conf[cand], kind="stable")]
+        best = i
+        if cand.size:
+            inter = iw[cand] * ih[cand]
+            iou = inter / (area[i] + area[cand] - inter)
+            contain = inter / np.minimum(area[i], area[cand])
+            for j, v_iou, v_con in zip(cand, iou, contain):
+                ti, tj = texts[best], texts[j]
+                similar = bool(ti) and bool(tj) and (ti in tj or tj in ti)
+                if v_iou >= DEDUP_IOU_STRICT or (v_iou >= DEDUP_IOU and similar) or (v_con >= DEDUP_CONTAIN and similar):
+                    alive[j] = False
+                    # 断在块边缘的残片置信度往往更高，完整的那条更有用
+                    if len(tj) > len(ti) and ti in tj and conf[j] >= conf[best] - PREFER_LONGER_SLACK:
+                        best = j
+        keep.append(best)
+    keep.sort()
+    return [hits[k] for k in keep], n - len(keep)
+
+def _join_text(a: str, b: str) -> str:
+    # 重叠带里两边都识别到的字：找 a 的后缀与 b 的前缀最长重合
+    for k in range(min(len(a), len(b)), 0, -1):
+        if a[-k:] == b[:k]:
+            return a + b[k:]
+    return a + b
+
+def _near(v: float, cuts: np.ndarray, tol: float) -> bool:
+    return cuts.size > 0 and bool(np.any(np.abs(cuts - v) <= tol))
+
+def merge_fragments(hits: List[Dict], cut_xs: Sequence[float] = (), cut_ys: Sequence[float] = ()) -> Tuple[List[Dict], int]:
+    """
+    合并被块边界切开的碎片：同一行（或同一竖列）、高度相近、首尾相接/略有重叠，
+    且断口在某条块边界附近。没有断口信息（cut_xs/cut_ys 为空）时不合并。
+    """
+    n = len(hits)
+    if n < 2 or (not len(cut_xs) and not len(cut_ys)):
+        return hits, 0
+    cx, cy = np.asarray(sorted(set(cut_xs)), dtype=np.float32), np.asarray(sorted(set(cut_ys)), dtype=np.float32)
+    x0, y0, x1, y1, conf = _arrays(hits)
+    hh, ww = y1 - y0, x1 - x0
+    merged = 0
+    out = [dict(h, box=dict(h['box'])) for h in hits]
+    gone = np.zeros(n, dtype=bool)
+
+    for axis in ("x", "y"):
+        # x：横排，按行左右拼；y：竖向框，按列上下拼
+        if axis == "x":
+            lo, hi, span_lo, span_hi, thick, cuts = x0, x1, y0, y1, hh, cx
+            mask = ww >= hh
+        else:
+            lo, hi, span_lo, span_hi, thick, cuts = y0, y1, x0, x1, ww, cy
+            mask = hh > ww
+        idx = np.nonzero(mask & ~gone)[0]
+        idx = idx[np.argsort(lo[idx], kind="stable")]
+        for a_pos, a in enumerate(idx):
+            if gone[a]:
+                continue
+            tol = 0.5 * thick[a]
+            if not _near(hi[a], cuts, tol):
+                continue
+            rest = idx[a_pos + 1:]
+            c = (~gone[rest]) & (lo[rest] <= hi[a] + 0.2 * thick[a]) & (lo[rest] >= lo[a])
+            ov = np.minimum(span_hi[a], span_hi[rest]) - np.maximum(span_lo[a], span_lo[rest])
+            c &= ov >= 0.6 * np.minimum(thick[a], thick[rest])
+            ratio = thick[rest] / max(1.0, float(thick[a]))
+            c &= (ratio >= 0.7) & (ratio <= 1.4)
+            for b in rest[c]:
+                ta, tb = out[a]['text'], out[b]['text']
+                overlap_px = hi[a] - lo[b]
+                joined = _join_text(ta, tb)
+                # 框重叠明显却找不到文本重合：多半是两条不同的字，不拼
+                if overlap_px > 0.3 * min(hi[a] - lo[a], hi[b] - lo[b]) and len(joined) == len(ta) + len(tb):
+                    continue
+                la, lb = max(1, len(ta)), max(1, len(tb))
+                out[a]['text'] = joined
+                out[a]['conf'] = float((conf[a] * la + conf[b] * lb) / (la + lb))
+                nx0, ny0 = min(x0[a], x0[b]), min(y0[a], y0[b])
+                nx1, ny1 = max(x1[a], x1[b]), max(y1[a], y1[b])
+                x0[a], y0[a], x1[a], y1[a] = nx0, ny0, nx1, ny1
+                out[a]['box'] = {'x': int(nx0), 'y': int(ny0), 'w': int(max(1, nx1 - nx0)), 'h': int(max(1, ny1 - ny0))}
+                conf[a] = out[a]['conf']
+                gone[b] = True
+                merged += 1
+                break
+    return [h for k, h in enumerate(out) if not gone[k]], merged
+
+def postprocess_hits(hits: List[Dict], cut_xs: Sequence[float] = (), cut_ys: Sequence[float] = ()) -> Tuple[List[Dict], Dict[str, int]]:
+    hits, removed = dedup_hits(hits)
+    hits, merged = merge_fragments(hits, cut_xs, cut_ys)
+    return hits, {'removed': removed, 'merged': merged}
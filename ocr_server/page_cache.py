@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+内容寻址的 OCR 页缓存。
+
+key = sha1(页内容指纹 + dpi/tile/overlap + OCR 版本)
+  - 页内容指纹：页面尺寸/旋转 + 内容流 + 引用的图片/表单 XObject 原始流
+    （扫描件各页内容流几乎相同，必须把图片流算进去）
+  - 改名不影响 key；同名替换后内容变了 key 随之变化
+
+存储：CACHE_DIR/_pages/<key[:2]>/<key>.json（只读，写入后不再修改）
+按文件名的 page_XXXX_{dpi}_rapidocr.json 照旧保留，并带 cache_key 字段，供旧接口读取。
+"""
+import os, json, hashlib, shutil
+from pathlib import Path
+from typing import Dict
+
+def page_fingerprint(doc, page_index: int) -> str:
+    page = doc.load_page(page_index)
+    h = hashlib.sha1()
+    r = page.rect
+    h.update(f"{r.width:.2f}x{r.height:.2f}r{page.rotation}".encode())
+    try:
+        h.update(page.read_contents() or b"")
+    except Exception:
+        pass
+    xrefs = {img[0] for img in page.get_images(full=True)}
+    try:
+        xrefs.update(x[0] for x in page.get_xobjects())
+    except Exception:
+        pass
+    for xref in sorted(xrefs):
+        try:
+            h.update(doc.xref_stream_raw(xref) or b"")
+        except Exception:
+            h.update(f"x{xref}".encode())
+    return h.hexdigest()
+
+def cache_key(fingerprint: str, dpi: int, tile: int, overlap: float, version: str) -> str:
+    return hashlib.sha1(f"{fingerprint}|{dpi}|{tile}|{overlap}|{version}".encode()).hexdigest()
+
+class PageCache:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def has(self, key: str) -> bool:
+        return self.path(key).exists()
+
+    def put(self, key: str, src: Path):
+        # 从刚写好的页 JSON 落一份到内容寻址区；同盘优先硬链接
+        dst = self.path(key)
+        if dst.exists():
+            return
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_suffix(".json.tmp")
+        try:
+            if tmp.exists():
+                tmp.unlink()
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        tmp.replace(dst)
+
+    def materialize(self, key: str, page_no: int, dest: Path) -> bool:
+        # 命中：按当前页码改写后落到 page_XXXX 文件
+        try:
+            obj = json.loads(self.path(key).read_text("utf-8"))
+        except Exception:
+            return False
+        obj["page"] = page_no
+        obj["cache_key"] = key
+        tmp = dest.with_suffix(dest.suffix + ".tmp")
+        tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(dest)
+        return True
+
+# ---------------- 文档目录内的 页码 → key 索引（免去逐页解析 JSON 比对） ----------------
+def key_index_path(doc_root: Path, dpi: int) -> Path:
+    return Path(doc_root) / f"keys_{dpi}.json"
+
+def load_key_index(doc_root: Path, dpi: int) -> Dict[int, str]:
+    try:
+        raw = json.loads(key_index_path(doc_root, dpi).read_text("utf-8"))
+        return {int(k): str(v) for k, v in raw.items()}
+    except Exception:
+        return {}
+
+def save_key_index(doc_root: Path, dpi: int, index: Dict[int, str]):
+    p = key_index_path(doc_root, dpi)
+    tmp = p.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps({str(k): v for k, v in sorted(index.items())}), encoding="utf-8")
+    tmp.replace(p)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+PDF 来源：按文件名直接打开 PDF_DIR 里的本地文件，远程 URL 落临时文件，不整本读进内存。
+
+- local_pdf：文件名 → PDF_DIR 下的路径（只认目录下一层的 .pdf，拒绝 ..、隐藏文件、软链出目录）
+- spool_url：流式下载到临时文件，边写边算 sha1
+- DocCache：打开的 fitz.Document 按 (路径, mtime, 大小) 做 LRU；fitz.open(路径) 按需读文件，
+  单页请求不必解析/拷贝整本。文件被替换（mtime/大小变了）即重开，sha1 随句柄缓存
+- open_pdf：OCR 流程的统一入口，优先本地、其次 URL
+
+fitz.Document 不是线程安全的：同一句柄同一时刻只能一个线程用（OCR 已由文档锁串行）。
+淘汰的句柄只是不再缓存、不主动 close，仍持有它的调用方不受影响，引用释放后自动关闭。
+
+配置（环境变量）：
+  PDF_DOC_CACHE        常驻的文档句柄数（默认 4；0 = 不缓存，每次重开）
+  PDF_SPOOL_MAX_MB     远程下载大小上限（默认 2048）
+  PDF_FETCH_TIMEOUT    远程下载的连接/读超时秒数（默认 30）
+"""
+import os, hashlib, tempfile, threading, unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+import fitz  # PyMuPDF
+
+PDF_DOC_CACHE = int(os.environ.get("PDF_DOC_CACHE", "4"))
+PDF_SPOOL_MAX_MB = int(os.environ.get("PDF_SPOOL_MAX_MB", "2048"))
+PDF_FETCH_TIMEOUT = float(os.environ.get("PDF_FETCH_TIMEOUT", "30"))
+_CHUNK = 1 << 20
+
+# ---------------- 本地文件 ----------------
+def local_pdf(pdf_dir: Path, name: str) -> Optional[Path]:
+    """PDF_DIR 下名为 name 的 PDF；不存在或名字不安全时返回 None"""
+    name = unicodedata.normalize("NFC", name or "")
+    if (not name or name != Path(name).name or name.startswith(".") or "\x00" in name
+            or "/" in name or "\\" in name or not name.lower().endswith(".pdf")):
+        return None
+    base = Path(pdf_dir).resolve()
+    path = (base / name).resolve()
+    if path.parent != base or not path.is_file():
+        return None
+    return path
+
+def file_sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# ---------------- 远程 URL ----------------
+def spool_url(url: str, spool_dir: Path) -> Tuple[Path, str]:
+    """流式下载到 spool_dir 下的临时文件，返回 (路径, sha1)；失败时删掉半截文件再抛出"""
+    import requests
+    fd, tmp = tempfile.mkstemp(suffix=".pdf", dir=spool_dir)
+    h, size, limit = hashlib.sha1(), 0, PDF_SPOOL_MAX_MB * 1048576
+    try:
+        with os.fdopen(fd, "wb") as f, requests.get(url, stream=True, timeout=PDF_FETCH_TIMEOUT) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(_CHUNK):
+                size += len(chunk)
+                if size > limit:
+                    raise ValueError(f"PDF 超过 {PDF_SPOOL_MAX_MB} MB：{url}")
+                h.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return Path(tmp), h.hexdigest()
+
+# ---------------- 打开的文档句柄 LRU ----------------
+class _Entry:
+    __slots__ = ("sig", "doc", "sha1")
+
+    def __init__(self, sig: tuple, doc):
+        self.sig, self.doc, self.sha1 = sig, doc, None
+
+class DocCache:
+    """路径 → fitz.Document 的 LRU；(mtime, 大小) 变化即重开"""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._docs: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, path: Path) -> _Entry:
+        key = str(path)
+        st = os.stat(key)
+        sig = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            e = self._docs.get(key)
+            if e is not None and e.sig == sig:
+                self._docs.move_to_end(key)
+                self.hits += 1
+                return e
+            self.misses += 1
+            if e is not None:
+                self.invalidations += 1
+                del self._docs[key]
+        e = _Entry(sig, fitz.open(key))
+        if self.capacity > 0:
+            with self._lock:
+                self._docs[key] = e
+                while len(self._docs) > self.capacity:
+                    self._docs.popitem(last=False)
+                    self.evictions += 1
+        return e
+
+    def get(self, path: Path):
+        return self._entry(Path(path)).doc
+
+    def get_with_sha1(self, path: Path):
+        """(doc, sha1)；sha1 按需计算一次，随句柄缓存"""
+        e = self._entry(Path(path))
+        if e.sha1 is None:
+            e.sha1 = file_sha1(Path(path))
+        return e.doc, e.sha1
+
+    def drop(self, path: Path):
+        with self._lock:
+            self._docs.pop(str(path), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "docs": len(self._docs),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+_cache: Optional[DocCache] = None
+_cache_lock = threading.Lock()
+
+def doc_cache() -> DocCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DocCache(PDF_DOC_CACHE)
+        return _cache
+
+# ---------------- 统一入口 ----------------
+class OpenedPdf:
+    __slots__ = ("doc", "path", "sha1", "source")
+
+    def __init__(self, doc, path: Path, sha1: str, source: str):
+        self.doc, self.path, self.sha1, self.source = doc, path, sha1, source
+
+@contextmanager
+def open_pdf(pdf_name: str, pdf_url: str, pdf_dir: Path, spool_dir: Path, prefer_local: bool = True) -> Iterator[OpenedPdf]:
+    """
+    prefer_local 且 PDF_DIR 里有同名文件：直接用（句柄进 LRU，source='local'）；
+    否则下载 pdf_url 到临时文件（句柄不缓存，退出时关闭并删除，source='url'）。
+    path 可直接交给进程池的工作进程各自打开。
+    """
+    path = local_pdf(pdf_dir, pdf_name) if prefer_local else None
+    if path is not None:
+        doc, sha1 = doc_cache().get_with_sha1(path)
+        yield OpenedPdf(doc, path, sha1, "local")
+        return
+    if not pdf_url:
+        raise FileNotFoundError(f"PDF_DIR 中没有 {pdf_name}，且未提供 pdf_url")
+    spool, sha1 = spool_url(pdf_url, spool_dir)
+    doc = None
+    try:
+        doc = fitz.open(str(spool))
+        yield OpenedPdf(doc, spool, sha1, "url")
+    finally:
+        if doc is not None:
+            doc.close()
+        try:
+            os.unlink(spool)
+        except OSError:
+            pass
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+QA 检索：每文档一份内存 BM25 索引，随 llm_qa 的文档缓存常驻（文档版本变了随之重建）。
+
+- 单元：普通 OCR 行（一条 hit）与表格行（layout 标记 TABLE_ROW 的整行，拼成一条）；
+  属于表格行的 hit 只作为表格行出现，不重复计
+- 切词：中文连续串取单字 + 相邻二字；拉丁/数字串取整词（去掉连字符，A-12 ≡ A12），带连字符的再拆出两字符以上的段；
+  查询侧先去掉疑问词/虚词（什么、哪个、吗、的……）
+- 打分：BM25（k1=1.2, b=0.75），标题行、表格行按版面略加权
+- 倒排：(词, 单元) 排序后的 CSR 数组，查询对命中词的倒排段整体向量化累加
+"""
+import math, re, unicodedata
+from typing import Dict, Iterable, List, Sequence, Tuple
+import numpy as np
+
+K1, B = 1.2, 0.75
+LINE, ROW = 0, 1
+TITLE_BOOST = 1.3    # 标题行（框高 ≥ 本页 h90）
+ROW_BOOST = 1.2      # 表格行：针脚/连接器问题的答案多在表里
+
+_CJK = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+_LATIN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+# 问句里的疑问词/虚词：只在查询侧切词前去掉（文档侧靠 idf 自然降权）
+_QUERY_FILLER = re.compile(r"请问|是什么|是多少|是哪|什么|哪个|哪些|哪里|在哪|多少|怎么|如何|是否|吗|呢|吧|的")
+
+def tokenize(s: str) -> List[str]:
+    s = unicodedata.normalize("NFKC", s or "").lower()
+    out: List[str] = []
+    for run in _CJK.findall(s):
+        out.extend(run)
+        out.extend(run[i:i + 2] for i in range(len(run) - 1))
+    for w in _LATIN.findall(s):
+        out.append(w.replace("-", ""))
+        if "-" in w:
+            out.extend(p for p in w.split("-") if len(p) >= 2)
+    return out
+
+def query_tokens(*texts: str) -> List[str]:
+    """问题与扩展词合并切词、去重（保持顺序）"""
+    seen: Dict[str, None] = {}
+    for t in texts:
+        for tok in tokenize(_QUERY_FILLER.sub(" ", t or "")):
+            seen.setdefault(tok, None)
+    return list(seen)
+
+def estimate_tokens(s: str) -> int:
+    """粗估 LLM token 数：中文一字约一个，其余非空白字符约四个一个，另加换行"""
+    s = s or ""
+    cjk = sum(len(r) for r in _CJK.findall(s))
+    other = len(re.sub(r"\s+", "", s)) - cjk
+    return cjk + (other + 3) // 4 + 1
+
+class BM25Index:
+    def __init__(self, texts: Sequence[str], kind: Iterable[int], page: Iterable[int], ref: Iterable[int], boost: Iterable[float]):
+        n = len(texts)
+        self.n = n
+        self.kind = np.fromiter(kind, np.uint8, n)
+        self.page = np.fromiter(page, np.int32, n)
+        self.ref = np.fromiter(ref, np.int32, n)      # LINE → 条目下标，ROW → 表格行下标
+        self.boost = np.fromiter(boost, np.float32, n)
+        vocab: Dict[str, int] = {}
+        toks: List[int] = []
+        units: List[int] = []
+        dl = np.zeros(n, np.float32)
+        for u, text in enumerate(texts):
+            ts = tokenize(text)
+            dl[u] = len(ts)
+            for t in ts:
+                toks.append(vocab.setdefault(t, len(vocab)))
+            units.extend([u] * len(ts))
+        self.vocab = vocab
+        # (词, 单元) 去重计数即 tf；按词排序后每个词的倒排是连续一段
+        key, tf = np.unique(np.asarray(toks, np.int64) * max(1, n) + np.asarray(units, np.int64), return_counts=True)
+        self.post_unit = (key % max(1, n)).astype(np.int32)
+        self.post_tf = tf.astype(np.float32)
+        self.post_off = np.searchsorted(key // max(1, n), np.arange(len(vocab) + 1)).astype(np.int64)
+        self.avgdl = float(dl.mean()) if n else 0.0
+        # 长度归一项只与单元有关：建索引时算好
+        self._norm = (K1 * (1 - B + B * dl / self.avgdl)).astype(np.float32) if n and self.avgdl else np.ones(n, np.float32)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.kind, self.page, self.ref, self.boost, self.post_unit, self.post_tf, self.post_off, self._norm)
+        return sum(a.nbytes for a in arrays) + 96 * len(self.vocab)
+
+    def search(self, tokens: Sequence[str], limit: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (单元 id, 分数)，分数降序（同分按 id 升序）；没有命中返回空数组"""
+        parts_u, parts_s = [], []
+        for t in tokens:
+            tid = self.vocab.get(t)
+            if tid is None:
+                continue
+            a, b = int(self.post_off[tid]), int(self.post_off[tid + 1])
+            df = b - a
+            idf = math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+            u, tf = self.post_unit[a:b], self.post_tf[a:b]
+            parts_u.append(u)
+            parts_s.append(idf * tf * (K1 + 1) / (tf + self._norm[u]))
+        if not parts_u:
+            return np.zeros(0, np.int32), np.zeros(0, np.float32)
+        ids, inv = np.unique(np.concatenate(parts_u), return_inverse=True)
+        score = np.bincount(inv.reshape(-1), weights=np.concatenate(parts_s)) * self.boost[ids]
+        order = np.lexsort((ids, -score))[:limit]
+        return ids[order], score[order].astype(np.float32)
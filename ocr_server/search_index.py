@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+每文档的倒排索引（CACHE_DIR/<pdf_name>/search_{dpi}.npz），供 /search 使用。
+
+- 词元：规范化文本（去空白、小写）的字符三元组，中文、拉丁字母、数字、符号一视同仁；
+  末尾补两个填充符，每个字符恰好起一个三元组（"c12" → c12 / 12␃ / 2␃␃）
+- 倒排：三列 (gram_id, page, idx) 按 gram_id 排序，gram 词表有序 → 二分定位
+- 查询：≤ 3 字的词是某个三元组的前缀，按前缀范围取；更长的词取其各三元组求交。
+  词落在 token 中间也能命中（12 → A12，123 → C123-1，ecu → ABSECU）；
+  候选一律回列式整本（ocr_book）核对子串，命中结果与旧前端“包含即命中”一致
+- 排序权重与前端原逻辑相同：1 + 表格行(同行密度 ≥ 12) + 3 × 标题(框高 ≥ 本页 h90)，直接取整本里的版面标记（ocr_layout）
+- 增量：OCR 完成后按整本里的页摘要比对，只重算变化的页，删除的页随之去掉
+"""
+import os, re, bisect, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+import ocr_book, ocr_layout
+
+INDEX_VERSION = 3
+SEARCH_LRU = int(os.environ.get("SEARCH_LRU", "8"))   # 常驻内存的索引数下限；全库检索登记分片时抬到分片数
+GRAM = 3
+_PAD = "\x03"                                          # 补尾的填充符（规范化时从文本里去掉）
+_TOP = "\U0010ffff" * GRAM                              # 前缀范围的上界
+_capacity = SEARCH_LRU
+
+def normalize(s: str) -> str:
+    return re.sub(r"[\s\x00-\x1f]+", "", (s or "").lower())
+
+def index_path(doc_root: Path, dpi: int) -> Path:
+    return Path(doc_root) / f"search_{dpi}.npz"
+
+def text_grams(t: str) -> Set[str]:
+    """建索引用：规范化文本的三元组（末尾补齐），长度 n 的文本至多 n 个"""
+    p = t + _PAD * (GRAM - 1)
+    return {p[i:i + GRAM] for i in range(len(t))}
+
+def reserve(n: int):
+    """全库检索登记分片后调用：常驻索引数至少覆盖全部分片，扇出查询不再每次从磁盘重读"""
+    global _capacity
+    with _lock:
+        _capacity = max(SEARCH_LRU, n)
+
+class SearchIndex:
+    def __init__(self):
+        self.vocab: List[str] = []
+        self.gid = np.zeros(0, np.int32)
+        self.page = np.zeros(0, np.int32)
+        self.idx = np.zeros(0, np.int32)
+        self.digests: Dict[int, int] = {}            # 页 → 建索引时的整本页摘要
+        self._pd = None                              # (页数组, 摘要数组) 缓存，供 matches 向量化比对
+
+    def matches(self, book: ocr_book.OcrBook) -> bool:
+        if self._pd is None:
+            pages = sorted(self.digests)
+            self._pd = (np.array(pages, np.int64), np.array([self.digests[p] for p in pages], np.uint64))
+        return (np.array_equal(self._pd[0], book.pages_arr["page"].astype(np.int64))
+                and np.array_equal(self._pd[1], book.pages_arr["digest"]))
+
+    # ---------------- 持久化 ----------------
+    def save(self, path: Path):
+        pages = np.array(sorted(self.digests), dtype=np.int32)
+        blob = "\0".join(self.vocab).encode("utf-8")
+        tmp = Path(path).with_suffix(".tmp.npz")
+        np.savez(tmp, version=np.array([INDEX_VERSION]), vocab=np.frombuffer(blob, np.uint8),
+                 gid=self.gid, page=self.page, idx=self.idx,
+                 dpages=pages, ddigest=np.array([self.digests[int(p)] for p in pages], dtype=np.uint64))
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["SearchIndex"]:
+        try:
+            with np.load(path) as z:
+                if int(z["version"][0]) != INDEX_VERSION:
+                    return None
+                arr = {k: z[k] for k in z.files}
+        except Exception:
+            return None
+        ix = cls()
+        blob = arr["vocab"].tobytes().decode("utf-8")
+        ix.vocab = blob.split("\0") if blob else []
+        ix.gid, ix.page, ix.idx = arr["gid"], arr["page"], arr["idx"]
+        ix.digests = dict(zip(arr["dpages"].tolist(), arr["ddigest"].tolist()))
+        return ix
+
+    # ---------------- 增量更新 ----------------
+    def sync(self, book: ocr_book.OcrBook) -> bool:
+        """按页摘要与整本对齐；返回是否有变化"""
+        cur = dict(zip(book.pages_arr["page"].tolist(), book.pages_arr["digest"].tolist()))
+        stale = {p for p, d in self.digests.items() if cur.get(p) != d}
+        todo = [p for p, d in cur.items() if self.digests.get(p) != d]
+        if not stale and not todo:
+            return False
+
+        # 去掉变化/删除页的旧倒排
+        if stale:
+            keep = ~np.isin(self.page, np.fromiter(stale, np.int32, len(stale)))
+            self.gid, self.page, self.idx = self.gid[keep], self.page[keep], self.idx[keep]
+        for p in stale:
+            self.digests.pop(p, None)
+
+        # 新页：逐条取文本切词
+        terms, pages, idxs = [], [], []
+        for p in todo:
+            boxes, _, s = book.hit_arrays(p)
+            for j, t in enumerate(book._texts_of(s, s + len(boxes))):
+                for g in text_grams(normalize(t)):
+                    terms.append(g); pages.append(p); idxs.append(j)
+            self.digests[p] = cur[p]
+
+        # 词表合并：旧 id 经 searchsorted 重映射，不必把旧倒排还原成字符串
+        old_vocab = np.asarray(self.vocab, dtype=str)
+        new_terms = np.asarray(terms, dtype=str)
+        vocab = np.union1d(old_vocab, new_terms)
+        gid = np.concatenate([np.searchsorted(vocab, old_vocab)[self.gid] if len(self.gid) else np.zeros(0, np.int64),
+                              np.searchsorted(vocab, new_terms)])
+        page = np.concatenate([self.page, np.asarray(pages, np.int32)])
+        idx = np.concatenate([self.idx, np.asarray(idxs, np.int32)])
+        order = np.argsort(gid, kind="stable")
+        self.vocab = vocab.tolist()
+        self.gid, self.page, self.idx = gid[order].astype(np.int32), page[order], idx[order]
+        self._pd = None
+        return True
+
+    # ---------------- 查询 ----------------
+    def _postings(self, lo: int, hi: int) -> np.ndarray:
+        # gram id 区间 [lo, hi) → (page << 32 | idx) 的有序唯一数组
+        a, b = np.searchsorted(self.gid, [lo, hi])
+        return np.unique((self.page[a:b].astype(np.int64) << 32) | self.idx[a:b])
+
+    def _gram_range(self, g: str, prefix: bool) -> Tuple[int, int]:
+        lo = bisect.bisect_left(self.vocab, g)
+        hi = bisect.bisect_right(self.vocab, g + _TOP) if prefix else (lo + 1 if lo < len(self.vocab) and self.vocab[lo] == g else lo)
+        return lo, hi
+
+    @staticmethod
+    def _keys(term: str) -> List[Tuple[str, bool]]:
+        # 短词：以它开头的三元组（前缀范围）；长词：每个三元组都得出现
+        if len(term) <= GRAM:
+            return [(term, len(term) < GRAM)]
+        return list(dict.fromkeys((term[i:i + GRAM], False) for i in range(len(term) - GRAM + 1)))
+
+    def candidates(self, term: str) -> Optional[np.ndarray]:
+        """term 已规范化；返回候选 (page<<32|idx)，无法用索引约束时返回 None"""
+        keys = self._keys(term)
+        if not keys:
+            return None
+        lists = [self._postings(*self._gram_range(g, pre)) for g, pre in keys]
+        lists.sort(key=len)
+        out = lists[0]
+        for lst in lists[1:]:
+            if not len(out):
+                break
+            out = np.intersect1d(out, lst, assume_unique=True)
+        return out
+
+# ---------------- 打开 / 更新 / 查询 ----------------
+_cache: "OrderedDict[str, Tuple[float, SearchIndex]]" = OrderedDict()
+_lock = threading.Lock()
+
+_path_locks: Dict[str, threading.Lock] = {}
+
+def _path_lock(path: Path) -> threading.Lock:
+    with _lock:
+        return _path_locks.setdefault(str(path), threading.Lock())
+
+def update(doc_root: Path, dpi: int, book: Optional[ocr_book.OcrBook] = None) -> Optional[SearchIndex]:
+    """OCR 完成后调用（/search 时发现过期也会调用）；只重算变化的页"""
+    book = book or ocr_book.open_book(doc_root, dpi)
+    path = index_path(doc_root, dpi)
+    if book is None:
+        return None
+    # 读盘/重算只锁本文档：全库检索并发打开多个分片时互不阻塞
+    with _path_lock(path):
+        ix = SearchIndex.load(path) if path.exists() else None
+        ix = ix or SearchIndex()
+        if ix.sync(book) or not path.exists():
+            ix.save(path)
+        mtime = path.stat().st_mtime
+    with _lock:
+        _cache[str(path)] = (mtime, ix)
+        _cache.move_to_end(str(path))
+        while len(_cache) > _capacity:
+            _cache.popitem(last=False)
+    return ix
+
+def open_index(doc_root: Path, dpi: int, book: ocr_book.OcrBook) -> Optional[SearchIndex]:
+    path = index_path(doc_root, dpi)
+    with _lock:
+        hit = _cache.get(str(path))
+        if hit and path.exists() and hit[0] == path.stat().st_mtime:
+            _cache.move_to_end(str(path))
+            # 整本已更新而索引没跟上（如手工转换）：补一次
+            if hit[1].matches(book):
+                return hit[1]
+    return update(doc_root, dpi, book)
+
+def term_counts(doc_root: Path, dpi: int, terms: Iterable[str]) -> Optional[List[int]]:
+    """每个词的候选 hit 数（不回整本核对子串，作上界用）；全库问答给文档排序用，未 OCR 返回 None"""
+    book = ocr_book.open_book(doc_root, dpi)
+    if book is None:
+        return None
+    ix = open_index(doc_root, dpi, book)
+    out = []
+    for term in terms:
+        cand = ix.candidates(normalize(term)) if normalize(term) else None
+        out.append(0 if cand is None else int(len(cand)))
+    return out
+
+def search(doc_root: Path, dpi: int, terms: Iterable[str], limit: int = 500) -> Dict:
+    """terms 为查询词及其同义词；任一命中即算（同旧前端），按权重降序、页序升序"""
+    book = ocr_book.open_book(doc_root, dpi)
+    if book is None:
+        return {"hits": [], "total": 0, "indexed": False}
+    ix = open_index(doc_root, dpi, book)
+    nums, starts = book.pages_arr["page"], book.pages_arr["start"].astype(np.int64)
+    terms = [t for t in dict.fromkeys(normalize(t) for t in terms) if t]
+    found = []
+    for term in terms:
+        cand = ix.candidates(term)
+        if cand is None or not len(cand):
+            continue
+        # (page, idx) → 整本全局序号
+        gi = starts[np.searchsorted(nums, cand >> 32)] + (cand & 0xFFFFFFFF)
+        gi = gi[[term in normalize(book.text(g)) for g in gi.tolist()]]
+        found.append(gi)
+    if not found:
+        return {"hits": [], "total": 0, "indexed": True, "pages": book.n_pages}
+    gi = np.unique(np.concatenate(found))
+    score = ocr_layout.weights(book.layout["flags"][gi])
+    top = gi[np.lexsort((gi, -score.astype(np.int64)))[:limit]]
+
+    hits = []
+    for g, sc in zip(top.tolist(), ocr_layout.weights(book.layout["flags"][top]).tolist()):
+        k = int(np.searchsorted(starts, g, "right")) - 1
+        x, y, w, h = book.boxes[g].tolist()
+        hits.append({
+            "page": int(nums[k]), "index": g - int(starts[k]), "text": book.text(g),
+            "score": int(sc),
+            "box": {"x": x, "y": y, "w": w, "h": h}, "conf": round(float(book.conf[g]), 6),
+            "pw": int(book.pages_arr["w"][k]), "ph": int(book.pages_arr["h"][k]),
+        })
+    return {"hits": hits, "total": int(len(gi)), "indexed": True, "pages": book.n_pages}
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# 后端是平铺模块（main.py 旁边直接 import），测试把 ocr_server/ 放进 sys.path
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
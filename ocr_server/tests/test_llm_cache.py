@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import threading, time
+import pytest
+from llm_cache import LLMCache, make_key
+
+def _cache(tmp_path, **kw):
+    return LLMCache(tmp_path / "llm_cache.sqlite", **kw)
+
+def test_put_get_round_trip(tmp_path):
+    c = _cache(tmp_path)
+    key = make_key("qa", "doc", "问题")
+    assert c.get(key) is None
+    c.put(key, {"answer": "继电器 R12", "pages": [3]})
+    assert c.get(key) == {"answer": "继电器 R12", "pages": [3]}
+    # 重开同一文件：条目和字节数都还在
+    c2 = _cache(tmp_path)
+    assert c2.get(key) == {"answer": "继电器 R12", "pages": [3]}
+    assert c2.bytes == c.bytes > 0
+
+def test_expired_entry_is_a_miss_and_removed(tmp_path):
+    c = _cache(tmp_path, ttl=60)
+    key = make_key("syn", "ECU")
+    c.put(key, ["发动机控制单元"], created=time.time() - 120)
+    assert c.get(key, count=True) is None
+    assert c.expired == 1 and c.bytes == 0
+    assert c.stats()["entries"] == 0
+    assert c.stats()["kinds"]["syn"]["misses"] == 1
+
+def test_fresh_entry_within_ttl_hits(tmp_path):
+    c = _cache(tmp_path, ttl=60)
+    key = make_key("syn", "ECU")
+    c.put(key, ["x"], created=time.time() - 30)
+    assert c.get(key) == ["x"]
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    c = _cache(tmp_path, max_bytes=2500)   # 每条约 345 字节，装得下 7 条
+    keys = [make_key("qa", str(i)) for i in range(10)]
+    for k in keys[:5]:
+        c.put(k, "x" * 300)
+    time.sleep(0.01)
+    c.get(keys[0])                          # 最早写入但刚被访问
+    for k in keys[5:]:
+        c.put(k, "x" * 300)
+    assert c.bytes <= 2500 and c.evictions > 0
+    assert c.get(keys[0]) is not None
+    assert c.get(keys[1]) is None
+
+def test_single_flight_computes_once(tmp_path):
+    c = _cache(tmp_path)
+    key = make_key("qa", "same")
+    calls, start = [], threading.Barrier(8)
+    results = [None] * 8
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)                     # 让其余线程都赶上这一趟
+        return {"answer": 42}
+
+    def run(i):
+        start.wait()
+        results[i] = c.get_or_compute(key, compute)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == [{"answer": 42}] * 8
+    k = c.stats()["kinds"]["qa"]
+    assert k["misses"] == 1 and k["hits"] + k["shared"] == 7
+    assert c.stats()["in_flight"] == 0
+    # 之后直接命中
+    assert c.get_or_compute(key, lambda: pytest.fail("不该再算")) == {"answer": 42}
+
+def test_single_flight_error_reaches_waiters_and_is_not_cached(tmp_path):
+    c = _cache(tmp_path)
+    key = make_key("qa", "boom")
+    start = threading.Barrier(4)
+    errors = []
+
+    def compute():
+        time.sleep(0.2)
+        raise RuntimeError("upstream 500")
+
+    def run():
+        start.wait()
+        try:
+            c.get_or_compute(key, compute)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == ["upstream 500"] * 4
+    assert c.get(key) is None
+    assert c.stats()["kinds"]["qa"]["errors"] == 1
+    assert c.get_or_compute(key, lambda: "ok") == "ok"
+
+def test_settings_read_when_cache_is_first_opened(tmp_path, monkeypatch):
+    import llm_cache
+    monkeypatch.setattr(llm_cache, "_cache", None)
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "c.sqlite"))
+    monkeypatch.setenv("LLM_CACHE_TTL_SEC", "120")
+    monkeypatch.setenv("LLM_CACHE_MB", "3")
+    c = llm_cache.llm_cache()
+    assert c.path == tmp_path / "c.sqlite" and c.ttl == 120 and c.max_bytes == 3 * 1024 * 1024
+    assert llm_cache.llm_cache() is c
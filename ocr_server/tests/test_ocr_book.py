@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import json, os, time
+import numpy as np
+import ocr_book, page_cache
+
+DPI = 500
+
+def _page(no, texts, extra=None):
+    hits = [{"text": t, "conf": 0.9 - 0.01 * k, "box": {"x": 10 * k, "y": 20, "w": 30, "h": 12}}
+            for k, t in enumerate(texts)]
+    return {"page": no, "w": 1000, "h": 700, "hits": hits, "tiles": {"total": 4}, **(extra or {})}
+
+def _write(root, obj):
+    p = root / f"page_{obj['page']:04d}_{DPI}_rapidocr.json"
+    p.write_text(json.dumps(obj, ensure_ascii=False), "utf-8")
+    return p
+
+def _later(p):
+    # 保证 mtime 严格晚于刚写的整本（粗粒度文件系统上也成立）
+    t = time.time() + 5
+    os.utime(p, (t, t))
+
+def test_round_trip(tmp_path):
+    pages = [_page(1, ["发动机控制单元", "C123-1"]), _page(2, []), _page(3, ["A12", "0.5 R/B"], {"cache_key": "k3"})]
+    for obj in pages:
+        _write(tmp_path, obj)
+    assert ocr_book.update_from_json(tmp_path, DPI) is not None
+    book = ocr_book.open_book(tmp_path, DPI)
+    assert book.n_pages == 3 and book.n_hits == 4
+    assert list(book.page_numbers) == [1, 2, 3]
+    for obj in pages:
+        got = book.page(obj["page"])
+        assert [h["text"] for h in got["hits"]] == [h["text"] for h in obj["hits"]]
+        assert [h["box"] for h in got["hits"]] == [h["box"] for h in obj["hits"]]
+        np.testing.assert_allclose([h["conf"] for h in got["hits"]], [h["conf"] for h in obj["hits"]], rtol=1e-6)
+        assert got["tiles"] == obj["tiles"]
+    assert book.page(3)["cache_key"] == "k3"
+    assert [p["page"] for p in book.pages(2, 3)] == [2, 3]
+    assert book.page(4) is None
+
+def test_incremental_update_and_etag(tmp_path):
+    for no in (1, 2):
+        _write(tmp_path, _page(no, [f"p{no}"]))
+    ocr_book.update_from_json(tmp_path, DPI)
+    before = ocr_book.open_book(tmp_path, DPI)
+    tag1, tag2 = before.etag([1]), before.etag([2])
+
+    _later(_write(tmp_path, _page(2, ["changed"])))
+    ocr_book.update_from_json(tmp_path, DPI)
+    after = ocr_book.open_book(tmp_path, DPI)
+    assert after is not before
+    assert [h["text"] for h in after.page(2)["hits"]] == ["changed"]
+    assert after.etag([1]) == tag1 and after.etag([2]) != tag2
+
+def test_unchanged_update_does_not_touch_book(tmp_path):
+    _write(tmp_path, _page(1, ["x"]))
+    out = ocr_book.update_from_json(tmp_path, DPI)
+    mtime = out.stat().st_mtime_ns
+    ocr_book.update_from_json(tmp_path, DPI)
+    assert out.stat().st_mtime_ns == mtime
+
+def test_key_index_does_not_hide_book(tmp_path):
+    # 写 keys 索引（OCR 每批结束时）不影响已有整本的读取
+    _write(tmp_path, _page(1, ["x"]))
+    ocr_book.update_from_json(tmp_path, DPI)
+    page_cache.save_key_index(tmp_path, DPI, {1: "k1"})
+    _later(page_cache.key_index_path(tmp_path, DPI))
+    book = ocr_book.open_book(tmp_path, DPI)
+    assert book is not None and book.page(1)["hits"][0]["text"] == "x"
+
+def test_deleted_pages_are_dropped(tmp_path):
+    files = [_write(tmp_path, _page(no, [str(no)])) for no in (1, 2)]
+    ocr_book.update_from_json(tmp_path, DPI)
+    files[1].unlink()
+    ocr_book.update_from_json(tmp_path, DPI)
+    assert list(ocr_book.open_book(tmp_path, DPI).page_numbers) == [1]
+    files[0].unlink()
+    assert ocr_book.update_from_json(tmp_path, DPI) is None
+    assert ocr_book.open_book(tmp_path, DPI) is None
+
+def test_close_releases_mapping(tmp_path):
+    _write(tmp_path, _page(1, ["x"]))
+    out = ocr_book.update_from_json(tmp_path, DPI)
+    book = ocr_book.OcrBook(out)
+    assert book.page(1)["hits"][0]["text"] == "x"
+    book.close()
+    assert book._mm.closed
+
+def test_page_rewritten_in_same_tick_as_book_is_picked_up(tmp_path):
+    p = _write(tmp_path, _page(1, ["old"]))
+    out = ocr_book.update_from_json(tmp_path, DPI)
+    _write(tmp_path, _page(1, ["new"]))
+    st = out.stat()
+    os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns))      # 与书同一时间刻
+    ocr_book.update_from_json(tmp_path, DPI)
+    assert ocr_book.open_book(tmp_path, DPI).page(1)["hits"][0]["text"] == "new"
+
+def test_same_tick_unchanged_page_does_not_rewrite_book(tmp_path):
+    p = _write(tmp_path, _page(1, ["x"]))
+    out = ocr_book.update_from_json(tmp_path, DPI)
+    st = out.stat()
+    os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns))
+    ocr_book.update_from_json(tmp_path, DPI)
+    assert out.stat().st_mtime_ns == st.st_mtime_ns
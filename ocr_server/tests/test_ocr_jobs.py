@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from ocr_jobs import JobManager
+
+DEFAULTS = {"text_layer": True, "orientation": "auto", "dedup": True, "adaptive": False}
+
+def _opts(spec):
+    return {k: spec.get(k, v) for k, v in DEFAULTS.items()}
+
+def _spec(**kw):
+    return {"pdf_name": "a.pdf", "dpi": 500, "tile": 1400, "overlap": 0.12, **kw}
+
+def _manager(tmp_path):
+    # 不 start()：任务停在 queued，正好检验去重
+    return JobManager(lambda spec, job: None, tmp_path, opts_fn=_opts)
+
+def test_same_spec_attaches_to_active_job(tmp_path):
+    jm = _manager(tmp_path)
+    a = jm.submit(_spec())
+    assert jm.submit(_spec()) is a
+    # 显式给出默认值与省略等价
+    assert jm.submit(_spec(adaptive=False, dedup=True)) is a
+
+def test_different_options_get_their_own_job(tmp_path):
+    jm = _manager(tmp_path)
+    a = jm.submit(_spec())
+    for kw in ({"text_layer": False}, {"orientation": "dual"}, {"dedup": False}, {"adaptive": True}):
+        assert jm.submit(_spec(**kw)) is not a
+
+def test_pages_and_force(tmp_path):
+    jm = _manager(tmp_path)
+    a = jm.submit(_spec(pages=[3, 1]))
+    assert jm.submit(_spec(pages=[1, 3])) is a
+    assert jm.submit(_spec(pages=[1])) is not a
+    assert jm.submit(_spec(pages=[1, 3], force=True)) is not a
+
+def test_finished_job_is_not_reused(tmp_path):
+    jm = _manager(tmp_path)
+    a = jm.submit(_spec())
+    a.status = "done"
+    assert jm.submit(_spec()) is not a
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os, time
+import fitz
+import pytest
+import pdf_source
+from pdf_source import DocCache, local_pdf, file_sha1
+
+def _pdf(path, pages=1):
+    doc = fitz.open()
+    for _ in range(pages):
+        doc.new_page()
+    doc.save(str(path))
+    doc.close()
+    return path
+
+@pytest.fixture
+def pdf_dir(tmp_path):
+    d = tmp_path / "pdfs"
+    d.mkdir()
+    _pdf(d / "manual.pdf")
+    _pdf(tmp_path / "secret.pdf")             # PDF_DIR 之外
+    (d / "sub").mkdir()
+    _pdf(d / "sub" / "nested.pdf")
+    return d
+
+def test_local_pdf_accepts_plain_name(pdf_dir):
+    assert local_pdf(pdf_dir, "manual.pdf") == (pdf_dir / "manual.pdf").resolve()
+
+@pytest.mark.parametrize("name", [
+    "../secret.pdf", "..", "sub/nested.pdf", "sub\\nested.pdf", "/etc/passwd", "<abs>",
+    ".hidden.pdf", "manual.pdf\x00.txt", "manual.txt", "", None, "missing.pdf",
+])
+def test_local_pdf_rejects_unsafe_names(pdf_dir, name):
+    if name == "<abs>":                       # PDF_DIR 外的绝对路径
+        name = str(pdf_dir.parent / "secret.pdf")
+    if name == ".hidden.pdf":
+        _pdf(pdf_dir / name)
+    assert local_pdf(pdf_dir, name) is None
+
+def test_local_pdf_rejects_symlink_out_of_dir(pdf_dir):
+    (pdf_dir / "link.pdf").symlink_to(pdf_dir.parent / "secret.pdf")
+    assert local_pdf(pdf_dir, "link.pdf") is None
+
+def test_local_pdf_rejects_directory(pdf_dir):
+    (pdf_dir / "dir.pdf").mkdir()
+    assert local_pdf(pdf_dir, "dir.pdf") is None
+
+def test_open_pdf_unknown_name_without_url(pdf_dir, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        with pdf_source.open_pdf("../secret.pdf", "", pdf_dir, tmp_path):
+            pass
+
+def test_doc_cache_reopens_replaced_file(pdf_dir):
+    path = pdf_dir / "manual.pdf"
+    cache = DocCache(2)
+    doc, sha = cache.get_with_sha1(path)
+    assert doc.page_count == 1 and sha == file_sha1(path)
+    assert cache.get(path) is doc and cache.stats()["hits"] == 1
+    _pdf(path, pages=3)
+    t = time.time() + 5
+    os.utime(path, (t, t))
+    doc2, sha2 = cache.get_with_sha1(path)
+    assert doc2 is not doc and doc2.page_count == 3 and sha2 != sha
+    assert cache.stats()["invalidations"] == 1
+
+def test_doc_cache_lru_eviction(pdf_dir):
+    paths = [_pdf(pdf_dir / f"d{i}.pdf") for i in range(3)]
+    cache = DocCache(2)
+    for p in paths:
+        cache.get(p)
+    assert cache.stats()["docs"] == 2 and cache.stats()["evictions"] == 1
+    cache.get(paths[0])
+    assert cache.stats()["misses"] == 4
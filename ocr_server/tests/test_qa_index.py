@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+import ocr_layout, qa_index
+from qa_index import BM25Index, estimate_tokens, query_tokens, tokenize
+
+# ---------------- 切词 / BM25 ----------------
+def test_tokenize_cjk_and_latin():
+    toks = tokenize("发动机 C123-1 ＥＣＵ")
+    assert {"发", "动", "机", "发动", "动机"} <= set(toks)
+    assert {"c1231", "c123", "ecu"} <= set(toks)        # 连字符去掉后整词 + 拆出的段；全角归一
+    assert "1" not in toks                               # 单字符段不单独成词
+
+def test_query_tokens_drop_fillers_and_dedup():
+    assert query_tokens("ECU 的供电是什么？", "ecu") == ["供", "电", "供电", "ecu"]
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("继电器") == 4
+    assert estimate_tokens("abcd efgh") == 3
+
+def _index(texts, boost=None):
+    n = len(texts)
+    return BM25Index(texts, [qa_index.LINE] * n, [1] * n, range(n), boost or [1.0] * n)
+
+def test_bm25_ranks_rarer_and_denser_matches_first():
+    ix = _index(["ECU 供电", "ECU 接地", "ECU", "继电器 供电 供电", "保险丝"])
+    ids, scores = ix.search(query_tokens("供电"), limit=10)
+    assert ids.tolist() == [3, 0]                        # tf 高的在前
+    assert np.all(np.diff(scores) <= 0)
+    ids, _ = ix.search(query_tokens("ECU 供电"), limit=10)
+    assert ids[0] == 0                                   # 两个词都中的排最前
+    assert ix.search(["不存在"], limit=10)[0].size == 0
+
+def test_bm25_boost_and_limit():
+    ix = _index(["A12 信号", "A12 信号"], boost=[1.0, qa_index.ROW_BOOST])
+    ids, scores = ix.search(["a12"], limit=1)
+    assert ids.tolist() == [1] and scores[0] > 0
+    ids, scores = _index(["x", "x"]).search(["x"], limit=5)
+    assert ids.tolist() == [0, 1]                        # 同分按 id 升序
+
+def test_bm25_empty_index():
+    ix = _index([])
+    assert ix.n == 0 and ix.search(["a"], limit=3)[0].size == 0
+
+# ---------------- 上下文装箱（llm_qa._pack_context） ----------------
+try:
+    import llm_qa
+    _why = ""
+except (ImportError, RuntimeError) as e:   # 缺 openai 依赖或未配置 OPENAI_API_KEY
+    llm_qa, _why = None, f"llm_qa 不可导入：{e}"
+needs_qa = pytest.mark.skipif(llm_qa is None, reason=_why)
+
+def _hit(text, x, y, h=12):
+    return {"text": text, "conf": 0.9, "box": {"x": x, "y": y, "w": 60, "h": h}}
+
+def _pages():
+    p1 = [_hit(f"说明第{i}行", 10, 40 * i) for i in range(8)]
+    p1[4]["text"] = "发动机控制单元 ECU 供电"
+    # 三行针脚表：同一 y 上多条，字母数字串之间隔着中文（行内文本直接拼接后数串）
+    for r, (pin, sig) in enumerate([("PIN", "SIGNAL"), ("C123-1", "B+"), ("C123-2", "GND")]):
+        y = 600 + 30 * r
+        p1 += [_hit(t, 10 + 80 * k, y) for k, t in enumerate([pin, "至", sig, "经", "X1", "接", f"R{r}"])]
+    p2 = [_hit("保险丝 F12 10A", 10, 40), _hit("接地点 G101", 10, 80)]
+    pages = []
+    for no, hits in ((1, p1), (2, p2)):
+        pages.append({"page": no, "w": 1000, "h": 800, "hits": hits, "layout": ocr_layout.analyze_hits(hits)})
+    return pages
+
+def _seeds(doc, q, k=8):
+    ids, _ = doc.index.search(query_tokens(q), limit=k)
+    return [(0, int(u)) for u in ids]
+
+@needs_qa
+def test_pack_line_with_window_and_budget():
+    doc = llm_qa._Doc(("t",), 500, _pages())
+    seeds = _seeds(doc, "ECU 供电")
+    ctx, ev, used_kind, used = llm_qa._pack_context([doc], seeds[:1], window=1, budget=2000)
+    assert ctx.startswith("[Page 1]\n")
+    assert ctx.splitlines()[1:] == ["说明第3行", "发动机控制单元 ECU 供电", "说明第5行"]
+    assert used_kind == "lines" and ev[0]["text"] == "发动机控制单元 ECU 供电" and ev[0]["page"] == 1
+    assert used == llm_qa.PAGE_HEAD_TOKENS + sum(estimate_tokens(t) for t in ctx.splitlines()[1:])
+
+@needs_qa
+def test_pack_falls_back_to_seed_alone_when_window_does_not_fit():
+    doc = llm_qa._Doc(("t",), 500, _pages())
+    seed = _seeds(doc, "ECU 供电")[:1]
+    alone = llm_qa.PAGE_HEAD_TOKENS + estimate_tokens("发动机控制单元 ECU 供电")
+    ctx, _, _, used = llm_qa._pack_context([doc], seed, window=1, budget=alone)
+    assert ctx.splitlines()[1:] == ["发动机控制单元 ECU 供电"]
+    assert used == alone
+    ctx, ev, used_kind, used = llm_qa._pack_context([doc], seed, window=1, budget=alone - 1)
+    assert ctx == "" and ev == [] and used_kind == "none" and used == 0
+
+@needs_qa
+def test_pack_table_row_brings_neighbour_rows():
+    doc = llm_qa._Doc(("t",), 500, _pages())
+    rows = [(0, int(u)) for u in range(doc.index.n) if doc.index.kind[u] == qa_index.ROW]
+    assert len(rows) == 3
+    ctx, ev, used_kind, _ = llm_qa._pack_context([doc], rows[1:2], window=1, budget=2000)
+    assert used_kind == "tables"
+    assert ctx.splitlines()[0] == "[Page 1 · 表格]"
+    assert [l.split(" | ")[0] for l in ctx.splitlines()[1:]] == ["PIN", "C123-1", "C123-2"]
+    assert ev[0]["text"] == "C123-1"
+
+@needs_qa
+def test_pack_never_exceeds_budget_and_orders_by_page():
+    doc = llm_qa._Doc(("t",), 500, _pages())
+    seeds = [(0, u) for u in range(doc.index.n)][::-1]
+    for budget in (10, 25, 40, 80, 2000):
+        ctx, _, _, used = llm_qa._pack_context([doc], seeds, window=2, budget=budget)
+        assert used <= budget
+        heads = [l for l in ctx.splitlines() if l.startswith("[Page")]
+        assert heads == sorted(heads, key=lambda s: int(s.split()[1].rstrip("]")))
+
+@needs_qa
+def test_pack_library_names():
+    a, b = llm_qa._Doc(("a",), 500, _pages()), llm_qa._Doc(("b",), 500, _pages()[1:])
+    seeds = [(1, int(b.index.search(["g101"], 1)[0][0])), (0, int(a.index.search(["f12"], 1)[0][0]))]
+    ctx, ev, _, _ = llm_qa._pack_context([a, b], seeds, window=0, budget=2000, names=["甲.pdf", "乙.pdf"])
+    assert ctx.splitlines()[0] == "[甲.pdf · Page 2]"
+    assert "[乙.pdf · Page 2]" in ctx
+    assert [e["pdf_name"] for e in ev] == ["乙.pdf", "甲.pdf"]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import json, os, time
+import pytest
+import ocr_book, search_index
+
+DPI = 500
+
+PAGES = {
+    1: ["发动机控制单元", "C123-1", "A12", "ABSECU"],
+    2: ["加速踏板位置传感器", "0.5 R/B", "B7", "针脚 A120"],
+    3: ["组合仪表", "C1234", "CAN-H"],
+}
+
+def _write(root, no, texts):
+    hits = [{"text": t, "conf": 0.9, "box": {"x": 10 * k, "y": 20, "w": 30, "h": 12}} for k, t in enumerate(texts)]
+    p = root / f"page_{no:04d}_{DPI}_rapidocr.json"
+    p.write_text(json.dumps({"page": no, "w": 1000, "h": 700, "hits": hits}, ensure_ascii=False), "utf-8")
+    return p
+
+@pytest.fixture
+def doc(tmp_path):
+    for no, texts in PAGES.items():
+        _write(tmp_path, no, texts)
+    ocr_book.update_from_json(tmp_path, DPI)
+    search_index.update(tmp_path, DPI)
+    return tmp_path
+
+def _found(doc, *terms):
+    return sorted((h["page"], h["text"]) for h in search_index.search(doc, DPI, terms)["hits"])
+
+def _substring(*terms):
+    # 旧前端的语义：规范化后包含即命中
+    terms = [search_index.normalize(t) for t in terms]
+    return sorted((no, t) for no, texts in PAGES.items() for t in texts
+                  if any(q in search_index.normalize(t) for q in terms))
+
+@pytest.mark.parametrize("term", ["12", "123", "ecu", "23-1", "-1", "a12", "c123-1", "c12", "1234", "/b", "can-h"])
+def test_infix_pin_and_connector_numbers(doc, term):
+    assert _found(doc, term) == _substring(term)
+    assert _found(doc, term)
+
+def test_infix_examples(doc):
+    assert (1, "A12") in _found(doc, "12")
+    assert (1, "C123-1") in _found(doc, "123")
+    assert _found(doc, "ecu") == [(1, "ABSECU")]
+
+@pytest.mark.parametrize("term", ["发", "控制", "控制单元", "位置传感", "仪表", "针脚a12", "踏板位置传感器"])
+def test_cjk(doc, term):
+    assert _found(doc, term) == _substring(term)
+
+def test_no_false_positives(doc):
+    assert _found(doc, "控单") == []
+    assert _found(doc, "c999") == []
+    assert _found(doc, "x") == []
+
+def test_case_and_whitespace_insensitive(doc):
+    assert _found(doc, "0.5r/b") == _found(doc, "0.5 R/B") == [(2, "0.5 R/B")]
+    assert _found(doc, "Can-h") == [(3, "CAN-H")]
+
+def test_any_term_matches(doc):
+    assert _found(doc, "仪表", "ecu") == [(1, "ABSECU"), (3, "组合仪表")]
+
+def test_incremental_update(doc):
+    p = _write(doc, 2, ["新的文字 X99"])
+    t = time.time() + 5
+    os.utime(p, (t, t))
+    ocr_book.update_from_json(doc, DPI)
+    assert _found(doc, "99") == [(2, "新的文字 X99")]
+    assert _found(doc, "踏板") == []
+    assert (1, "A12") in _found(doc, "12")
+
+def test_reserve_grows_lru(tmp_path):
+    search_index.reserve(search_index.SEARCH_LRU + 5)
+    try:
+        assert search_index._capacity == search_index.SEARCH_LRU + 5
+    finally:
+        search_index.reserve(0)
+    assert search_index._capacity == search_index.SEARCH_LRU
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+每文档的同义词候选词表（CACHE_DIR/<pdf_name>/vocab_{dpi}.json），供 /synonyms 使用。
+
+- 抽词规则同旧 load_vocab_from_ocr_cache：整条文本（2~32 字）、中文 2~6 连续字、英文/缩写片段
+- 每个词记：出现次数 freq、出现页数 pages、类别（zh / en / abbr / code / phrase）、是否出现在标题/表格行
+- OCR 完成后从列式整本建一次；整本内容变了（ETag 不同）时 /synonyms 顺带重建
+- 选词：与查询共享字符（中文单字 / 拉丁二字母）的词按 Jaccard、包含关系、编辑距离打相关度，
+  乘以频次/页数/版面权重排序；相关词不足 limit 时用全文最常见的词补齐（给 LLM 提供领域叫法）
+"""
+import os, re, json, itertools, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional
+import numpy as np
+import ocr_book, ocr_layout
+
+VOCAB_VERSION = 1
+VOCAB_LIMIT = int(os.environ.get("SYN_VOCAB_LIMIT", "150"))  # 送进 LLM 的候选词上限
+VOCAB_LRU = 8
+MIN_REL = 0.25       # 相关度低于此值不算“相关词”
+SHAPE_MAX = 3        # 去掉数字/空白后相同的词最多选几个
+
+CLASSES = ("zh", "en", "abbr", "code", "phrase")
+
+_ZH = re.compile(r"[\u4e00-\u9fff]{2,6}")
+_EN = re.compile(r"[A-Za-z][A-Za-z0-9_/\-]{1,31}")
+_ABBR = re.compile(r"[A-Z]{2,6}")
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9_/\-]*")
+_CJK = re.compile(r"[\u4e00-\u9fff]")
+_LATIN = re.compile(r"[a-z0-9]+")
+_SHAPE = re.compile(r"[\d\s]+")
+
+def vocab_path(doc_root: Path, dpi: int) -> Path:
+    return Path(doc_root) / f"vocab_{dpi}.json"
+
+def extract(t: str) -> List[str]:
+    t = str(t).strip()
+    if not t:
+        return []
+    found = _ZH.findall(t) + _EN.findall(t)
+    if 2 <= len(t) <= 32:
+        found.append(t)
+    return [v for v in found if 2 <= len(v) <= 32]
+
+def term_class(t: str) -> int:
+    if _ZH.fullmatch(t):
+        return CLASSES.index("zh")
+    if _ABBR.fullmatch(t):
+        return CLASSES.index("abbr")
+    if _WORD.fullmatch(t):
+        return CLASSES.index("code" if any(c.isdigit() for c in t) else "en")
+    return CLASSES.index("phrase")
+
+def _keys(t: str) -> FrozenSet[str]:
+    """字符级特征：中文逐字，拉丁/数字串取相邻二字符（单字符串取自身）"""
+    t = t.lower()
+    out = set(_CJK.findall(t))
+    for run in _LATIN.findall(t):
+        out.update([run] if len(run) == 1 else (run[i:i + 2] for i in range(len(run) - 1)))
+    return frozenset(out)
+
+def _lev(a: str, b: str) -> int:
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+class VocabIndex:
+    def __init__(self, terms: List[str], freq, pages, cls, salient, etag: str = "", post: Optional[Dict] = None):
+        self.terms = terms
+        self.freq = np.asarray(freq, np.int32)
+        self.pages = np.asarray(pages, np.int32)
+        self.cls = np.asarray(cls, np.uint8)
+        self.salient = np.asarray(salient, bool)
+        self.etag = etag
+        # 频次 / 页数 / 版面：词本身的重要度，相关度相同时靠它排序，也用于补齐
+        self.weight = 1 + 0.2 * np.log1p(self.freq) + 0.2 * np.log1p(self.pages) + 0.3 * self.salient
+        self._lower = [t.lower() for t in terms]
+        self._len = np.fromiter(map(len, terms), np.int32, len(terms))
+        self._latin = np.isin(self.cls, [CLASSES.index(c) for c in ("en", "abbr", "code")])
+        if post is None:
+            # 特征 → 词 id 的倒排；每个词的特征数 nkeys 供 Jaccard 求并集
+            acc: Dict[str, List[int]] = {}
+            nkeys = []
+            for i, t in enumerate(self._lower):
+                ks = _keys(t)
+                nkeys.append(len(ks))
+                for k in ks:
+                    acc.setdefault(k, []).append(i)
+            post = {"nkeys": nkeys, **{k: v for k, v in acc.items()}}
+        self._nkeys = np.asarray(post.pop("nkeys"), np.int32)
+        self._post = {k: np.asarray(v, np.int32) for k, v in post.items()}
+        self._popular = np.lexsort((np.arange(len(terms)), -self.weight)).tolist()
+
+    @classmethod
+    def build(cls, book: ocr_book.OcrBook) -> "VocabIndex":
+        freq: Dict[str, int] = {}
+        pages: Dict[str, int] = {}
+        salient = set()
+        key_flags = ocr_layout.TITLE | ocr_layout.TABLE_ROW
+        for k in range(book.n_pages):
+            s, n = int(book.pages_arr["start"][k]), int(book.pages_arr["n"][k])
+            seen = set()
+            for t, f in zip(book._texts_of(s, s + n), book.layout["flags"][s:s + n].tolist()):
+                found = extract(t)
+                for v in found:
+                    freq[v] = freq.get(v, 0) + 1
+                seen.update(found)
+                if f & key_flags:
+                    salient.update(found)
+            for v in seen:
+                pages[v] = pages.get(v, 0) + 1
+        terms = sorted(freq)
+        return cls(terms, [freq[t] for t in terms], [pages[t] for t in terms],
+                   [term_class(t) for t in terms], [t in salient for t in terms], book.etag())
+
+    # ---------------- 持久化 ----------------
+    def save(self, path: Path):
+        keys = sorted(self._post)
+        lens = [len(self._post[k]) for k in keys]
+        obj = {"version": VOCAB_VERSION, "etag": self.etag, "classes": CLASSES, "terms": self.terms,
+               "freq": self.freq.tolist(), "pages": self.pages.tolist(), "cls": self.cls.tolist(),
+               "salient": self.salient.astype(int).tolist(), "nkeys": self._nkeys.tolist(),
+               "keys": keys, "post_len": lens,
+               "post": np.concatenate([self._post[k] for k in keys]).tolist() if keys else []}
+        tmp = Path(path).with_suffix(".tmp")
+        tmp.write_text(json.dumps(obj, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["VocabIndex"]:
+        try:
+            obj = json.loads(Path(path).read_text("utf-8"))
+        except (OSError, ValueError):
+            return None
+        if obj.get("version") != VOCAB_VERSION:
+            return None
+        ids = np.asarray(obj["post"], np.int32)
+        post = dict(zip(obj["keys"], np.split(ids, np.cumsum(obj["post_len"])[:-1]))) if obj["keys"] else {}
+        post["nkeys"] = obj["nkeys"]
+        return cls(obj["terms"], obj["freq"], obj["pages"], obj["cls"], obj["salient"], obj.get("etag", ""), post)
+
+    # ---------------- 选词 ----------------
+    def relevance(self, query: str) -> Dict[int, float]:
+        """与查询共享特征的词 → 相关度 (0, 1]"""
+        q = re.sub(r"\s+", "", query or "").lower()
+        qk = _keys(q)
+        lists = [self._post[k] for k in qk if k in self._post]
+        if not lists:
+            return {}
+        # 交集大小 = 该词在几条查询特征的倒排里出现；整段向量化，只对少数候选做字符串比较
+        ids, inter = np.unique(np.concatenate(lists), return_counts=True)
+        nk = self._nkeys[ids]
+        rel = inter / (len(qk) + nk - inter)
+        # 包含关系（“加速踏板” ⊂ “加速踏板位置传感器”）：必要条件是一方的特征全在交集里
+        for j in np.nonzero((inter == len(qk)) | (inter == nk))[0].tolist():
+            t = self._lower[ids[j]]
+            if q in t or t in q:
+                rel[j] = max(rel[j], 0.5 + 0.5 * min(len(q), len(t)) / max(len(q), len(t)))
+        # 拉丁词允许拼写/OCR 误差：编辑距离只在长度接近时算
+        for w in (w for w in _LATIN.findall(q) if len(w) >= 2):
+            near = np.nonzero(self._latin[ids] & (np.abs(self._len[ids] - len(w)) <= 2))[0]
+            for j in near.tolist():
+                t = self._lower[ids[j]]
+                rel[j] = max(rel[j], 1 - _lev(w, t) / max(len(w), len(t)))
+        keep = np.nonzero(rel >= MIN_REL)[0]
+        return dict(zip(ids[keep].tolist(), rel[keep].tolist()))
+
+    def select(self, query: str, limit: int = VOCAB_LIMIT) -> List[str]:
+        rel = self.relevance(query)
+        ranked = sorted(rel, key=lambda i: (-rel[i] * self.weight[i], self.terms[i]))
+        ids, per_shape = [], {}
+        # 只差编号的变体（“制动灯开关8 / 制动灯开关46”）每种形状最多留 SHAPE_MAX 个，把名额让给不同的词
+        for i in itertools.chain(ranked, (i for i in self._popular if i not in rel)):
+            if len(ids) >= limit:
+                break
+            shape = _SHAPE.sub("", self._lower[i])
+            if per_shape.get(shape, 0) >= SHAPE_MAX:
+                continue
+            per_shape[shape] = per_shape.get(shape, 0) + 1
+            ids.append(i)
+        return [self.terms[i] for i in ids]
+
+    def stats(self) -> Dict:
+        return {"terms": len(self.terms),
+                "classes": {c: int((self.cls == k).sum()) for k, c in enumerate(CLASSES)},
+                "salient": int(self.salient.sum())}
+
+# ---------------- 打开 / 更新 ----------------
+_cache: "OrderedDict[str, VocabIndex]" = OrderedDict()
+_lock = threading.Lock()
+
+def _remember(path: Path, ix: VocabIndex):
+    _cache[str(path)] = ix
+    _cache.move_to_end(str(path))
+    while len(_cache) > VOCAB_LRU:
+        _cache.popitem(last=False)
+
+def update(doc_root: Path, dpi: int, book: Optional[ocr_book.OcrBook] = None) -> Optional[VocabIndex]:
+    """OCR 完成后调用；整本未变（ETag 相同）时不重建"""
+    book = book or ocr_book.open_book(doc_root, dpi)
+    if book is None:
+        return None
+    path = vocab_path(doc_root, dpi)
+    with _lock:
+        ix = _cache.get(str(path)) or (VocabIndex.load(path) if path.exists() else None)
+        if ix is None or ix.etag != book.etag():
+            ix = VocabIndex.build(book)
+            ix.save(path)
+        _remember(path, ix)
+        return ix
+
+def open_vocab(doc_root: Path, dpi: int) -> Optional[VocabIndex]:
+    book = ocr_book.open_book(doc_root, dpi)
+    if book is None:
+        return None
+    path = vocab_path(doc_root, dpi)
+    with _lock:
+        ix = _cache.get(str(path))
+        if ix is not None and ix.etag == book.etag():
+            _cache.move_to_end(str(path))
+            return ix
+    return update(doc_root, dpi, book)